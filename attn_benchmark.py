@@ -0,0 +1,153 @@
+import argparse
+import logging
+import os
+import time
+
+import pandas as pd
+import torch
+
+from sonics.layers.transformer import (
+    ATTN_BACKENDS,
+    Transformer,
+    sdpa_kernel_unavailable,
+)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark softmax (per SDPA kernel) vs linear attention against "
+        "token count"
+    )
+    parser.add_argument("--embed_dim", type=int, default=384, help="Token dimension")
+    parser.add_argument("--num_heads", type=int, default=6, help="Attention heads")
+    parser.add_argument("--num_layers", type=int, default=12, help="Transformer blocks")
+    parser.add_argument(
+        "--num_tokens",
+        type=int,
+        nargs="+",
+        # 5s / 120s f1t3 SpecTTTra, then up to a ~6 min song
+        default=[170, 1290, 2500, 5000, 10000],
+        help="Sequence lengths to benchmark",
+    )
+    parser.add_argument(
+        "--attn_backends",
+        type=str,
+        nargs="+",
+        default=["auto"],
+        choices=ATTN_BACKENDS,
+        help="SDPA kernels of softmax attention to benchmark",
+    )
+    parser.add_argument("--batch_size", type=int, default=1, help="Batch size")
+    parser.add_argument("--num_runs", type=int, default=10, help="Timed runs")
+    parser.add_argument(
+        "--output", type=str, default="output/attn_benchmark.csv", help="Result CSV"
+    )
+    return parser.parse_args()
+
+
+def read_rss(field):
+    """
+    Resident memory of this process in bytes from /proc: "VmRSS" (current) or "VmHWM"
+    (peak since the last `reset_peak_rss`). Linux only.
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) * 1024  # kB
+    raise OSError(f"{field} not found in /proc/self/status")
+
+
+def reset_peak_rss():
+    """
+    Resets VmHWM to the current RSS (Linux >= 4.0).
+    """
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def benchmark(model, x, num_runs, warmup_runs=2):
+    """
+    Returns (latency in seconds, peak memory in GB) of an inference forward pass. On
+    CPU, memory is the peak RSS growth during the timed runs (NaN outside Linux).
+    """
+    with torch.no_grad():
+        for _ in range(warmup_runs):
+            model(x)
+
+        if x.is_cuda:
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            start_memory = torch.cuda.max_memory_allocated()
+        else:
+            try:
+                reset_peak_rss()
+                start_memory = read_rss("VmRSS")
+            except OSError:
+                start_memory = None
+
+        start = time.perf_counter()
+        for _ in range(num_runs):
+            model(x)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+        latency = (time.perf_counter() - start) / num_runs
+
+    if x.is_cuda:
+        memory = (torch.cuda.max_memory_allocated() - start_memory) / (1024**3)
+    elif start_memory is not None:
+        memory = (read_rss("VmHWM") - start_memory) / (1024**3)
+    else:
+        memory = float("nan")
+    return latency, memory
+
+
+def main():
+    args = arg_parser()
+    logging.basicConfig(level=logging.INFO, format="> %(message)s")  # "benchmark" picks
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    print(f"> Using device: {device}")
+
+    results = []
+    settings = [("softmax", backend) for backend in args.attn_backends]
+    settings.append(("linear", "auto"))
+    for attn_type, attn_backend in settings:
+        model = Transformer(
+            args.embed_dim,
+            args.num_heads,
+            args.num_layers,
+            attn_type=attn_type,
+            attn_backend=attn_backend,
+        )
+        model.to(device).eval()
+        for num_tokens in args.num_tokens:
+            x = torch.randn(args.batch_size, num_tokens, args.embed_dim, device=device)
+            try:
+                latency, memory = benchmark(model, x, args.num_runs)
+            except torch.cuda.OutOfMemoryError:
+                latency, memory = float("nan"), float("nan")
+                torch.cuda.empty_cache()
+            except RuntimeError as e:
+                if not sdpa_kernel_unavailable(e):
+                    raise
+                latency, memory = float("nan"), float("nan")
+            results.append(
+                {
+                    "attn_type": attn_type,
+                    "attn_backend": attn_backend,
+                    "num_tokens": num_tokens,
+                    "latency (s)": latency,
+                    "memory (GB)": memory,
+                }
+            )
+            print(results[-1])
+
+    result_df = pd.DataFrame(results)
+    print(result_df.to_markdown(index=False, tablefmt="grid"))
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    result_df.to_csv(args.output, index=False)
+    print(f"> Benchmark results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import time
+
+import yaml
+import torch
+
+from sonics.models.export import ExportModel, freeze_model
+from sonics.models.hf_model import HFAudioClassifier
+from sonics.models.compress import decompress_state_dict
+from sonics.models.model import AudioClassifier
+from sonics.utils.config import dict2cfg
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Freeze a model into a TorchScript inference artifact"
+    )
+    parser.add_argument(
+        "--model_id", type=str, default=None, help="HF Hub repo ID or local directory"
+    )
+    parser.add_argument("--config", type=str, default=None, help="Path to config file")
+    parser.add_argument(
+        "--ckpt_path", type=str, default=None, help="Path to checkpoint file"
+    )
+    parser.add_argument("--output", type=str, required=True, help="Output .pt file")
+    parser.add_argument(
+        "--no_frontend",
+        action="store_true",
+        help="Freeze spectrogram -> logits instead of waveform -> logits",
+    )
+    parser.add_argument(
+        "--resize",
+        action="store_true",
+        help="Keep the bilinear resize when the frontend doesn't match input_shape",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = arg_parser()
+
+    # Load model
+    if args.model_id is not None:
+        model = HFAudioClassifier.from_pretrained(args.model_id)
+    else:
+        cfg = dict2cfg(yaml.safe_load(open(args.config).read()))
+        model = AudioClassifier(cfg)
+        checkpoint = torch.load(args.ckpt_path, map_location="cpu")
+        model.load_state_dict(decompress_state_dict(checkpoint["model"]))
+    model.cpu().eval()
+
+    # Freeze and save
+    frozen = freeze_model(
+        model, args.output, frontend=not args.no_frontend, resize=args.resize
+    )
+    print(f"> Saved frozen model to {args.output}")
+
+    # Check against the eager model
+    if args.no_frontend:
+        x = torch.randn(2, *model.cfg.model.input_shape)
+    else:
+        x = torch.randn(2, model.cfg.audio.max_len)
+    with torch.no_grad():
+        expected = ExportModel(model, frontend=False)(x) if args.no_frontend else model(x)
+        start = time.time()
+        loaded = torch.jit.load(args.output)
+        print(f"> Load time: {time.time() - start:.2f}s")
+        diff = (loaded(x) - expected).abs().max().item()
+    print(f"> Max abs logit difference vs eager: {diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import logging
+import os
+import warnings
+
+import pandas as pd
+import yaml
+
+import torch
+from timm.optim import create_optimizer_v2, optimizer_kwargs
+
+from sonics.models.compress import decompress_state_dict
+from sonics.models.lowrank import factorize_transformer
+from sonics.models.model import AudioClassifier
+from sonics.utils.config import cfg2dict, dict2cfg
+from sonics.utils.losses import BCEWithLogitsLoss
+from sonics.utils.seed import set_seed
+
+# Import the train loop and the evaluation helpers shared with pruning
+from train import GradScaler, torch_amp_new, train_loop
+from model_prune import evaluate, get_loader
+
+warnings.filterwarnings("ignore", category=UserWarning)
+logging.getLogger("fvcore").setLevel(logging.ERROR)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Low-rank (SVD) factorization of Transformer projections: "
+        "FLOPs/latency vs validation F1"
+    )
+    parser.add_argument("--config", type=str, required=True, help="Path to config file")
+    parser.add_argument(
+        "--ckpt_path", type=str, required=True, help="Path to checkpoint file"
+    )
+    parser.add_argument(
+        "--energy",
+        type=float,
+        default=0.9,
+        help="Fraction of each weight's spectral energy kept by the truncated SVD",
+    )
+    parser.add_argument(
+        "--finetune_epochs",
+        type=int,
+        default=0,
+        help="Fine-tuning epochs after factorization",
+    )
+    parser.add_argument(
+        "--finetune_lr", type=float, default=1e-4, help="Fine-tuning learning rate"
+    )
+    parser.add_argument(
+        "--num_valid",
+        type=int,
+        default=None,
+        help="Number of validation songs to score (default: all)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    # Parse arguments
+    args = arg_parser()
+    dict_ = yaml.safe_load(open(args.config).read())
+    cfg = dict2cfg(dict_)
+    print(cfg)
+
+    # Set seed
+    set_seed(cfg.environment.seed)
+
+    # Set up device
+    if not torch.cuda.is_available():
+        print("> Using CPU, this will be slow")
+        device = torch.device("cpu")
+    else:
+        device = torch.device("cuda:0")
+        print(f"> Using GPU: {device}")
+
+    # Load data
+    valid_df = pd.read_csv(cfg.dataset.valid_dataframe)
+    valid_df = valid_df.sample(frac=1.0, random_state=cfg.environment.seed).reset_index(
+        drop=True
+    )
+    if args.num_valid is not None:
+        valid_df = valid_df[: args.num_valid]
+    valid_dataloader = get_loader(cfg, valid_df)
+
+    # Load model
+    model = AudioClassifier(cfg)
+    if "timm" in model.model_name:
+        raise ValueError("Low-rank factorization is only supported for SpecTTTra and ViT")
+    model.to(device)
+    checkpoint = torch.load(args.ckpt_path, map_location=device)
+    model.load_state_dict(decompress_state_dict(checkpoint["model"]))
+    print(f"> Loaded checkpoint from {args.ckpt_path}")
+
+    criterion = BCEWithLogitsLoss(label_smoothing=0.0)
+    results = [evaluate(model, valid_dataloader, criterion, device, cfg, "dense")]
+
+    # Replace qkv/proj/fc1/fc2 with their truncated SVD
+    print(f"\n> Factorizing projections keeping {args.energy:.0%} of the energy")
+    layer_ranks = factorize_transformer(model.encoder.transformer, energy=args.energy)
+    cfg.model.layer_ranks = layer_ranks
+    print(f"> layer_ranks [qkv, proj, fc1, fc2] (0 = full rank): {layer_ranks}")
+    results.append(evaluate(model, valid_dataloader, criterion, device, cfg, "lowrank"))
+
+    # Optionally recover accuracy with a short fine-tune
+    if args.finetune_epochs:
+        train_df = pd.read_csv(cfg.dataset.train_dataframe)
+        train_dataloader = get_loader(cfg, train_df, train=True)
+        # Override the lr for the fine-tune only, the saved config keeps the original
+        opt_kwargs = {**optimizer_kwargs(cfg.optimizer), "lr": args.finetune_lr}
+        optimizer = create_optimizer_v2(model.parameters(), **opt_kwargs)
+        scaler = (
+            (GradScaler("cuda") if torch_amp_new else GradScaler())
+            if cfg.environment.mixed_precision
+            else None
+        )
+        for epoch in range(args.finetune_epochs):
+            print(f"FINE-TUNE EPOCH: {epoch+1}/{args.finetune_epochs}")
+            train_loop(
+                model, train_dataloader, criterion, optimizer, scaler, device, cfg
+            )
+        results.append(
+            evaluate(model, valid_dataloader, criterion, device, cfg, "lowrank+ft")
+        )
+
+    result_df = pd.DataFrame(results)
+    base = result_df.iloc[0]
+    result_df["FLOPs saved"] = 1 - result_df["FLOPs (G)"] / base["FLOPs (G)"]
+    result_df["speedup"] = result_df["speed (A/S)"] / base["speed (A/S)"]
+    result_df["f1_change"] = result_df.f1 - base.f1
+    print("\n> Low-Rank Results:")
+    print(result_df.to_markdown(index=False, tablefmt="grid"))
+
+    # Save the factorized checkpoint with the config that builds its shapes
+    output_dir = f"output/{cfg.experiment_name}"
+    os.makedirs(output_dir, exist_ok=True)
+    torch.save(
+        {"model": model.state_dict(), "layer_ranks": layer_ranks},
+        f"{output_dir}/lowrank_checkpoint.pth",
+    )
+    with open(f"{output_dir}/lowrank_config.yaml", "w") as f:
+        yaml.safe_dump(cfg2dict(cfg), f, sort_keys=False)
+    result_df.to_csv(f"{output_dir}/lowrank.csv", index=False)
+    print(
+        f"> Low-rank checkpoint saved to {output_dir}/lowrank_checkpoint.pth, load it "
+        f"with {output_dir}/lowrank_config.yaml"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,9 @@ import os
 import yaml
 import torch
 import pandas as pd
-from sonics.models.model import AudioClassifier
-from sonics.utils.perf import profile_model
+from sonics.models.model import AudioClassifier, get_example_input
+from sonics.utils.config import dict2cfg
+from sonics.utils.perf import fused_layer_report, profile_model
 from sonics.utils.seed import set_seed
 
 
@@ -14,6 +15,11 @@ def arg_parser():
     parser.add_argument(
         "--batch_size", type=int, default=12, help="Batch size for profiling"
     )
+    parser.add_argument(
+        "--channels_last",
+        action="store_true",
+        help="Also profile the timm encoder in channels-last memory format",
+    )
     return parser.parse_args()
 
 
@@ -41,12 +47,27 @@ def main():
     print("> Loading model...")
     model = AudioClassifier(cfg)
     model.to(device)
+    if args.channels_last:
+        model.set_channels_last(False)  # contiguous baseline first
 
     # Profile model
     print("> Model Profile:")
-    input_tensor = torch.randn((args.batch_size, cfg.audio.max_len)).to(device)
+    input_tensor = get_example_input(cfg, args.batch_size).to(device)
     profile_df = profile_model(model, input_tensor, display=True)
 
+    # Compare against channels-last on the same weights
+    if args.channels_last:
+        print("\n> Fused Layers:")
+        fused_layer_report(display=True)
+        torch.backends.cudnn.benchmark = True
+        model.set_channels_last(True)
+        print("> Model Profile (channels-last):")
+        cl_profile_df = profile_model(model, input_tensor, display=True)
+        profile_df = pd.concat([profile_df, cl_profile_df], ignore_index=True)
+        profile_df.insert(0, "Memory Format", ["contiguous", "channels_last"])
+        profile_df["Speedup"] = profile_df["Speed (A/S)"] / profile_df["Speed (A/S)"][0]
+        print(profile_df.to_markdown(index=False, tablefmt="grid"))
+
     # Save profile results
     os.makedirs(f"output/{cfg.experiment_name}", exist_ok=True)
     profile_df.to_csv(f"output/{cfg.experiment_name}/model_profile.csv", index=False)
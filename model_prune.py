@@ -0,0 +1,202 @@
+import argparse
+import logging
+import os
+import warnings
+
+import pandas as pd
+import yaml
+
+import torch
+from timm.optim import create_optimizer_v2, optimizer_kwargs
+
+from sonics.layers.feature import WorkerFeatureExtractor
+from sonics.models.compress import decompress_state_dict
+from sonics.models.model import AudioClassifier, get_example_input
+from sonics.models.prune import importance_scores, prune_transformer
+from sonics.utils.config import cfg2dict, dict2cfg
+from sonics.utils.dataset import get_dataloader
+from sonics.utils.losses import BCEWithLogitsLoss
+from sonics.utils.perf import calculate_flops, calculate_speed
+from sonics.utils.seed import set_seed, worker_init_fn
+
+# Import the train/valid loops from the training script
+from train import GradScaler, torch_amp_new, train_loop, valid_loop
+
+warnings.filterwarnings("ignore", category=UserWarning)
+logging.getLogger("fvcore").setLevel(logging.ERROR)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Prune attention heads and MLP channels: latency vs validation F1"
+    )
+    parser.add_argument("--config", type=str, required=True, help="Path to config file")
+    parser.add_argument(
+        "--ckpt_path", type=str, required=True, help="Path to checkpoint file"
+    )
+    parser.add_argument(
+        "--head_ratio", type=float, default=0.25, help="Fraction of heads removed"
+    )
+    parser.add_argument(
+        "--mlp_ratio", type=float, default=0.25, help="Fraction of MLP channels removed"
+    )
+    parser.add_argument(
+        "--num_batches", type=int, default=16, help="Validation batches for scoring"
+    )
+    parser.add_argument(
+        "--finetune_epochs", type=int, default=0, help="Fine-tuning epochs after pruning"
+    )
+    parser.add_argument(
+        "--finetune_lr", type=float, default=1e-4, help="Fine-tuning learning rate"
+    )
+    parser.add_argument(
+        "--num_valid",
+        type=int,
+        default=None,
+        help="Number of validation songs to score (default: all)",
+    )
+    return parser.parse_args()
+
+
+def get_loader(cfg, df, train=False):
+    return get_dataloader(
+        df.filepath.tolist(),
+        df.target.tolist(),
+        skip_times=df.skip_time.tolist() if cfg.audio.skip_time else None,
+        max_len=cfg.audio.max_len,
+        batch_size=cfg.training.batch_size if train else cfg.validation.batch_size,
+        num_classes=cfg.num_classes,
+        train=train,
+        random_sampling=cfg.audio.random_sampling if train else False,
+        num_workers=cfg.environment.num_workers,
+        worker_init_fn=worker_init_fn,
+        collate_fn=None,
+        distributed=False,
+        transform=(
+            WorkerFeatureExtractor(cfg)
+            if getattr(cfg.melspec, "placement", "model") == "worker"
+            else None
+        ),
+        return_length=getattr(cfg.model, "padding_mask", False) and not train,
+    )
+
+
+def evaluate(model, valid_dataloader, criterion, device, cfg, name):
+    input_tensor = get_example_input(cfg, 1).to(device)
+    flops = calculate_flops(model, input_tensor)
+    speed = calculate_speed(model, input_tensor)
+    _, acc, f1, sens, spec, _ = valid_loop(
+        model, valid_dataloader, criterion, device, cfg, desc=name
+    )
+    return {
+        "model": name,
+        "params (M)": sum(p.numel() for p in model.parameters()) / 1e6,
+        "FLOPs (G)": flops,
+        "latency (ms)": 1000 / speed,
+        "speed (A/S)": speed,
+        "acc": acc,
+        "f1": f1,
+        "sens": sens,
+        "spec": spec,
+    }
+
+
+def main():
+    # Parse arguments
+    args = arg_parser()
+    dict_ = yaml.safe_load(open(args.config).read())
+    cfg = dict2cfg(dict_)
+    print(cfg)
+
+    # Set seed
+    set_seed(cfg.environment.seed)
+
+    # Set up device
+    if not torch.cuda.is_available():
+        print("> Using CPU, this will be slow")
+        device = torch.device("cpu")
+    else:
+        device = torch.device("cuda:0")
+        print(f"> Using GPU: {device}")
+
+    # Load data
+    valid_df = pd.read_csv(cfg.dataset.valid_dataframe)
+    valid_df = valid_df.sample(frac=1.0, random_state=cfg.environment.seed).reset_index(
+        drop=True
+    )
+    if args.num_valid is not None:
+        valid_df = valid_df[: args.num_valid]
+    valid_dataloader = get_loader(cfg, valid_df)
+
+    # Load model
+    model = AudioClassifier(cfg)
+    model.to(device)
+    checkpoint = torch.load(args.ckpt_path, map_location=device)
+    model.load_state_dict(decompress_state_dict(checkpoint["model"]))
+    print(f"> Loaded checkpoint from {args.ckpt_path}")
+
+    criterion = BCEWithLogitsLoss(label_smoothing=0.0)
+    results = [evaluate(model, valid_dataloader, criterion, device, cfg, "dense")]
+
+    # Score heads/channels on a validation subset and remove the weakest ones
+    print("\n> Scoring heads and MLP channels")
+    head_scores, mlp_scores = importance_scores(
+        model, valid_dataloader, device, num_batches=args.num_batches
+    )
+    layer_dims = prune_transformer(
+        model.encoder.transformer,
+        head_scores,
+        mlp_scores,
+        head_ratio=args.head_ratio,
+        mlp_ratio=args.mlp_ratio,
+    )
+    cfg.model.layer_dims = layer_dims
+    print(f"> Pruned layer_dims [num_heads, mlp_hidden_dim]: {layer_dims}")
+    results.append(evaluate(model, valid_dataloader, criterion, device, cfg, "pruned"))
+
+    # Optionally recover accuracy with a short fine-tune
+    if args.finetune_epochs:
+        train_df = pd.read_csv(cfg.dataset.train_dataframe)
+        train_dataloader = get_loader(cfg, train_df, train=True)
+        # Override the lr for the fine-tune only, the saved config keeps the original
+        opt_kwargs = {**optimizer_kwargs(cfg.optimizer), "lr": args.finetune_lr}
+        optimizer = create_optimizer_v2(model.parameters(), **opt_kwargs)
+        scaler = (
+            (GradScaler("cuda") if torch_amp_new else GradScaler())
+            if cfg.environment.mixed_precision
+            else None
+        )
+        for epoch in range(args.finetune_epochs):
+            print(f"FINE-TUNE EPOCH: {epoch+1}/{args.finetune_epochs}")
+            train_loop(
+                model, train_dataloader, criterion, optimizer, scaler, device, cfg
+            )
+        results.append(
+            evaluate(model, valid_dataloader, criterion, device, cfg, "pruned+ft")
+        )
+
+    result_df = pd.DataFrame(results)
+    base = result_df.iloc[0]
+    result_df["speedup"] = result_df["speed (A/S)"] / base["speed (A/S)"]
+    result_df["f1_change"] = result_df.f1 - base.f1
+    print("\n> Pruning Results:")
+    print(result_df.to_markdown(index=False, tablefmt="grid"))
+
+    # Save the pruned checkpoint with the config that builds its shapes
+    output_dir = f"output/{cfg.experiment_name}"
+    os.makedirs(output_dir, exist_ok=True)
+    torch.save(
+        {"model": model.state_dict(), "layer_dims": layer_dims},
+        f"{output_dir}/pruned_checkpoint.pth",
+    )
+    with open(f"{output_dir}/pruned_config.yaml", "w") as f:
+        yaml.safe_dump(cfg2dict(cfg), f, sort_keys=False)
+    result_df.to_csv(f"{output_dir}/pruning.csv", index=False)
+    print(
+        f"> Pruned checkpoint saved to {output_dir}/pruned_checkpoint.pth, load it "
+        f"with {output_dir}/pruned_config.yaml"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import argparse
+import io
+import logging
+import os
+import warnings
+
+import pandas as pd
+import yaml
+
+import torch
+
+from sonics.layers.feature import WorkerFeatureExtractor
+from sonics.models.compress import decompress_state_dict
+from sonics.models.model import AudioClassifier, get_example_input
+from sonics.models.quantize import quantize_model
+from sonics.utils.config import dict2cfg
+from sonics.utils.dataset import get_dataloader
+from sonics.utils.losses import BCEWithLogitsLoss
+from sonics.utils.perf import calculate_speed
+from sonics.utils.seed import set_seed, worker_init_fn
+
+# Import the valid_loop function from the training script
+from train import valid_loop
+
+warnings.filterwarnings("ignore", category=UserWarning)
+logging.getLogger("fvcore").setLevel(logging.ERROR)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Quantize a model to int8 and compare it with fp32 on CPU"
+    )
+    parser.add_argument("--config", type=str, required=True, help="Path to config file")
+    parser.add_argument(
+        "--ckpt_path", type=str, required=True, help="Path to checkpoint file"
+    )
+    parser.add_argument(
+        "--static",
+        action="store_true",
+        help="Also statically quantize the tokenizer convs (SpecTTTra/ViT)",
+    )
+    parser.add_argument(
+        "--num_calib", type=int, default=8, help="Validation batches for calibration"
+    )
+    parser.add_argument(
+        "--num_valid",
+        type=int,
+        default=None,
+        help="Number of validation songs to score (default: all)",
+    )
+    parser.add_argument(
+        "--backend", type=str, default="x86", help="Quantized engine (x86, qnnpack)"
+    )
+    return parser.parse_args()
+
+
+def model_size(model):
+    """
+    Size of the serialized state_dict in MB.
+    """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024**2
+
+
+def main():
+    # Parse arguments
+    args = arg_parser()
+    dict_ = yaml.safe_load(open(args.config).read())
+    cfg = dict2cfg(dict_)
+    cfg.environment.mixed_precision = False  # int8 kernels run on CPU, in float32 I/O
+    print(cfg)
+
+    # Set seed
+    set_seed(cfg.environment.seed)
+    device = torch.device("cpu")
+
+    # Load validation data
+    valid_df = pd.read_csv(cfg.dataset.valid_dataframe)
+    valid_df = valid_df.sample(frac=1.0, random_state=cfg.environment.seed).reset_index(
+        drop=True
+    )
+    if args.num_valid is not None:
+        valid_df = valid_df[: args.num_valid]
+
+    valid_dataloader = get_dataloader(
+        valid_df.filepath.tolist(),
+        valid_df.target.tolist(),
+        skip_times=valid_df.skip_time.tolist() if cfg.audio.skip_time else None,
+        max_len=cfg.audio.max_len,
+        batch_size=cfg.validation.batch_size,
+        num_classes=cfg.num_classes,
+        train=False,
+        random_sampling=False,
+        num_workers=cfg.environment.num_workers,
+        worker_init_fn=worker_init_fn,
+        collate_fn=None,
+        distributed=False,
+        transform=(
+            WorkerFeatureExtractor(cfg)
+            if getattr(cfg.melspec, "placement", "model") == "worker"
+            else None
+        ),
+    )
+
+    # Load model
+    model = AudioClassifier(cfg)
+    checkpoint = torch.load(args.ckpt_path, map_location=device)
+    model.load_state_dict(decompress_state_dict(checkpoint["model"]))
+    model.eval()
+    print(f"> Loaded checkpoint from {args.ckpt_path}")
+
+    # Quantize
+    variants = {"fp32": model, "int8-dynamic": quantize_model(model, backend=args.backend)}
+    if args.static:
+        calib_batches = []
+        for step, batch in enumerate(valid_dataloader):
+            if step >= args.num_calib:
+                break
+            calib_batches.append(batch["audio"])
+        variants["int8-static+dynamic"] = quantize_model(
+            model, calib_batches=calib_batches, backend=args.backend
+        )
+
+    # Evaluate every variant with the metrics of `valid_loop`
+    criterion = BCEWithLogitsLoss(label_smoothing=0.0)
+    # int8 kernels run on CPU, so the speed is timed on CPU even when a GPU is present
+    input_tensor = get_example_input(cfg, 1).to(device)
+    results = []
+    for name, variant in variants.items():
+        print(f"\n> {name}")
+        _, acc, f1, sens, spec, _ = valid_loop(
+            variant, valid_dataloader, criterion, device, cfg, desc=name
+        )
+        results.append(
+            {
+                "variant": name,
+                "size (MB)": model_size(variant),
+                "speed (A/S)": calculate_speed(variant, input_tensor, num_runs=10),
+                "acc": acc,
+                "f1": f1,
+                "sens": sens,
+                "spec": spec,
+            }
+        )
+
+    result_df = pd.DataFrame(results)
+    for metric in ["f1", "sens", "spec"]:
+        result_df[f"{metric}_delta"] = result_df[metric] - result_df[metric].iloc[0]
+    print("\n> Quantization Results:")
+    print(result_df.to_markdown(index=False, tablefmt="grid"))
+
+    # Save quantized models and results
+    os.makedirs(f"output/{cfg.experiment_name}", exist_ok=True)
+    for name, variant in variants.items():
+        if name != "fp32":
+            torch.save(variant, f"output/{cfg.experiment_name}/model_{name}.pt")
+    result_df.to_csv(f"output/{cfg.experiment_name}/quantization.csv", index=False)
+    print(f"> Results saved to output/{cfg.experiment_name}/quantization.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+
+import yaml
+import torch
+
+from sonics.models.export import export_onnx, onnx_parity
+from sonics.models.hf_model import HFAudioClassifier
+from sonics.models.compress import decompress_state_dict
+from sonics.models.model import AudioClassifier
+from sonics.utils.config import dict2cfg
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(description="Export a model to ONNX")
+    parser.add_argument(
+        "--model_id", type=str, default=None, help="HF Hub repo ID or local directory"
+    )
+    parser.add_argument("--config", type=str, default=None, help="Path to config file")
+    parser.add_argument(
+        "--ckpt_path", type=str, default=None, help="Path to checkpoint file"
+    )
+    parser.add_argument(
+        "--output", type=str, required=True, help="Directory for model.onnx"
+    )
+    parser.add_argument(
+        "--no_frontend",
+        action="store_true",
+        help="Export spectrogram -> logits, the engine computes log-mel with NumPy",
+    )
+    parser.add_argument(
+        "--resize",
+        action="store_true",
+        help="Keep the bilinear resize when the frontend doesn't match input_shape",
+    )
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version")
+    return parser.parse_args()
+
+
+def main():
+    args = arg_parser()
+
+    # Load model
+    if args.model_id is not None:
+        model = HFAudioClassifier.from_pretrained(args.model_id)
+    else:
+        cfg = dict2cfg(yaml.safe_load(open(args.config).read()))
+        model = AudioClassifier(cfg)
+        checkpoint = torch.load(args.ckpt_path, map_location="cpu")
+        model.load_state_dict(decompress_state_dict(checkpoint["model"]))
+    model.eval()
+
+    # Export and check the exported graph against PyTorch
+    model_path = export_onnx(
+        model,
+        args.output,
+        frontend=not args.no_frontend,
+        opset_version=args.opset,
+        resize=args.resize,
+    )
+    print(f"> Exported ONNX model to {model_path}")
+    diff = onnx_parity(model, args.output)
+    print(f"> Max abs probability difference vs PyTorch: {diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
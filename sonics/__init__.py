@@ -1,5 +1,17 @@
-from sonics.utils.seed import set_seed
-from sonics.utils.config import dict2cfg
-from sonics.utils.dataset import get_dataloader
-from sonics.utils.scheduler import get_scheduler
-from sonics.models.hf_model import HFAudioClassifier
+# Imported lazily, so torch-free modules (e.g. `sonics.utils.onnx_engine`) can be used
+# on hosts without torch
+_LAZY_IMPORTS = {
+    "set_seed": "sonics.utils.seed",
+    "dict2cfg": "sonics.utils.config",
+    "get_dataloader": "sonics.utils.dataset",
+    "get_scheduler": "sonics.utils.scheduler",
+    "HFAudioClassifier": "sonics.models.hf_model",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        import importlib
+
+        return getattr(importlib.import_module(_LAZY_IMPORTS[name]), name)
+    raise AttributeError(f"module 'sonics' has no attribute {name!r}")
@@ -1,4 +1,4 @@
-from sonics.layers.tokenizer import Tokenizer1D, STTokenizer
+from sonics.layers.tokenizer import Tokenizer1D, STTokenizer, FusedSTTokenizer
 from sonics.layers.embedding import (
     SinusoidPositionalEncoding,
     LearnedPositionalEncoding,
@@ -81,7 +81,9 @@ class MixUp(torch.nn.Module):
         """
         Args:
             batch (Tensor): Float tensor of size (B, C, H, W)
-            target (Tensor): Integer tensor of size (B, )
+            target (Tensor): Integer tensor of size (B, ), or for binary targets a float
+                tensor of size (B, K) stacking targets mixed with the same lambda
+                (e.g. labels and teacher soft targets)
 
         Returns:
             Tensor: Randomly transformed batch.
@@ -90,7 +92,7 @@ class MixUp(torch.nn.Module):
             raise ValueError(
                 f"Batch ndim should be 3 (b, f, t) or 2 (b, n). Got {batch.ndim}"
             )
-        if target.ndim != 1:
+        if target.ndim != 1 and not (target.ndim == 2 and self.num_classes == 1):
             raise ValueError(f"Target ndim should be 1. Got {target.ndim}")
         if not batch.is_floating_point():
             raise TypeError(f"Batch dtype should be a float tensor. Got {batch.dtype}.")
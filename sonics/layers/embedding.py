@@ -1,25 +1,45 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+
+
+def sinusoid_table(max_len, token_dim):
+    """
+    Sinusoidal positional table of shape (1, max_len, token_dim).
+    """
+    pe = torch.zeros(max_len, token_dim)  # shape: (max_len, token_dim)
+    position = torch.arange(0, max_len, dtype=torch.float).unsqueeze(
+        1
+    )  # shape: (max_len, 1)
+    div_term = torch.exp(
+        torch.arange(0, token_dim, 2).float()
+        * (-torch.log(torch.tensor(10000.0)) / token_dim)
+    )  # shape: (token_dim // 2)
+    pe[:, 0::2] = torch.sin(position * div_term)  # shape: (max_len, token_dim // 2)
+    pe[:, 1::2] = torch.cos(position * div_term)  # shape: (max_len, token_dim // 2)
+    return pe.unsqueeze(0)  # shape: (1, max_len, token_dim)
 
 
 class SinusoidPositionalEncoding(nn.Module):
     def __init__(self, token_dim, max_len=5000):
         super(SinusoidPositionalEncoding, self).__init__()
-        pe = torch.zeros(max_len, token_dim)  # shape: (max_len, token_dim)
-        position = torch.arange(0, max_len, dtype=torch.float).unsqueeze(
-            1
-        )  # shape: (max_len, 1)
-        div_term = torch.exp(
-            torch.arange(0, token_dim, 2).float()
-            * (-torch.log(torch.tensor(10000.0)) / token_dim)
-        )  # shape: (token_dim // 2)
-        pe[:, 0::2] = torch.sin(position * div_term)  # shape: (max_len, token_dim // 2)
-        pe[:, 1::2] = torch.cos(position * div_term)  # shape: (max_len, token_dim // 2)
-        pe = pe.unsqueeze(0)  # shape: (1, max_len, token_dim)
-        self.register_buffer("pe", pe)
+        self.token_dim = token_dim
+        self.register_buffer("pe", sinusoid_table(max_len, token_dim))
+        self.pe_ext = None  # longer table than `max_len`, kept out of the state_dict
+
+    def get_pe(self, seq_len):
+        """
+        Positional table for `seq_len` tokens, extended on demand past `max_len`.
+        """
+        if seq_len <= self.pe.size(1):
+            return self.pe[:, :seq_len, :]
+        if self.pe_ext is None or self.pe_ext.size(1) < seq_len:
+            self.pe_ext = sinusoid_table(seq_len, self.token_dim)
+        self.pe_ext = self.pe_ext.to(self.pe)
+        return self.pe_ext[:, :seq_len, :]
 
     def forward(self, x):
-        x = x + self.pe[:, : x.size(1), :]  # shape: (batch_size, seq_len, token_dim)
+        x = x + self.get_pe(x.size(1))  # shape: (batch_size, seq_len, token_dim)
         return x
 
 
@@ -27,7 +47,37 @@ class LearnedPositionalEncoding(nn.Module):
     def __init__(self, token_dim, num_tokens):
         super(LearnedPositionalEncoding, self).__init__()
         self.pe = nn.Parameter(torch.randn(1, num_tokens, token_dim) * 0.02)
+        self.pe_cache = {}  # seq_len -> resized table, only filled without autograd
+
+    def get_pe(self, seq_len):
+        """
+        Positional table for `seq_len` tokens. Other lengths than the trained one are
+        linearly interpolated from it; without autograd the result is cached per length.
+        """
+        if seq_len == self.pe.size(1):
+            return self.pe
+        if torch.is_grad_enabled():
+            return self.resize_pe(seq_len)
+
+        pe = self.pe_cache.get(seq_len)
+        if pe is None or pe.device != self.pe.device or pe.dtype != self.pe.dtype:
+            pe = self.pe_cache[seq_len] = self.resize_pe(seq_len)
+        return pe
+
+    def resize_pe(self, seq_len):
+        pe = F.interpolate(
+            self.pe.transpose(1, 2), size=seq_len, mode="linear", align_corners=True
+        )  # shape: (1, token_dim, seq_len)
+        return pe.transpose(1, 2)
+
+    def train(self, mode=True):
+        self.pe_cache.clear()  # tables go stale once `pe` is updated
+        return super().train(mode)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        self.pe_cache.clear()
+        super()._load_from_state_dict(*args, **kwargs)
 
     def forward(self, x):
-        x = x + self.pe
+        x = x + self.get_pe(x.size(1))
         return x
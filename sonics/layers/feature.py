@@ -1,6 +1,7 @@
 import torch
 import numpy as np
 import torch.nn as nn
+import torch.nn.functional as F
 
 try:
     from torch.amp import autocast
@@ -11,7 +12,62 @@ except:
 
     torch_amp_new = False
 
-from torchaudio.transforms import AmplitudeToDB, MelSpectrogram
+from sonics.utils.np_frontend import NumpyFrontend
+
+# torchaudio is imported inside `FeatureExtractor`, so the NumPy backend doesn't pay for it
+
+# Dtype of the mel projection for each `melspec.precision`, None keeps it in float32
+PRECISION_DTYPES = {"fp32": None, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+def get_feature_extractor(cfg):
+    """
+    Builds the log-mel frontend selected by `melspec.backend` ("torchaudio" or "numpy").
+    """
+    backend = getattr(cfg.melspec, "backend", "torchaudio")
+    if backend == "torchaudio":
+        return FeatureExtractor(cfg)
+    elif backend == "numpy":
+        return NumpyFeatureExtractor(cfg)
+    raise ValueError(f"Unknown melspec backend: {backend}")
+
+
+def frame_mask(lengths, n_samples, n_frames):
+    """
+    Valid frames of a zero-padded batch, with the same rounding as
+    `AudioClassifier.frame_lengths`.
+
+    Args:
+        lengths (torch.Tensor): Valid samples of each waveform, shape (batch_size,).
+        n_samples (int): Padded number of samples.
+        n_frames (int): Number of frames of the spectrogram.
+
+    Returns:
+        torch.Tensor: Boolean mask of shape (batch_size, 1, n_frames).
+    """
+    frames = (lengths.float() / n_samples * n_frames).ceil().clamp(1, n_frames)
+    return torch.arange(n_frames, device=lengths.device) < frames[:, None, None]
+
+
+def masked_amplitude_to_db(x, mask, top_db=None, amin=1e-10):
+    """
+    `AmplitudeToDB` of a power spectrogram whose top_db threshold comes from each
+    clip's own valid frames, instead of the max over the whole batch.
+
+    Args:
+        x (torch.Tensor): Power spectrogram of shape (batch_size, n_mels, n_frames).
+        mask (torch.Tensor): Valid frames of shape (batch_size, 1, n_frames).
+        top_db (float, optional): Dynamic range below the peak. Defaults to None.
+        amin (float, optional): Minimum power. Defaults to 1e-10.
+
+    Returns:
+        torch.Tensor: Spectrogram in dB.
+    """
+    x_db = 10.0 * torch.log10(x.clamp(min=amin))
+    if top_db is not None:
+        x_max = x_db.masked_fill(~mask, -torch.inf).amax(dim=(1, 2), keepdim=True)
+        x_db = torch.maximum(x_db, x_max - top_db)
+    return x_db
 
 
 class FeatureExtractor(nn.Module):
@@ -29,6 +85,7 @@ class FeatureExtractor(nn.Module):
             norm (str, optional): Normalization method. Defaults to "min_max".
         """
         super().__init__()
+        from torchaudio.transforms import AmplitudeToDB, MelSpectrogram
 
         self.audio2melspec = MelSpectrogram(
             n_fft=cfg.melspec.n_fft,
@@ -40,7 +97,25 @@ class FeatureExtractor(nn.Module):
             f_max=cfg.melspec.f_max,
             power=cfg.melspec.power,
         )
+        # Project onto the mel scale with the banded (sparse) filterbank
+        num_fb_bands = getattr(cfg.melspec, "num_fb_bands", None)
+        if num_fb_bands:
+            self.audio2melspec.mel_scale = BandedMelScale(
+                self.audio2melspec.mel_scale.fb, num_bands=num_fb_bands
+            )
         self.amplitude_to_db = AmplitudeToDB(top_db=cfg.melspec.top_db)
+        # Number of frames to keep, derived by `dict2cfg` to match `model.input_shape`.
+        # Only clips up to `max_len` are trimmed, longer ones keep all their frames.
+        self.n_frames = getattr(cfg.melspec, "n_frames", None)
+        self.max_len = cfg.audio.max_len
+        # Compute the STFT this many frames at a time to bound peak memory
+        self.chunk_frames = getattr(cfg.melspec, "chunk_frames", None)
+        # Reduced precision mel projection, gated by `check_frontend_precision`: on the
+        # spectrogram error before training, then on F1 with the trained weights
+        # (train.py, test.py) before it's relied on for evaluation
+        self.precision = getattr(cfg.melspec, "precision", "fp32")
+        if self.precision not in PRECISION_DTYPES:
+            raise ValueError(f"Unknown melspec precision: {self.precision}")
 
         if cfg.melspec.norm == "mean_std":
             self.normalizer = MeanStdNorm()
@@ -51,12 +126,16 @@ class FeatureExtractor(nn.Module):
         else:
             self.normalizer = nn.Identity()
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         """
         Forward pass of the feature extractor.
 
         Args:
             x (torch.Tensor): Input audio data.
+            lengths (torch.Tensor, optional): Valid samples of each zero-padded waveform,
+                shape (batch_size,). The top_db threshold and the normalization then use
+                each clip's valid frames only, as if it was scored alone.
+                Defaults to None.
 
         Returns:
             torch.Tensor: Extracted features.
@@ -67,12 +146,329 @@ class FeatureExtractor(nn.Module):
             if torch_amp_new
             else autocast(enabled=False)
         ):
-            melspec = self.audio2melspec(x.float())
-            melspec = self.amplitude_to_db(melspec)
-            melspec = self.normalizer(melspec)
+            melspec = self.melspectrogram(x.float())
+            if lengths is None:
+                melspec = self.amplitude_to_db(melspec)
+                melspec = self.normalizer(melspec)
+            else:
+                mask = frame_mask(lengths, x.size(-1), melspec.size(-1))
+                top_db = self.amplitude_to_db.top_db
+                melspec = masked_amplitude_to_db(melspec, mask, top_db)
+                if not isinstance(self.normalizer, nn.Identity):
+                    melspec = self.normalizer(melspec, mask)
+
+        return melspec
+
+    def melspectrogram(self, x):
+        """
+        Computes the (trimmed) power mel spectrogram, in one shot or chunked.
+
+        Args:
+            x (torch.Tensor): Input audio of shape (..., n_samples).
+
+        Returns:
+            torch.Tensor: Mel spectrogram of shape (..., n_mels, n_frames).
+        """
+        if self.chunk_frames:
+            return self.chunked_melspectrogram(x)
 
+        melspec = self.mel_scale(self.audio2melspec.spectrogram(x))
+        if self.n_frames is not None and x.size(-1) <= self.max_len:
+            melspec = melspec[..., : self.n_frames]
         return melspec
 
+    def chunked_melspectrogram(self, x):
+        """
+        Same result as `audio2melspec`, but the STFT is computed `chunk_frames` frames at a
+        time over overlapping windows of the padded signal, and each chunk's mel output is
+        written into a preallocated tensor. Only one chunk of the complex STFT is alive at
+        a time, instead of the full (B, n_freqs, n_frames) one.
+
+        Args:
+            x (torch.Tensor): Input audio of shape (..., n_samples).
+
+        Returns:
+            torch.Tensor: Mel spectrogram of shape (..., n_mels, n_frames).
+        """
+        from torchaudio.functional import spectrogram
+
+        stft = self.audio2melspec.spectrogram
+        n_fft, hop_length = stft.n_fft, stft.hop_length
+
+        shape = x.shape
+        x = x.reshape(-1, shape[-1])
+        if stft.pad > 0:
+            x = F.pad(x, (stft.pad, stft.pad), "constant")
+        num_frames = x.size(-1) // hop_length + 1  # centered STFT
+        if self.n_frames is not None and shape[-1] <= self.max_len:
+            num_frames = min(num_frames, self.n_frames)
+
+        # Pad once the way torch.stft(center=True) does, chunks then use center=False
+        if stft.center:
+            pad = n_fft // 2
+            x = F.pad(x.unsqueeze(1), (pad, pad), mode=stft.pad_mode).squeeze(1)
+        else:
+            num_frames = min(num_frames, (x.size(-1) - n_fft) // hop_length + 1)
+
+        melspec = x.new_empty(x.size(0), self.audio2melspec.n_mels, num_frames)
+        for start in range(0, num_frames, self.chunk_frames):
+            end = min(start + self.chunk_frames, num_frames)
+            # Frame j spans samples [j * hop, j * hop + n_fft) of the padded signal
+            chunk = x[:, start * hop_length : (end - 1) * hop_length + n_fft]
+            spec = spectrogram(
+                chunk,
+                pad=0,
+                window=stft.window,
+                n_fft=n_fft,
+                hop_length=hop_length,
+                win_length=stft.win_length,
+                power=stft.power,
+                normalized=stft.normalized,
+                center=False,
+                onesided=stft.onesided,
+            )  # shape: (B, n_freqs, end - start)
+            melspec[:, :, start:end] = self.mel_scale(spec)
+
+        return melspec.reshape(shape[:-1] + melspec.shape[-2:])
+
+    def mel_scale(self, spec):
+        """
+        Projects a power spectrogram onto the mel scale in `melspec.precision`. The STFT
+        and dB conversion stay in float32; only this matmul runs in bf16/fp16, which
+        accumulates in float32 on both cuBLAS and CPU backends.
+
+        Args:
+            spec (torch.Tensor): Spectrogram of shape (..., n_freqs, time).
+
+        Returns:
+            torch.Tensor: float32 mel spectrogram of shape (..., n_mels, time).
+        """
+        dtype = PRECISION_DTYPES[self.precision]
+        if dtype is None:
+            return self.audio2melspec.mel_scale(spec)
+
+        # Power spectra reach ~1e6 for n_fft=2048, past fp16's range, so project the
+        # spectrogram scaled by its peak and undo the scaling in float32
+        scale = spec.amax(dim=(-2, -1), keepdim=True).clamp_min(1e-10)
+        with (
+            autocast(spec.device.type, dtype=dtype)
+            if torch_amp_new
+            else autocast(dtype=dtype)
+        ):
+            melspec = self.audio2melspec.mel_scale(spec / scale)
+        return melspec.float() * scale
+
+
+class NumpyFeatureExtractor(nn.Module):
+    def __init__(self, cfg):
+        """
+        `FeatureExtractor` backed by `NumpyFrontend`, for CPU inference hosts that
+        shouldn't import torchaudio or librosa. Selected with `melspec.backend: "numpy"`.
+        Chunking, banded projection and reduced precision options don't apply here.
+
+        Args:
+            cfg (SimpleNamespace): Config with `audio` and `melspec` sections.
+        """
+        super().__init__()
+        self.frontend = NumpyFrontend(cfg)
+
+    def forward(self, x, lengths=None):
+        """
+        Args:
+            x (torch.Tensor): Input audio of shape (batch_size, n_samples).
+            lengths (torch.Tensor, optional): Valid samples of each zero-padded
+                waveform, see `FeatureExtractor.forward`. Defaults to None.
+
+        Returns:
+            torch.Tensor: Extracted features of shape (batch_size, n_mels, n_frames).
+        """
+        if lengths is not None:
+            lengths = lengths.detach().cpu().numpy()
+        melspec = self.frontend(x.detach().float().cpu().numpy(), lengths)
+        return torch.from_numpy(melspec).to(x.device)
+
+    # Buffers of the torchaudio `FeatureExtractor` (`BandedMelScale` keeps the name)
+    TORCHAUDIO_KEYS = ("audio2melspec.spectrogram.window", "audio2melspec.mel_scale.fb")
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # The torchaudio frontend saves its window and filterbank as buffers; they are
+        # recomputed here, so checkpoints from either backend load with strict=True.
+        # Any other key is left in and reported as unexpected.
+        for key in self.TORCHAUDIO_KEYS:
+            state_dict.pop(prefix + key, None)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+
+def frontend_parity(cfg, batch_size=2, seed=42):
+    """
+    Max absolute difference between the NumPy and torchaudio frontends on random audio.
+
+    Args:
+        cfg (SimpleNamespace): Config with `audio` and `melspec` sections.
+        batch_size (int, optional): Number of random clips. Defaults to 2.
+        seed (int, optional): Random seed. Defaults to 42.
+
+    Returns:
+        float: Max absolute difference of the normalized log-mel features.
+    """
+    audio = np.random.default_rng(seed).standard_normal(
+        (batch_size, cfg.audio.max_len), dtype=np.float32
+    )
+    with torch.no_grad():
+        expected = FeatureExtractor(cfg)(torch.from_numpy(audio)).numpy()
+    actual = NumpyFrontend(cfg)(audio)
+    return float(np.abs(actual - expected).max())
+
+
+class ExportFeatureExtractor(nn.Module):
+    def __init__(self, cfg):
+        """
+        `FeatureExtractor` written with plain torch ops for ONNX/TorchScript export, so
+        no torchaudio ops end up in the graph: `torch.stft` exports as the ONNX STFT op
+        (opset >= 17) and the mel projection as a matmul. The window and mel filterbank
+        come from `NumpyFrontend`, which matches torchaudio's.
+
+        Args:
+            cfg (SimpleNamespace): Config with `audio` and `melspec` sections.
+        """
+        super().__init__()
+        frontend = NumpyFrontend(cfg)
+        self.n_fft = frontend.n_fft
+        self.hop_length = frontend.hop_length
+        self.power = frontend.power
+        self.top_db = frontend.top_db
+        self.n_frames = frontend.n_frames
+        self.max_len = frontend.max_len
+
+        window = frontend.window.astype(np.float32)  # zero-padded to n_fft
+        self.register_buffer("window", torch.from_numpy(window))
+        self.register_buffer("fb", torch.from_numpy(frontend.fb).t().contiguous())
+
+        if cfg.melspec.norm == "mean_std":
+            self.normalizer = MeanStdNorm()
+        elif cfg.melspec.norm == "min_max":
+            self.normalizer = MinMaxNorm()
+        elif cfg.melspec.norm == "simple":
+            self.normalizer = SimpleNorm()
+        else:
+            self.normalizer = nn.Identity()
+
+    def forward(self, x):
+        """
+        Args:
+            x (torch.Tensor): Input audio of shape (batch_size, n_samples).
+
+        Returns:
+            torch.Tensor: Extracted features of shape (batch_size, n_mels, n_frames).
+        """
+        n_samples = x.size(-1)
+        pad = self.n_fft // 2
+        x = F.pad(x.float().unsqueeze(1), (pad, pad), mode="reflect").squeeze(1)
+        if self.n_frames is not None and n_samples <= self.max_len:
+            # Drop the samples of the trimmed trailing frames before the STFT
+            x = x[:, : (self.n_frames - 1) * self.hop_length + self.n_fft]
+        stft_kwargs = dict(
+            n_fft=self.n_fft,
+            hop_length=self.hop_length,
+            window=self.window,
+            center=False,  # padded above, like torchaudio's center=True
+            onesided=True,
+        )
+        if torch.onnx.is_in_onnx_export():
+            # The ONNX STFT op has no complex outputs: (B, n_freqs, T, 2)
+            spec = torch.stft(x, return_complex=False, **stft_kwargs).pow(2).sum(-1)
+        else:
+            spec = torch.stft(x, return_complex=True, **stft_kwargs).abs().pow(2)
+        if self.power != 2:
+            spec = spec.pow(self.power / 2)
+        melspec = torch.matmul(self.fb, spec)  # (n_mels, n_freqs) @ (B, n_freqs, T)
+
+        melspec = 10.0 * torch.log10(melspec.clamp(min=1e-10))
+        if self.top_db is not None:
+            # Like `AmplitudeToDB` on 3D inputs, the threshold comes from the batch max
+            top = melspec.amax(dim=(-3, -2, -1), keepdim=True)
+            melspec = torch.maximum(melspec, top - self.top_db)
+        return self.normalizer(melspec)
+
+
+class WorkerFeatureExtractor(nn.Module):
+    def __init__(self, cfg):
+        """
+        Dataset transform that runs `FeatureExtractor` (without augmentation) on a single
+        clip inside DataLoader workers, used with `melspec.placement: "worker"`.
+
+        Args:
+            cfg (SimpleNamespace): Config, `melspec.worker_dtype` sets the dtype of the
+                returned spectrogram. Defaults to "float16".
+        """
+        super().__init__()
+        self.ft_extractor = get_feature_extractor(cfg)
+        self.dtype = getattr(torch, getattr(cfg.melspec, "worker_dtype", "float16"))
+
+    @torch.no_grad()
+    def forward(self, audio):
+        """
+        Args:
+            audio (torch.Tensor): Input audio of shape (n_samples,).
+
+        Returns:
+            torch.Tensor: Spectrogram of shape (n_mels, n_frames).
+        """
+        spec = self.ft_extractor(audio.unsqueeze(0)).squeeze(0)
+        return spec.to(self.dtype)
+
+
+class BandedMelScale(nn.Module):
+    def __init__(self, fb, num_bands=8):
+        """
+        Mel projection that only multiplies the non-zero band of the filterbank.
+
+        The mel filters are split into `num_bands` contiguous groups and each group is
+        projected with a dense block covering just the frequency bins its triangles span,
+        so the output matches torchaudio's dense `MelScale` up to float rounding.
+
+        Args:
+            fb (torch.Tensor): Filterbank of shape (n_freqs, n_mels), e.g. `MelScale.fb`.
+            num_bands (int, optional): Number of mel groups. Defaults to 8.
+        """
+        super().__init__()
+        # Same buffer name as `MelScale` so existing checkpoints load unchanged
+        self.register_buffer("fb", fb.clone())
+        self.n_mels = fb.size(1)
+        self.bands = self.get_bands(fb, num_bands)
+
+    @staticmethod
+    def get_bands(fb, num_bands):
+        """
+        Returns (mel_start, mel_end, freq_start, freq_end) for every group of filters.
+        """
+        nonzero = fb > 0
+        bands = []
+        for mels in torch.arange(fb.size(1)).chunk(num_bands):
+            m0, m1 = int(mels[0]), int(mels[-1]) + 1
+            rows = nonzero[:, m0:m1].any(dim=1).nonzero().flatten()
+            if rows.numel() == 0:
+                continue  # all-zero filters stay zero
+            bands.append((m0, m1, int(rows[0]), int(rows[-1]) + 1))
+        return bands
+
+    def forward(self, specgram):
+        """
+        Args:
+            specgram (torch.Tensor): Spectrogram of shape (..., n_freqs, time).
+
+        Returns:
+            torch.Tensor: Mel spectrogram of shape (..., n_mels, time).
+        """
+        shape = specgram.shape
+        specgram = specgram.reshape(-1, shape[-2], shape[-1])
+        melspec = specgram.new_zeros(specgram.size(0), self.n_mels, shape[-1])
+        for m0, m1, f0, f1 in self.bands:
+            melspec[:, m0:m1] = torch.matmul(
+                self.fb[f0:f1, m0:m1].t(), specgram[:, f0:f1]
+            )  # (m, f) @ (B, f, time) -> (B, m, time)
+        return melspec.reshape(shape[:-2] + melspec.shape[-2:])
+
 
 class MinMaxNorm(nn.Module):
     def __init__(self, eps=1e-6):
@@ -85,18 +481,24 @@ class MinMaxNorm(nn.Module):
         super().__init__()
         self.eps = eps
 
-    def forward(self, X):
+    def forward(self, X, mask=None):
         """
         Forward pass of the min-max normalization module.
 
         Args:
             X (torch.Tensor): Input data.
+            mask (torch.Tensor, optional): Valid frames (batch_size, 1, n_frames), the
+                statistics are taken over them only. Defaults to None.
 
         Returns:
             torch.Tensor: Normalized data.
         """
-        min_ = torch.amax(X, dim=(1, 2), keepdim=True)
-        max_ = torch.amin(X, dim=(1, 2), keepdim=True)
+        if mask is None:
+            min_ = torch.amax(X, dim=(1, 2), keepdim=True)
+            max_ = torch.amin(X, dim=(1, 2), keepdim=True)
+        else:
+            min_ = X.masked_fill(~mask, -torch.inf).amax(dim=(1, 2), keepdim=True)
+            max_ = X.masked_fill(~mask, torch.inf).amin(dim=(1, 2), keepdim=True)
         return (X - min_) / (max_ - min_ + self.eps)
 
 
@@ -107,12 +509,13 @@ class SimpleNorm(nn.Module):
         """
         super().__init__()
 
-    def forward(self, x):
+    def forward(self, x, mask=None):
         """
         Forward pass of the simple normalization module.
 
         Args:
             x (torch.Tensor): Input data.
+            mask (torch.Tensor, optional): Unused, the normalization is per value.
 
         Returns:
             torch.Tensor: Normalized data.
@@ -131,16 +534,24 @@ class MeanStdNorm(nn.Module):
         super().__init__()
         self.eps = eps
 
-    def forward(self, X):
+    def forward(self, X, mask=None):
         """
         Forward pass of the mean and standard deviation normalization module.
 
         Args:
             X (torch.Tensor): Input data.
+            mask (torch.Tensor, optional): Valid frames (batch_size, 1, n_frames), the
+                statistics are taken over them only. Defaults to None.
 
         Returns:
             torch.Tensor: Normalized data.
         """
-        mean = X.mean((1, 2), keepdim=True)
-        std = X.reshape(X.size(0), -1).std(1, keepdim=True).unsqueeze(-1)
+        if mask is None:
+            mean = X.mean((1, 2), keepdim=True)
+            std = X.reshape(X.size(0), -1).std(1, keepdim=True).unsqueeze(-1)
+        else:
+            count = mask.sum((1, 2), keepdim=True) * X.size(1)
+            mean = (X * mask).sum((1, 2), keepdim=True) / count
+            var = ((X - mean) ** 2 * mask).sum((1, 2), keepdim=True) / (count - 1)
+            std = var.sqrt()
         return (X - mean) / (std + self.eps)
@@ -1,6 +1,7 @@
 import math
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from sonics.layers.embedding import (
     SinusoidPositionalEncoding,
     LearnedPositionalEncoding,
@@ -56,7 +57,7 @@ class STTokenizer(nn.Module):
             pe_learnable=pe_learnable,
         )
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         # Temporal tokenization
         temporal_input = x  # shape: (B, F, T)
         temporal_tokens = self.temporal_tokenizer(
@@ -64,7 +65,7 @@ class STTokenizer(nn.Module):
         )  # shape: (B, T/t, dim)
 
         # Spectral tokenization
-        spectral_input = x.permute(0, 2, 1)  # shape: (batch_size, T, F)
+        spectral_input = self.spectral_input(x, lengths).permute(0, 2, 1)  # (B, T, F)
         spectral_tokens = self.spectral_tokenizer(
             spectral_input
         )  # shape: (B, F/f, dim)
@@ -74,6 +75,75 @@ class STTokenizer(nn.Module):
         )  # shape: (B, T/t + F/f, dim)
         return spectro_temporal_tokens
 
+    def spectral_input(self, x, lengths=None):
+        """
+        The spectral tokenizer's conv has one input channel per frame, so spectrograms
+        with a different number of frames than `input_temp_dim` (variable-length
+        inference) are linearly resized along time for this branch only. The temporal
+        branch sees every frame. In a padded batch, `lengths` (B,) valid frames, each
+        song's own frames are resized, as if it were scored alone.
+        """
+        if lengths is None:
+            if x.size(-1) == self.input_temp_dim:
+                return x
+            return F.interpolate(
+                x, size=self.input_temp_dim, mode="linear", align_corners=False
+            )  # shape: (B, F, input_temp_dim)
+        return torch.cat(
+            [
+                F.interpolate(
+                    x[i : i + 1, :, :n],
+                    size=self.input_temp_dim,
+                    mode="linear",
+                    align_corners=False,
+                )
+                for i, n in enumerate(lengths.tolist())
+            ]
+        )  # shape: (B, F, input_temp_dim)
+
+
+class FusedSTTokenizer(STTokenizer):
+    """Single-pass `STTokenizer` with the same parameters (and state_dict keys).
+
+    Both strided convolutions are computed as patch GEMMs over the same (B, F, T)
+    buffer: the spectral patches are a view of it, so the `permute` copy goes away, and
+    the GEMMs produce (B, N, dim) directly, so the transposes go away. The positional
+    encodings are added in place and each branch is written into one preallocated
+    (B, T/t + F/f, dim) output instead of being concatenated.
+    """
+
+    def forward(self, x, lengths=None):
+        B, F_dim, T_dim = x.shape
+        t_tok, s_tok = self.temporal_tokenizer, self.spectral_tokenizer
+        nt, nf = T_dim // self.t_clip, self.num_spectral_tokens
+
+        # Temporal patches: (B, F, nt, t) -> (B, nt, F * t), matches conv weight (dim, F, t)
+        patches = x[..., : nt * self.t_clip].reshape(B, F_dim, nt, self.t_clip)
+        patches = patches.transpose(1, 2).reshape(B, nt, F_dim * self.t_clip)
+        weight = t_tok.conv1d.weight.reshape(self.embed_dim, -1)
+        temporal_tokens = self.embed(t_tok, patches, weight)  # shape: (B, T/t, dim)
+
+        # Spectral patches are a view: (B, nf * f, T) -> (B, nf, f * T)
+        x = self.spectral_input(x, lengths)
+        patches = x[:, : nf * self.f_clip].reshape(B, nf, -1)
+        weight = s_tok.conv1d.weight.transpose(1, 2).reshape(self.embed_dim, -1)
+        spectral_tokens = self.embed(s_tok, patches, weight)  # shape: (B, F/f, dim)
+
+        tokens = temporal_tokens.new_empty(B, nt + nf, self.embed_dim)
+        tokens[:, :nt] = temporal_tokens
+        tokens[:, nt:] = spectral_tokens
+        return tokens  # shape: (B, T/t + F/f, dim)
+
+    @staticmethod
+    def embed(tokenizer, patches, weight):
+        """
+        GEMM + bias, GELU, in-place positional add and pre-norm of one `Tokenizer1D`.
+        """
+        x = F.linear(patches, weight, tokenizer.conv1d.bias)  # (B, N, dim)
+        x = tokenizer.act(x)
+        x += tokenizer.pos_encoder.get_pe(x.size(1))
+        return tokenizer.norm_pre(x)
+
 
 class Tokenizer1D(nn.Module):
     """Teimporal/Spectral Tokenizer
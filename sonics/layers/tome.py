@@ -0,0 +1,58 @@
+import torch
+
+
+def bipartite_soft_matching(metric, r):
+    """
+    Bipartite soft matching from Token Merging (ToMe, Bolya et al., 2023).
+
+    Tokens are split alternately into two sets A and B, every token in A is matched with
+    its most similar token in B, and the `r` most similar pairs are merged.
+
+    Args:
+        metric (torch.Tensor): Similarity features of shape (B, N, C), e.g. attention keys.
+        r (int): Number of tokens to remove, at most N // 2.
+
+    Returns:
+        Callable: `merge(x, mode="sum")` mapping (B, N, C) to (B, N - r, C).
+    """
+    r = min(r, metric.size(1) // 2)
+    if r <= 0:
+        return lambda x, mode="sum": x
+
+    with torch.no_grad():
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = metric[..., ::2, :], metric[..., 1::2, :]
+        scores = a @ b.transpose(-1, -2)  # shape: (B, N_a, N_b)
+
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+        unm_idx = edge_idx[..., r:, :]  # tokens of A that stay
+        src_idx = edge_idx[..., :r, :]  # tokens of A merged into B
+        dst_idx = node_idx[..., None].gather(dim=-2, index=src_idx)
+
+    def merge(x, mode="sum"):
+        src, dst = x[..., ::2, :], x[..., 1::2, :]
+        n, t1, c = src.shape
+        unm = src.gather(dim=-2, index=unm_idx.expand(n, t1 - r, c))
+        src = src.gather(dim=-2, index=src_idx.expand(n, r, c))
+        dst = dst.scatter_reduce(-2, dst_idx.expand(n, r, c), src, reduce=mode)
+        return torch.cat([unm, dst], dim=1)
+
+    return merge
+
+
+def merge_wavg(merge, x, size):
+    """
+    Merges tokens as a size-weighted average and returns the merged sizes.
+
+    Args:
+        merge (Callable): Output of `bipartite_soft_matching`.
+        x (torch.Tensor): Tokens of shape (B, N, C).
+        size (torch.Tensor): Number of original tokens behind each token, (B, N, 1).
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: Merged tokens and their sizes.
+    """
+    x = merge(x * size, mode="sum")
+    size = merge(size, mode="sum")
+    return x / size.clamp(min=1e-6), size  # two merged padding tokens have size 0
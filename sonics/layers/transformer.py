@@ -1,3 +1,6 @@
+import logging
+import math
+import time
 import torch.nn as nn
 from typing import Optional
 
@@ -13,6 +16,270 @@ from timm.layers import (
     use_fused_attn,
 )
 
+from sonics.layers.tome import bipartite_soft_matching, merge_wavg
+
+try:
+    from torch.nn.attention import SDPBackend, sdpa_kernel
+
+    # Kernels `F.scaled_dot_product_attention` can be pinned to, see `Attention`
+    SDPA_BACKENDS = {
+        "math": SDPBackend.MATH,
+        "efficient": SDPBackend.EFFICIENT_ATTENTION,
+        "flash": SDPBackend.FLASH_ATTENTION,
+    }
+except ImportError:  # torch < 2.3, the default dispatch only
+    sdpa_kernel = None
+    SDPA_BACKENDS = {}
+
+# "auto" keeps PyTorch's dispatch, "benchmark" times every kernel once per shape
+ATTN_BACKENDS = ["auto", "benchmark", *SDPA_BACKENDS] if SDPA_BACKENDS else ["auto"]
+
+logger = logging.getLogger(__name__)
+
+# Fastest SDPA kernel per (shape bucket, dtype, device, mask, dropout), from
+# `select_sdpa_backend`
+_sdpa_backend_cache = {}
+
+
+def windowed_attention(q, k, v, window_size, shift=0, num_global=0, dropout_p=0.0):
+    """
+    Local attention over non-overlapping windows of `window_size` tokens, linear in the
+    sequence length. The last `num_global` tokens are global: every window also attends
+    to them, and they attend to the whole sequence.
+
+    Args:
+        q, k, v (torch.Tensor): Queries, keys and values of shape (B, H, N, head_dim).
+        window_size (int): Number of local tokens per window.
+        shift (int, optional): Offset of the window grid (shifted windows), padded
+            positions are masked out. Defaults to 0.
+        num_global (int, optional): Number of trailing global tokens. Defaults to 0.
+        dropout_p (float, optional): Attention dropout. Defaults to 0.0.
+
+    Returns:
+        torch.Tensor: Attention output of shape (B, H, N, head_dim).
+    """
+    B, H, N, D = q.shape
+    n = N - num_global
+    num_windows = math.ceil((n + shift) / window_size)
+    pad_r = num_windows * window_size - n - shift
+
+    def to_windows(x):
+        x = x[:, :, :n]
+        if shift or pad_r:
+            x = F.pad(x, (0, 0, shift, pad_r))
+        return x.reshape(B, H, num_windows, window_size, D)
+
+    def merge_heads(x):
+        # 4D inputs so SDPA can pick a fused kernel: (B, H, nw, ., D) -> (B, H * nw, ., D)
+        return x.reshape(B, H * num_windows, x.size(-2), D)
+
+    q_local, k_local, v_local = to_windows(q), to_windows(k), to_windows(v)
+    if num_global:
+        k_global = k[:, :, None, n:].expand(-1, -1, num_windows, -1, -1)
+        v_global = v[:, :, None, n:].expand(-1, -1, num_windows, -1, -1)
+        k_local = torch.cat([k_local, k_global], dim=3)  # (B, H, nw, w + g, D)
+        v_local = torch.cat([v_local, v_global], dim=3)
+
+    attn_mask = None
+    if shift or pad_r:
+        pos = torch.arange(num_windows * window_size, device=q.device) - shift
+        valid = ((pos >= 0) & (pos < n)).reshape(num_windows, 1, window_size)
+        if num_global:
+            valid = torch.cat([valid, valid.new_ones(num_windows, 1, num_global)], -1)
+        # (H * nw, 1, w + g), broadcast over the batch and the queries
+        attn_mask = valid.expand(H, -1, -1, -1).reshape(H * num_windows, 1, -1)
+
+    x = F.scaled_dot_product_attention(
+        merge_heads(q_local),
+        merge_heads(k_local),
+        merge_heads(v_local),
+        attn_mask=attn_mask,
+        dropout_p=dropout_p,
+    )  # shape: (B, H * nw, w, D)
+    x = x.reshape(B, H, -1, D)[:, :, shift : shift + n]
+
+    if num_global:
+        x_global = F.scaled_dot_product_attention(
+            q[:, :, n:], k, v, dropout_p=dropout_p
+        )  # shape: (B, H, g, D)
+        x = torch.cat([x, x_global], dim=2)
+    return x
+
+
+def linear_attention(q, k, v, size=None, dropout_p=0.0, eps=1e-6):
+    """
+    Kernelized linear attention (Katharopoulos et al., 2020) with the `elu(x) + 1`
+    feature map: softmax(q k^T) v is replaced by phi(q) (phi(k)^T v), normalized by
+    phi(q) sum(phi(k)), so cost and memory are linear in the sequence length. It has
+    no parameters, so softmax-trained checkpoints load as is and only need a short
+    fine-tune to adapt.
+
+    Args:
+        q, k, v (torch.Tensor): Queries, keys and values of shape (B, H, N, head_dim).
+        size (torch.Tensor, optional): Token sizes (B, N, 1) of merged tokens, which
+            weight their keys. Defaults to None.
+        dropout_p (float, optional): Attention dropout. The factorized form has no
+            query-key weights to drop, so each key is dropped for all queries of a head
+            and the kept ones are scaled by 1 / (1 - p), like softmax attention dropout
+            (the normalizer is left intact). Defaults to 0.0.
+        eps (float, optional): Small value to avoid division by zero. Defaults to 1e-6.
+
+    Returns:
+        torch.Tensor: Attention output of shape (B, H, N, head_dim).
+    """
+    dtype = v.dtype
+    # Sums over all tokens overflow in fp16, so accumulate in float32
+    q, k, v = F.elu(q.float()) + 1, F.elu(k.float()) + 1, v.float()
+    if size is not None:
+        k = k * size[:, None].float()  # (B, 1, N, 1)
+    k_drop = k
+    if dropout_p > 0:
+        keep = torch.rand(k.shape[:-1] + (1,), device=k.device) >= dropout_p
+        k_drop = k * keep / (1 - dropout_p)  # (B, H, N, head_dim)
+    kv = k_drop.transpose(-2, -1) @ v  # shape: (B, H, head_dim, head_dim)
+    z = q @ k.sum(dim=-2, keepdim=True).transpose(-2, -1)  # shape: (B, H, N, 1)
+    x = (q @ kv) / (z + eps)
+    return x.to(dtype)
+
+
+def run_sdpa(q, k, v, backend="auto", attn_mask=None, dropout_p=0.0):
+    """
+    `F.scaled_dot_product_attention` on the `backend` kernel ("auto" lets PyTorch pick).
+    """
+    if backend == "auto":
+        return F.scaled_dot_product_attention(
+            q, k, v, attn_mask=attn_mask, dropout_p=dropout_p
+        )
+    with sdpa_kernel(SDPA_BACKENDS[backend]):
+        return F.scaled_dot_product_attention(
+            q, k, v, attn_mask=attn_mask, dropout_p=dropout_p
+        )
+
+
+def sdpa_kernel_unavailable(error):
+    """
+    Whether a RuntimeError from `run_sdpa` means the pinned kernel can't run these
+    inputs: "No available kernel" on CUDA, "No viable backend" on CPU.
+    """
+    message = str(error)
+    return "No available kernel" in message or "No viable backend" in message
+
+
+@torch.no_grad()
+def benchmark_sdpa_backends(q, k, v, attn_mask=None, dropout_p=0.0, num_runs=10):
+    """
+    Latency (s) of every SDPA kernel on these inputs. Kernels that don't support the
+    device, dtype, head_dim or mask are left out.
+    """
+    sync = torch.cuda.synchronize if q.is_cuda else (lambda: None)
+    latencies = {}
+    for backend in ["auto", *SDPA_BACKENDS]:
+        try:
+            run_sdpa(q, k, v, backend, attn_mask, dropout_p)  # warm-up
+            sync()
+            start = time.perf_counter()
+            for _ in range(num_runs):
+                run_sdpa(q, k, v, backend, attn_mask, dropout_p)
+            sync()
+        except RuntimeError as e:
+            if not sdpa_kernel_unavailable(e):
+                raise
+            continue
+        latencies[backend] = (time.perf_counter() - start) / num_runs
+    return latencies
+
+
+def select_sdpa_backend(q, k, v, attn_mask=None, dropout_p=0.0):
+    """
+    Fastest SDPA kernel for the (B, heads, N, head_dim) shape of `q`, benchmarked the
+    first time the shape is seen and cached for the rest of the run. Batch size and
+    token counts are bucketed to the next power of two, so variable-length batches
+    reuse the kernel picked for a similar shape and the cache stays small.
+    """
+
+    def bucket(n):
+        return 1 << (n - 1).bit_length()
+
+    B, H, N, D = q.shape
+    key = (
+        (bucket(B), H, bucket(N), D),
+        bucket(k.size(-2)),
+        q.dtype,
+        str(q.device),
+        None if attn_mask is None else attn_mask.dtype,
+        dropout_p > 0,
+    )
+    if key not in _sdpa_backend_cache:
+        latencies = benchmark_sdpa_backends(q, k, v, attn_mask, dropout_p)
+        best = min(latencies, key=latencies.get) if latencies else "auto"
+        _sdpa_backend_cache[key] = best
+        timings = ", ".join(f"{b}: {t * 1000:.3f} ms" for b, t in latencies.items())
+        logger.info(
+            "Attention backend for %s %s: %s (%s)",
+            tuple(q.shape),
+            q.dtype,
+            best,
+            timings,
+        )
+    return _sdpa_backend_cache[key]
+
+
+class LowRankLinear(nn.Module):
+    def __init__(self, in_features, out_features, rank, bias=True):
+        """
+        Rank-`rank` factorized linear layer, `up(down(x))`, with rank * (in + out)
+        instead of in * out weights and FLOPs.
+
+        Args:
+            in_features (int): Input features.
+            out_features (int): Output features.
+            rank (int): Inner dimension of the factorization, below
+                in * out / (in + out) or the layer is larger than the dense one.
+            bias (bool, optional): Whether `up` has a bias. Defaults to True.
+        """
+        super().__init__()
+        if not 1 <= rank * (in_features + out_features) < in_features * out_features:
+            raise ValueError(
+                f"rank {rank} doesn't shrink a {in_features} -> {out_features} linear "
+                "layer, use a rank in [1, in * out / (in + out)) or 0 for full rank"
+            )
+        self.in_features = in_features
+        self.out_features = out_features
+        self.rank = rank
+        self.down = nn.Linear(in_features, rank, bias=False)
+        self.up = nn.Linear(rank, out_features, bias=bias)
+
+    def forward(self, x):
+        return self.up(self.down(x))
+
+    @classmethod
+    @torch.no_grad()
+    def from_linear(cls, linear, rank):
+        """
+        Truncated SVD of a trained `nn.Linear`, W ~ (U S^1/2)(S^1/2 V^T), the best
+        rank-`rank` approximation of its weight.
+        """
+        U, S, Vh = torch.linalg.svd(linear.weight.float(), full_matrices=False)
+        sqrt_s = S[:rank].sqrt()
+        layer = cls(
+            linear.in_features, linear.out_features, rank, bias=linear.bias is not None
+        )
+        layer.to(linear.weight.device, linear.weight.dtype)
+        layer.down.weight.copy_(sqrt_s[:, None] * Vh[:rank])
+        layer.up.weight.copy_(U[:, :rank] * sqrt_s)
+        if linear.bias is not None:
+            layer.up.bias.copy_(linear.bias)
+        return layer
+
+
+def make_linear(in_features, out_features, bias=True, rank=0):
+    """
+    `nn.Linear`, or a `LowRankLinear` when `rank` is set (0/None keeps full rank).
+    """
+    if rank:
+        return LowRankLinear(in_features, out_features, rank, bias=bias)
+    return nn.Linear(in_features, out_features, bias=bias)
+
 
 class Attention(nn.Module):
     fused_attn: Final[bool]
@@ -26,22 +293,53 @@ class Attention(nn.Module):
         attn_drop: float = 0.0,
         proj_drop: float = 0.0,
         norm_layer: nn.Module = nn.LayerNorm,
+        window_size: Optional[int] = None,
+        window_shift: int = 0,
+        num_global_tokens: int = 0,
+        attn_type: str = "softmax",
+        head_dim: Optional[int] = None,
+        qkv_rank: int = 0,
+        proj_rank: int = 0,
+        attn_backend: str = "auto",
     ) -> None:
         super().__init__()
-        assert dim % num_heads == 0, "dim should be divisible by num_heads"
+        assert head_dim or dim % num_heads == 0, "dim should be divisible by num_heads"
+        if attn_type not in ("softmax", "linear"):
+            raise ValueError(f"Unknown attn_type: {attn_type}")
+        if attn_backend not in ATTN_BACKENDS:
+            raise ValueError(
+                f"Unknown attn_backend: {attn_backend}, available: {ATTN_BACKENDS}"
+            )
+        if attn_type == "linear" and window_size:
+            raise ValueError("Linear attention can't be combined with windowed attention")
         self.num_heads = num_heads
-        self.head_dim = dim // num_heads
+        # Fixed `head_dim` lets pruned layers keep fewer heads than dim // head_dim
+        self.head_dim = head_dim or dim // num_heads
+        inner_dim = self.num_heads * self.head_dim
         self.scale = self.head_dim**-0.5
         self.fused_attn = use_fused_attn()
+        # Local attention, see `windowed_attention`, None keeps full attention
+        self.window_size = window_size
+        self.window_shift = window_shift
+        self.num_global_tokens = num_global_tokens
+        # "linear" swaps softmax attention for `linear_attention`, same parameters
+        self.attn_type = attn_type
+        # SDPA kernel of full softmax attention, see `ATTN_BACKENDS`
+        self.attn_backend = attn_backend
 
-        self.qkv = nn.Linear(dim, dim * 3, bias=qkv_bias)
+        self.qkv = make_linear(dim, inner_dim * 3, bias=qkv_bias, rank=qkv_rank)
         self.q_norm = norm_layer(self.head_dim) if qk_norm else nn.Identity()
         self.k_norm = norm_layer(self.head_dim) if qk_norm else nn.Identity()
         self.attn_drop = nn.Dropout(attn_drop)
-        self.proj = nn.Linear(dim, dim)
+        self.proj = make_linear(inner_dim, dim, rank=proj_rank)
         self.proj_drop = nn.Dropout(proj_drop)
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def forward(
+        self,
+        x: torch.Tensor,
+        size: Optional[torch.Tensor] = None,
+        return_metric: bool = False,
+    ):
         B, N, C = x.shape
         qkv = (
             self.qkv(x)
@@ -51,23 +349,60 @@ class Attention(nn.Module):
         q, k, v = qkv.unbind(0)
         q, k = self.q_norm(q), self.k_norm(k)
 
-        if self.fused_attn:
-            x = F.scaled_dot_product_attention(
+        # Size-weighted (proportional) attention for merged tokens: a token standing
+        # for `s` original tokens gets `log(s)` added to its attention logits, padding
+        # tokens (size 0) get -inf and are never attended to
+        attn_mask = None
+        if size is not None:
+            attn_mask = size.log()[:, None, None, :, 0].to(q.dtype)  # (B, 1, 1, N)
+
+        if self.attn_type == "linear":
+            x = linear_attention(
+                q,
+                k,
+                v,
+                size=size,
+                dropout_p=self.attn_drop.p if self.training else 0.0,
+            )
+        elif self.window_size:
+            if attn_mask is not None:
+                raise ValueError(
+                    "Windowed attention doesn't support token merging or padding masks"
+                )
+            x = windowed_attention(
                 q,
                 k,
                 v,
+                self.window_size,
+                shift=self.window_shift,
+                num_global=self.num_global_tokens,
                 dropout_p=self.attn_drop.p if self.training else 0.0,
             )
+        elif self.fused_attn:
+            dropout_p = self.attn_drop.p if self.training else 0.0
+            backend = self.attn_backend
+            if backend == "benchmark":
+                # Timing can't be traced, compiled graphs keep the default dispatch
+                backend = (
+                    "auto"
+                    if torch.compiler.is_compiling()
+                    else select_sdpa_backend(q, k, v, attn_mask, dropout_p)
+                )
+            x = run_sdpa(q, k, v, backend, attn_mask=attn_mask, dropout_p=dropout_p)
         else:
             q = q * self.scale
             attn = q @ k.transpose(-2, -1)
+            if attn_mask is not None:
+                attn = attn + attn_mask
             attn = attn.softmax(dim=-1)
             attn = self.attn_drop(attn)
             x = attn @ v
 
-        x = x.transpose(1, 2).reshape(B, N, C)
+        x = x.transpose(1, 2).reshape(B, N, -1)
         x = self.proj(x)
         x = self.proj_drop(x)
+        if return_metric:
+            return x, k.mean(dim=1)  # keys averaged over heads, used for merging
         return x
 
 
@@ -101,6 +436,14 @@ class TransformerBlock(nn.Module):
         act_layer: nn.Module = nn.GELU,
         norm_layer: nn.Module = nn.LayerNorm,
         mlp_layer: nn.Module = Mlp,
+        window_size: Optional[int] = None,
+        window_shift: int = 0,
+        num_global_tokens: int = 0,
+        attn_type: str = "softmax",
+        head_dim: Optional[int] = None,
+        mlp_hidden_dim: Optional[int] = None,
+        ranks: Optional[list] = None,
+        attn_backend: str = "auto",
     ) -> None:
         super().__init__()
         self.norm1 = norm_layer(dim)
@@ -112,6 +455,14 @@ class TransformerBlock(nn.Module):
             attn_drop=attn_drop,
             proj_drop=proj_drop,
             norm_layer=norm_layer,
+            window_size=window_size,
+            window_shift=window_shift,
+            num_global_tokens=num_global_tokens,
+            attn_type=attn_type,
+            head_dim=head_dim,
+            qkv_rank=ranks[0] if ranks else 0,
+            proj_rank=ranks[1] if ranks else 0,
+            attn_backend=attn_backend,
         )
         self.ls1 = (
             LayerScale(dim, init_values=init_values) if init_values else nn.Identity()
@@ -121,20 +472,89 @@ class TransformerBlock(nn.Module):
         self.norm2 = norm_layer(dim)
         self.mlp = mlp_layer(
             in_features=dim,
-            hidden_features=int(dim * mlp_ratio),
+            hidden_features=mlp_hidden_dim or int(dim * mlp_ratio),
             act_layer=act_layer,
             drop=proj_drop,
         )
+        # Low-rank `Mlp` layers, [qkv, proj, fc1, fc2] ranks with 0 for full rank
+        if ranks and ranks[2]:
+            fc1 = self.mlp.fc1
+            self.mlp.fc1 = make_linear(fc1.in_features, fc1.out_features, rank=ranks[2])
+        if ranks and ranks[3]:
+            fc2 = self.mlp.fc2
+            self.mlp.fc2 = make_linear(fc2.in_features, fc2.out_features, rank=ranks[3])
         self.ls2 = (
             LayerScale(dim, init_values=init_values) if init_values else nn.Identity()
         )
         self.drop_path2 = DropPath(drop_path) if drop_path > 0.0 else nn.Identity()
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        x = x + self.drop_path1(self.ls1(self.attn(self.norm1(x))))
+    def forward(
+        self, x: torch.Tensor, size: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        x = x + self.drop_path1(self.ls1(self.attn(self.norm1(x), size=size)))
         x = x + self.drop_path2(self.ls2(self.mlp(self.norm2(x))))
         return x
 
+    def forward_merge(self, x, size=None, r=0):
+        """
+        Forward pass with token merging (ToMe) between the attention and the MLP.
+
+        Args:
+            x (torch.Tensor): Tokens of shape (B, N, dim).
+            size (torch.Tensor, optional): Original tokens behind each token, (B, N, 1).
+                None means every token is unmerged.
+            r (int, optional): Number of tokens to merge away. Defaults to 0.
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: Tokens (B, N - r, dim) and their sizes.
+        """
+        attn, metric = self.attn(self.norm1(x), size=size, return_metric=True)
+        x = x + self.drop_path1(self.ls1(attn))
+
+        if size is None:
+            size = x.new_ones(x.size(0), x.size(1), 1, dtype=torch.float32)
+        merge = bipartite_soft_matching(metric, r)
+        x, size = merge_wavg(merge, x, size)
+
+        x = x + self.drop_path2(self.ls2(self.mlp(self.norm2(x))))
+        return x, size
+
+
+def pool_tokens(x, size=None):
+    """
+    Mean over tokens, weighted by the number of original tokens behind each token when
+    tokens were merged; padding tokens (size 0) are left out.
+    """
+    if size is None:
+        return x.mean(dim=1)
+    return (x * size).sum(dim=1) / size.sum(dim=1)
+
+
+def pool_temporal_tokens(x, stride, num_global=0, global_stride=1):
+    """
+    Average-pools the local (temporal) tokens by `stride` between hierarchical stages;
+    the trailing `num_global` (spectral) tokens are pooled by `global_stride`, 1 keeps
+    them intact. A last partial window is averaged over the tokens it covers.
+
+    Args:
+        x (torch.Tensor): Tokens of shape (B, N, C), global tokens last.
+        stride (int): Temporal pooling factor.
+        num_global (int, optional): Number of trailing global tokens. Defaults to 0.
+        global_stride (int, optional): Pooling factor of the global tokens. Defaults to 1.
+
+    Returns:
+        torch.Tensor: Tokens of shape (B, ceil(n / stride) + ceil(g / global_stride), C).
+    """
+
+    def pool(tokens, s):
+        if s == 1 or tokens.size(1) == 0:
+            return tokens
+        tokens = F.avg_pool1d(tokens.transpose(1, 2), s, s, ceil_mode=True)
+        return tokens.transpose(1, 2)
+
+    n = x.size(1) - num_global
+    return torch.cat([pool(x[:, :n], stride), pool(x[:, n:], global_stride)], dim=1)
+
 
 class Transformer(nn.Module):
     """
@@ -152,25 +572,232 @@ class Transformer(nn.Module):
         proj_drop: float = 0.0,
         attn_drop: float = 0.0,
         drop_path: float = 0.0,
+        merge_ratio: float = 0.0,
+        attn_window: Optional[int] = None,
+        attn_shift: bool = True,
+        num_global_tokens: int = 0,
+        grad_checkpointing: int = 0,
+        exit_blocks: Optional[list] = None,
+        attn_type: str = "softmax",
+        layer_dims: Optional[list] = None,
+        stage_depths: Optional[list] = None,
+        temporal_stride: int = 2,
+        spectral_stride: int = 1,
+        layer_ranks: Optional[list] = None,
+        attn_backend: str = "auto",
     ):
         super(Transformer, self).__init__()
+        if merge_ratio and attn_window:
+            raise ValueError("Token merging and windowed attention can't be combined")
+        # Hierarchical stages: after every stage but the last, the local tokens are
+        # pooled by `temporal_stride` and the global ones by `spectral_stride`. Maps the
+        # depth a pooling follows to the number of global tokens before it.
+        self.temporal_stride = temporal_stride
+        self.spectral_stride = spectral_stride
+        self.pool_after = {}
+        num_globals = [num_global_tokens] * num_layers  # per block
+        if stage_depths is not None:
+            if sum(stage_depths) != num_layers:
+                raise ValueError(
+                    f"stage_depths {stage_depths} must sum to num_layers={num_layers}"
+                )
+            if merge_ratio:
+                raise ValueError("Token merging and hierarchical stages can't be combined")
+            depth = 0
+            for stage_depth in stage_depths[:-1]:
+                depth += stage_depth
+                self.pool_after[depth] = num_globals[depth - 1]
+                num_globals[depth:] = [
+                    math.ceil(num_globals[depth - 1] / spectral_stride)
+                ] * (num_layers - depth)
+        # Per-block [num_heads, mlp_hidden_dim] of a pruned model, None keeps every
+        # block at `num_heads` and `mlp_ratio`
+        if layer_dims is None:
+            layer_dims = [[num_heads, int(embed_dim * mlp_ratio)]] * num_layers
+        if len(layer_dims) != num_layers:
+            raise ValueError(
+                f"layer_dims has {len(layer_dims)} entries, expected {num_layers}"
+            )
+        # Per-block [qkv, proj, fc1, fc2] ranks of factorized `LowRankLinear` layers
+        # (0 keeps a layer full rank), or a single rank for all of them
+        if isinstance(layer_ranks, int):
+            layer_ranks = [[layer_ranks] * 4] * num_layers
+        if layer_ranks is not None and len(layer_ranks) != num_layers:
+            raise ValueError(
+                f"layer_ranks has {len(layer_ranks)} entries, expected {num_layers}"
+            )
+        if layer_ranks is not None and any(len(ranks) != 4 for ranks in layer_ranks):
+            raise ValueError("Every layer_ranks entry must be [qkv, proj, fc1, fc2]")
+        # Fraction of tokens merged away after every block (ToMe), 0 disables merging
+        self.merge_ratio = merge_ratio
+        # Original tokens behind each output token from the last forward (0 for
+        # padding), None if unmerged and unpadded
+        self.token_sizes = None
+        self.set_grad_checkpointing(grad_checkpointing)
+        # Depths (number of blocks run) whose pooled tokens feed early-exit heads, and
+        # those pooled tokens from the last forward
+        self.exit_blocks = set(exit_blocks or [])
+        self.exit_features = {}
         self.blocks = nn.ModuleList(
             [
                 TransformerBlock(
                     dim=embed_dim,
-                    num_heads=num_heads,
+                    num_heads=layer_dims[i][0],
                     mlp_ratio=mlp_ratio,
                     qkv_bias=qkv_bias,
                     qk_norm=qk_norm,
                     proj_drop=proj_drop,
                     attn_drop=attn_drop,
                     drop_path=drop_path,
+                    window_size=attn_window,
+                    # Every other block shifts its windows by half, like Swin
+                    window_shift=(
+                        attn_window // 2 if attn_window and attn_shift and i % 2 else 0
+                    ),
+                    num_global_tokens=num_globals[i],
+                    attn_type=attn_type,
+                    head_dim=embed_dim // num_heads,
+                    mlp_hidden_dim=layer_dims[i][1],
+                    ranks=layer_ranks[i] if layer_ranks else None,
+                    attn_backend=attn_backend,
                 )
-                for _ in range(num_layers)
+                for i in range(num_layers)
             ]
         )
 
-    def forward(self, x):
+    def set_attn_backend(self, backend):
+        """
+        Pins the SDPA kernel of every block's attention, see `ATTN_BACKENDS`. Kernels
+        share the weights, so it can be switched on any checkpoint.
+        """
+        if backend not in ATTN_BACKENDS:
+            raise ValueError(
+                f"Unknown attn_backend: {backend}, available: {ATTN_BACKENDS}"
+            )
         for block in self.blocks:
-            x = block(x)
-        return x
\ No newline at end of file
+            block.attn.attn_backend = backend
+
+    def set_grad_checkpointing(self, every=1):
+        """
+        Recomputes the activations of every `every`-th block in backward instead of
+        storing them (True is every block, False or 0 disables it).
+        """
+        self.grad_checkpointing = int(every)
+
+    def use_checkpoint(self, idx):
+        return (
+            self.grad_checkpointing > 0
+            and idx % self.grad_checkpointing == 0
+            and self.training
+            and torch.is_grad_enabled()
+        )
+
+    def pool_stage(self, x, depth, size=None):
+        """
+        Pools the tokens when `depth` blocks end a hierarchical stage, see
+        `pool_temporal_tokens`. With a padding mask `size` (B, N, 1), each window
+        averages its valid tokens only and stays valid if any of them is.
+        """
+        if depth not in self.pool_after:
+            return x, size
+
+        def pool(tokens):
+            return pool_temporal_tokens(
+                tokens,
+                self.temporal_stride,
+                num_global=self.pool_after[depth],
+                global_stride=self.spectral_stride,
+            )
+
+        if size is None:
+            return pool(x), None
+        weight = pool(size)
+        x = pool(x * size) / weight.clamp(min=1e-6)
+        return x, (weight > 0).to(size.dtype)
+
+    def forward(self, x, token_mask=None):
+        """
+        Args:
+            x (torch.Tensor): Tokens of shape (B, N, dim).
+            token_mask (torch.Tensor, optional): Valid (non-padding) tokens of a padded
+                batch, (B, N) bool. Padding tokens are masked out of attention and of
+                `token_sizes`, so pooling skips them. Defaults to None.
+        """
+        # Non-reentrant checkpointing replays the autocast state and works under DDP
+        self.exit_features = {}
+        if self.merge_ratio and self.pool_after:
+            raise ValueError("Token merging and hierarchical stages can't be combined")
+        # Padding tokens count as merged tokens of size 0
+        size = None if token_mask is None else token_mask[..., None].float()
+        if not self.merge_ratio:
+            for idx, block in enumerate(self.blocks):
+                if self.use_checkpoint(idx):
+                    x = torch.utils.checkpoint.checkpoint(
+                        block, x, size, use_reentrant=False
+                    )
+                else:
+                    x = block(x, size)
+                if idx + 1 in self.exit_blocks:
+                    self.exit_features[idx + 1] = pool_tokens(x, size)
+                x, size = self.pool_stage(x, idx + 1, size)
+            self.token_sizes = size
+            return x
+
+        for idx, block in enumerate(self.blocks):
+            r = int(x.size(1) * self.merge_ratio)
+            if self.use_checkpoint(idx):
+                x, size = torch.utils.checkpoint.checkpoint(
+                    block.forward_merge, x, size, r, use_reentrant=False
+                )
+            else:
+                x, size = block.forward_merge(x, size, r=r)
+            if idx + 1 in self.exit_blocks:
+                self.exit_features[idx + 1] = pool_tokens(x, size)
+        self.token_sizes = size
+        return x
+
+    @torch.no_grad()
+    def forward_early_exit(self, x, heads, threshold, token_mask=None):
+        """
+        Inference that stops each sample at the first head whose sigmoid confidence
+        (max of p and 1 - p) reaches `threshold`; exited samples are dropped from the
+        batch so later blocks only run on the undecided ones.
+
+        Args:
+            x (torch.Tensor): Tokens of shape (B, N, dim).
+            heads (dict): Depth -> head mapping pooled tokens to logits, must include
+                the full depth `len(self.blocks)`.
+            threshold (float): Confidence needed to exit.
+            token_mask (torch.Tensor, optional): Valid tokens (B, N) of a padded batch,
+                see `forward`. Defaults to None.
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: Logits (B, num_classes) and the number
+                of blocks each sample ran through (B,).
+        """
+        if self.merge_ratio:
+            raise ValueError("Early exit doesn't support token merging")
+        depth = len(self.blocks)
+        exit_depth = torch.full((x.size(0),), depth, dtype=torch.long, device=x.device)
+        active = torch.arange(x.size(0), device=x.device)
+        size = None if token_mask is None else token_mask[..., None].float()
+        preds = None
+        for idx, block in enumerate(self.blocks):
+            x = block(x, size)
+            if idx + 1 in heads:
+                logits = heads[idx + 1](pool_tokens(x, size))
+                if preds is None:
+                    preds = logits.new_zeros(exit_depth.size(0), logits.size(-1))
+                prob = torch.sigmoid(logits.float())
+                done = torch.maximum(prob, 1 - prob).amin(dim=-1) >= threshold
+                if idx + 1 == depth:
+                    done = torch.ones_like(done)
+
+                preds[active[done]] = logits[done]
+                exit_depth[active[done]] = idx + 1
+                x, active = x[~done], active[~done]
+                size = None if size is None else size[~done]
+                if active.numel() == 0:
+                    break
+            x, size = self.pool_stage(x, idx + 1, size)
+        return preds, exit_depth
@@ -1,3 +1,3 @@
 from sonics.models.model import AudioClassifier
-from sonics.models.spectttra import SpecTTTra
+from sonics.models.spectttra import HSpecTTTra, SpecTTTra
 from sonics.models.vit import ViT
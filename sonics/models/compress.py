@@ -0,0 +1,69 @@
+import torch
+
+WEIGHT_FORMATS = ["fp32", "fp16", "int8"]
+FORMAT_KEY = "__weight_format__"
+
+
+def quantize_per_channel(w):
+    """
+    Symmetric per-output-channel int8 quantization of a weight, (C, ...) -> int8 + scale.
+    """
+    amax = w.detach().float().abs().reshape(w.size(0), -1).amax(dim=1)
+    scale = (amax / 127.0).clamp(min=1e-12).reshape(-1, *([1] * (w.dim() - 1)))
+    q = torch.round(w.float() / scale).clamp(-127, 127).to(torch.int8)
+    return q, scale
+
+
+def compress_state_dict(model, weight_format="fp16"):
+    """
+    Weight-only compressed state_dict of a model. Parameters are stored in fp16 or, for
+    "int8", matrices/kernels as per-channel int8 with fp32 scales and vectors (biases,
+    norms) in fp16. Tensors without an output-channel axis, such as the (1, N, dim)
+    learned positional embedding or a class token, would get a single scale for the
+    whole tensor, so they are kept in fp16 too. Buffers (mel filterbank, positional
+    tables) are kept as they are.
+
+    Args:
+        model (nn.Module): Model to compress.
+        weight_format (str, optional): "fp32", "fp16" or "int8". Defaults to "fp16".
+
+    Returns:
+        dict: Compressed state_dict, restored with `decompress_state_dict`.
+    """
+    if weight_format not in WEIGHT_FORMATS:
+        raise ValueError(
+            f"Invalid weight_format: {weight_format}. Must be one of {WEIGHT_FORMATS}"
+        )
+    state_dict = {k: v.detach().cpu() for k, v in model.state_dict().items()}
+    if weight_format == "fp32":
+        return state_dict
+
+    params = {name for name, _ in model.named_parameters()}
+    tensors, scales = {}, {}
+    for name, value in state_dict.items():
+        if name not in params or not value.is_floating_point():
+            tensors[name] = value
+        elif weight_format == "int8" and value.dim() >= 2 and value.size(0) > 1:
+            tensors[name], scales[name] = quantize_per_channel(value)
+        else:
+            tensors[name] = value.half()
+    return {FORMAT_KEY: weight_format, "tensors": tensors, "scales": scales}
+
+
+def decompress_state_dict(state_dict, dtype=torch.float32):
+    """
+    Restores a state_dict written by `compress_state_dict`. Plain state_dicts are
+    returned unchanged, so loaders can call this on any checkpoint.
+    """
+    if FORMAT_KEY not in state_dict:
+        return state_dict
+    scales = state_dict["scales"]
+    out = {}
+    for name, value in state_dict["tensors"].items():
+        if name in scales:
+            out[name] = value.to(dtype) * scales[name].to(dtype)
+        elif value.is_floating_point():
+            out[name] = value.to(dtype)
+        else:
+            out[name] = value
+    return out
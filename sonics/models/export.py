@@ -0,0 +1,184 @@
+import os
+import copy
+import inspect
+import json
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from sonics.layers.feature import ExportFeatureExtractor
+from sonics.layers.transformer import pool_tokens
+from sonics.models.model import use_global_pool
+from sonics.utils.config import cfg2dict
+from sonics.utils.onnx_engine import OnnxAudioClassifier
+
+
+class ExportModel(nn.Module):
+    def __init__(self, model, frontend=True, resize=False):
+        """
+        Inference-only view of an `AudioClassifier` for graph export: waveform (or
+        spectrogram) -> encoder -> pooled logits, without augmentation or early exit.
+
+        Args:
+            model (AudioClassifier): Trained model.
+            frontend (bool, optional): Include the log-mel frontend, so the graph takes
+                raw audio; otherwise it takes spectrograms. Defaults to True.
+            resize (bool, optional): Keep `AudioClassifier`'s bilinear resize of
+                spectrograms that don't match `model.input_shape` in the graph. Without
+                it, such a frontend raises, see `melspec.fit_input_shape`.
+                Defaults to False.
+        """
+        super().__init__()
+        self.frontend = ExportFeatureExtractor(model.cfg) if frontend else None
+        self.encoder = model.encoder
+        self.classifier = model.classifier
+        self.global_pool = use_global_pool(model.model_name)
+        self.input_shape = tuple(model.cfg.model.input_shape)
+        self.resize = False
+        if self.frontend is not None:
+            with torch.no_grad():
+                shape = tuple(self.frontend(torch.zeros(1, model.cfg.audio.max_len)).shape)
+            self.resize = shape[-2:] != self.input_shape
+            if self.resize and not resize:
+                raise ValueError(
+                    f"The frontend yields {shape[-2:]} spectrograms, not input_shape "
+                    f"{self.input_shape}. Export with resize=True to keep the bilinear "
+                    "resize, or use a config with melspec.fit_input_shape: true."
+                )
+
+    def forward(self, x):
+        spec = self.frontend(x) if self.frontend is not None else x
+        if self.resize:  # same fallback as `AudioClassifier.get_spec`
+            spec = F.interpolate(spec.unsqueeze(1), size=self.input_shape, mode="bilinear")
+            spec = spec.squeeze(1)
+        features = self.encoder(spec.unsqueeze(1))
+        if self.global_pool:
+            features = pool_tokens(features, self.encoder.transformer.token_sizes)
+        return self.classifier(features)
+
+
+def remove_dropout(module):
+    """
+    Replaces Dropout and DropPath layers with Identity in place; they are no-ops in
+    eval mode but still show up as graph nodes when traced.
+    """
+    from timm.layers import DropPath
+
+    for name, child in module.named_children():
+        if isinstance(child, (nn.Dropout, DropPath)):
+            setattr(module, name, nn.Identity())
+        else:
+            remove_dropout(child)
+    return module
+
+
+def freeze_model(model, save_path=None, frontend=True, resize=False):
+    """
+    Builds a frozen TorchScript inference artifact: the `ExportModel` is traced without
+    dropout, then `torch.jit.freeze` inlines the weights and the mel constants and folds
+    constant ops (e.g. the fixed head/dim sizes of the QKV reshapes), and
+    `torch.jit.optimize_for_inference` applies backend fusions such as Linear+GELU
+    where available. Loading it needs only `torch.jit.load`, not sonics or timm.
+
+    Args:
+        model (AudioClassifier): Trained model.
+        save_path (str, optional): Where to save the artifact (.pt). Defaults to None.
+        frontend (bool, optional): Take raw audio (True) or spectrograms. Defaults to True.
+        resize (bool, optional): Keep the bilinear resize, see `ExportModel`.
+            Defaults to False.
+
+    Returns:
+        torch.jit.ScriptModule: Frozen module mapping the input to logits.
+    """
+    cfg = model.cfg
+    export_model = ExportModel(model, frontend=frontend, resize=resize)
+    export_model = copy.deepcopy(export_model).cpu().eval()
+    remove_dropout(export_model)  # on the copy, `model` keeps its dropout for training
+    if frontend:
+        example = torch.randn(2, cfg.audio.max_len)
+    else:
+        example = torch.randn(2, *cfg.model.input_shape)
+
+    with torch.no_grad():
+        traced = torch.jit.trace(export_model, example)
+        frozen = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    if save_path is not None:
+        # The config travels inside the artifact, e.g. for the sample rate and length
+        extra_files = {"config.json": json.dumps(cfg2dict(cfg), sort_keys=True)}
+        torch.jit.save(frozen, save_path, _extra_files=extra_files)
+    return frozen
+
+
+def export_onnx(model, save_directory, frontend=True, opset_version=17, resize=False):
+    """
+    Exports `model` to `save_directory/model.onnx` with a dynamic batch dimension and
+    writes its `config.json` next to it, for `OnnxAudioClassifier.from_pretrained`.
+
+    Args:
+        model (AudioClassifier): Trained model.
+        save_directory (str): Output directory.
+        frontend (bool, optional): Export waveform -> logits (True) or spectrogram ->
+            logits (False, the engine then runs the NumPy frontend). Defaults to True.
+        opset_version (int, optional): ONNX opset, at least 17 (STFT) with the
+            frontend. Defaults to 17.
+        resize (bool, optional): Keep the bilinear resize, see `ExportModel`.
+            Defaults to False.
+
+    Returns:
+        str: Path of the exported model.
+    """
+    if frontend and opset_version < 17:
+        raise ValueError("The frontend's STFT needs opset_version >= 17")
+    os.makedirs(save_directory, exist_ok=True)
+    export_model = ExportModel(model, frontend=frontend, resize=resize).cpu().eval()
+
+    cfg = model.cfg
+    if frontend:
+        input_name, example = "audio", torch.randn(2, cfg.audio.max_len)
+    else:
+        input_name, example = "spectrogram", torch.randn(2, *cfg.model.input_shape)
+
+    model_path = os.path.join(save_directory, "model.onnx")
+    # The TorchScript exporter, which the `dynamic_axes` API targets; torch >= 2.9
+    # defaults to the dynamo one
+    export_kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs["dynamo"] = False
+    with torch.no_grad():
+        torch.onnx.export(
+            export_model,
+            (example,),
+            model_path,
+            input_names=[input_name],
+            output_names=["logits"],
+            dynamic_axes={input_name: {0: "batch_size"}, "logits": {0: "batch_size"}},
+            opset_version=opset_version,
+            **export_kwargs,
+        )
+
+    with open(os.path.join(save_directory, "config.json"), "w", encoding="utf-8") as f:
+        json.dump(cfg2dict(cfg), f, indent=2, sort_keys=True)
+    return model_path
+
+
+def onnx_parity(model, save_directory, batch_size=2, seed=42):
+    """
+    Max absolute difference between the probabilities of `model` and its ONNX export.
+
+    Args:
+        model (AudioClassifier): Model the export was made from, in eval mode.
+        save_directory (str): Directory passed to `export_onnx`.
+        batch_size (int, optional): Number of random clips. Defaults to 2.
+        seed (int, optional): Random seed. Defaults to 42.
+
+    Returns:
+        float: Max absolute difference of the predicted probabilities.
+    """
+    audio = np.random.default_rng(seed).standard_normal(
+        (batch_size, model.cfg.audio.max_len), dtype=np.float32
+    )
+    engine = OnnxAudioClassifier.from_pretrained(save_directory)
+    return float(np.abs(model.predict(audio) - engine.predict(audio)).max())
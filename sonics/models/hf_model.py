@@ -1,7 +1,9 @@
 import os
 import json
+import warnings
 import torch
 import torch.nn as nn
+from .compress import compress_state_dict, decompress_state_dict
 from .model import AudioClassifier
 from ..utils.config import dict2cfg, cfg2dict
 from huggingface_hub import HfApi, create_repo, hf_hub_download
@@ -15,7 +17,27 @@ class HFAudioClassifier(AudioClassifier):
         super().__init__(self.config)
 
     @classmethod
-    def from_pretrained(cls, model_id, cache_dir=None, map_location="cpu", strict=False):
+    def from_pretrained(
+        cls,
+        model_id,
+        cache_dir=None,
+        map_location="cpu",
+        strict=False,
+        frontend=None,
+        compile_mode=None,
+    ):
+        """Load a model from a local directory or the Hugging Face Hub.
+
+        Args:
+            model_id (str): Local directory or repository ID on HuggingFace Hub
+            cache_dir (str, optional): Cache directory for downloaded files
+            map_location (str, optional): Device to load the weights on
+            strict (bool, optional): Whether to strictly enforce matching state_dict keys
+            frontend (str, optional): Overrides `melspec.backend`, e.g. "numpy" to compute
+                log-mel features without torchaudio on CPU inference hosts
+            compile_mode (str, optional): `torch.compile` mode (e.g. "default",
+                "reduce-overhead") to compile the model for any batch size and length
+        """
         # Check if model_id is a local path
         is_local = os.path.exists(model_id)
         
@@ -33,6 +55,8 @@ class HFAudioClassifier(AudioClassifier):
         if os.path.exists(config_file):
             with open(config_file, "r", encoding="utf-8") as f:
                 config = json.load(f)
+        if frontend is not None:
+            config["melspec"]["backend"] = frontend
 
         # Create model
         model = cls(config)
@@ -40,15 +64,35 @@ class HFAudioClassifier(AudioClassifier):
         # Load weights
         if os.path.exists(model_file):
             state_dict = torch.load(model_file, map_location=torch.device(map_location))
+            state_dict = decompress_state_dict(state_dict)  # fp16/int8 checkpoints
             model.load_state_dict(state_dict, strict=strict)
             model.eval()
         else:
             raise FileNotFoundError(f"Model weights not found at {model_file}")
 
+        # A bf16/fp16 frontend is only used once `check_frontend_precision` (train.py,
+        # test.py) has verified it with these weights, recorded in the saved config
+        precision = getattr(model.ft_extractor, "precision", "fp32")
+        if precision != "fp32" and not getattr(
+            model.cfg.melspec, "precision_checked", False
+        ):
+            warnings.warn(
+                f"melspec.precision {precision} wasn't verified for these weights "
+                "(melspec.precision_checked), falling back to fp32.",
+                RuntimeWarning,
+            )
+            model.ft_extractor.precision = "fp32"
+            model.cfg.melspec.precision = "fp32"
+
+        if compile_mode is not None:
+            model.set_compile(mode=compile_mode, dynamic=True)
+
         return model
 
 
-    def push_to_hub(self, repo_id, token=None, commit_message=None, private=False):
+    def push_to_hub(
+        self, repo_id, token=None, commit_message=None, private=False, weight_format="fp32"
+    ):
         """Push model and config to Hugging Face Hub.
         
         Args:
@@ -56,6 +100,7 @@ class HFAudioClassifier(AudioClassifier):
             token (str, optional): HuggingFace token. If None, will use token from ~/.huggingface/token
             commit_message (str, optional): Commit message for the push
             private (bool, optional): Whether to make the repository private
+            weight_format (str, optional): "fp32", "fp16" or "int8" (weight-only, per-channel)
         """
 
         # Create repo if it doesn't exist
@@ -72,7 +117,7 @@ class HFAudioClassifier(AudioClassifier):
             json.dump(config, f, indent=2, sort_keys=True)
 
         # Save model weights
-        torch.save(self.cpu().state_dict(), "pytorch_model.bin")
+        torch.save(compress_state_dict(self.cpu(), weight_format), "pytorch_model.bin")
         self.to(self.device if hasattr(self, 'device') else 'cuda' if torch.cuda.is_available() else 'cpu')  # restore device
 
         # Push files to hub
@@ -87,11 +132,12 @@ class HFAudioClassifier(AudioClassifier):
             )
             os.remove(file)  # Clean up local files
 
-    def save_pretrained(self, save_directory: str, **kwargs):
+    def save_pretrained(self, save_directory: str, weight_format="fp32", **kwargs):
         """Save model weights and configuration to a directory.
         
         Args:
             save_directory (str): Directory to save files in
+            weight_format (str, optional): "fp32", "fp16" or "int8" (weight-only, per-channel)
             **kwargs: Additional arguments passed to save functions
         """
         os.makedirs(save_directory, exist_ok=True)
@@ -104,5 +150,5 @@ class HFAudioClassifier(AudioClassifier):
 
         # Save model weights
         model_file = os.path.join(save_directory, "pytorch_model.bin")
-        torch.save(self.cpu().state_dict(), model_file)
+        torch.save(compress_state_dict(self.cpu(), weight_format), model_file)
         self.to(self.device if hasattr(self, 'device') else 'cuda' if torch.cuda.is_available() else 'cpu')  # restore device
\ No newline at end of file
@@ -0,0 +1,54 @@
+import torch
+import torch.nn as nn
+
+from sonics.layers.transformer import LowRankLinear
+
+
+def energy_rank(weight, energy):
+    """
+    Smallest rank whose singular values keep `energy` of the weight's squared
+    Frobenius norm (sum of S^2).
+    """
+    S = torch.linalg.svdvals(weight.detach().float())
+    cum_energy = (S**2).cumsum(dim=0) / (S**2).sum()
+    return min(int((cum_energy < energy).sum().item()) + 1, S.numel())
+
+
+def factorize_transformer(transformer, energy=0.9):
+    """
+    Replaces the `qkv`, `proj`, `fc1` and `fc2` layers of every block with rank-r
+    `LowRankLinear` layers initialized by truncated SVD, r keeping `energy` of each
+    weight. Layers whose rank wouldn't save weights stay full rank.
+
+    Args:
+        transformer (Transformer): Trained Transformer, factorized in place.
+        energy (float, optional): Fraction of the spectral energy kept, in (0, 1].
+            Defaults to 0.9.
+
+    Returns:
+        list: The new `model.layer_ranks`, per block [qkv, proj, fc1, fc2] ranks with
+            0 for full rank, needed to build the model for the checkpoint.
+    """
+    if not 0 < energy <= 1:
+        raise ValueError(f"energy must be in (0, 1], got {energy}")
+    layer_ranks = []
+    for block in transformer.blocks:
+        ranks = []
+        for parent, name in [
+            (block.attn, "qkv"),
+            (block.attn, "proj"),
+            (block.mlp, "fc1"),
+            (block.mlp, "fc2"),
+        ]:
+            linear = getattr(parent, name)
+            if not isinstance(linear, nn.Linear):
+                raise ValueError(f"{name} is already factorized")
+            rank = energy_rank(linear.weight, energy)
+            in_f, out_f = linear.in_features, linear.out_features
+            if rank * (in_f + out_f) >= in_f * out_f:
+                rank = 0
+            else:
+                setattr(parent, name, LowRankLinear.from_linear(linear, rank))
+            ranks.append(rank)
+        layer_ranks.append(ranks)
+    return layer_ranks
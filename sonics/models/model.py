@@ -1,7 +1,9 @@
-from sonics.models.spectttra import SpecTTTra
+from sonics.models.spectttra import HSpecTTTra, SpecTTTra
 from sonics.models.vit import ViT
-from sonics.layers.feature import FeatureExtractor
-from sonics.layers.augment import AugmentLayer
+from sonics.layers.feature import get_feature_extractor
+from sonics.layers.transformer import pool_tokens
+import warnings
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import timm
@@ -33,18 +35,63 @@ def use_init_weights(model_name):
     return False if any(x in model_name for x in has_init_weights) else True
 
 
+def get_example_input(cfg, batch_size):
+    """
+    Random model input: raw audio, or the spectrogram when the frontend runs in the
+    DataLoader workers (`melspec.placement: "worker"`).
+    """
+    if getattr(cfg.melspec, "placement", "model") == "worker":
+        return torch.randn((batch_size, *cfg.model.input_shape))
+    return torch.randn((batch_size, cfg.audio.max_len))
+
+
 class AudioClassifier(nn.Module):
     def __init__(self, cfg):
         super().__init__()
 
         self.model_name = cfg.model.name
         self.input_shape = cfg.model.input_shape
+        # SpecTTTra can score any number of frames in eval mode instead of resizing
+        self.variable_length = getattr(cfg.model, "variable_length", False)
+        if self.variable_length and self.model_name not in ("SpecTTTra", "HSpecTTTra"):
+            raise ValueError("model.variable_length is only supported for SpecTTTra")
+        # Eval batches carry each song's valid length, padding is masked out of the
+        # encoder's attention and pooling, see `frame_lengths`
+        if getattr(cfg.model, "padding_mask", False):
+            if "timm" in self.model_name:
+                raise ValueError(
+                    "model.padding_mask is only supported for SpecTTTra and ViT"
+                )
+            if getattr(cfg.model, "attn_window", None):
+                raise ValueError(
+                    "model.padding_mask and model.attn_window can't be combined"
+                )
         self.num_classes = cfg.num_classes
-        self.ft_extractor = FeatureExtractor(cfg)
-        self.augment = AugmentLayer(cfg)
+        self.cfg = cfg
+        self.ft_extractor = get_feature_extractor(cfg)
+        # "worker": inputs are spectrograms computed by `WorkerFeatureExtractor`
+        self.frontend_placement = getattr(cfg.melspec, "placement", "model")
+        self.augment = None  # built on first training step, see `augment_spec`
         self.encoder = self.get_encoder(cfg)
+        self.channels_last = False  # see `set_channels_last`
+        if getattr(cfg.model, "channels_last", False):
+            self.set_channels_last(True)
         self.embed_dim = get_embed_dim(self.model_name, self.encoder)
         self.classifier = nn.Linear(self.embed_dim, self.num_classes)
+        # Early exit: extra heads after `model.exit_blocks` blocks, trained jointly (or
+        # distilled from the final head), used in eval when `model.exit_threshold` is set
+        self.exit_blocks = list(getattr(cfg.model, "exit_blocks", None) or [])
+        self.exit_threshold = getattr(cfg.model, "exit_threshold", None)
+        self.exit_loss_weight = getattr(cfg.model, "exit_loss_weight", 0.3)
+        self.exit_distill = getattr(cfg.model, "exit_distill", False)
+        early_exit = self.exit_blocks or self.exit_threshold is not None
+        if early_exit and "timm" in self.model_name:
+            raise ValueError("Early exit is only supported for SpecTTTra and ViT")
+        self.exit_heads = nn.ModuleDict(
+            {str(d): nn.Linear(self.embed_dim, self.num_classes) for d in self.exit_blocks}
+        )
+        self.exit_logits = {}  # depth -> logits of the last training forward
+        self.exit_depth = None  # blocks run per sample in the last early-exit forward
         self.use_init_weights = getattr(cfg.model, "use_init_weights", True)
 
         # Initialize weights
@@ -55,8 +102,17 @@ class AudioClassifier(nn.Module):
         )
 
     def get_encoder(self, cfg):
-        if cfg.model.name == "SpecTTTra":
-            model = SpecTTTra(
+        if cfg.model.name in ("SpecTTTra", "HSpecTTTra"):
+            # HSpecTTTra pools the temporal tokens between `model.stage_depths` stages
+            stage_kwargs = {}
+            if cfg.model.name == "HSpecTTTra":
+                stage_kwargs = dict(
+                    stage_depths=getattr(cfg.model, "stage_depths", None),
+                    temporal_stride=getattr(cfg.model, "temporal_stride", 2),
+                    spectral_stride=getattr(cfg.model, "spectral_stride", 1),
+                )
+            encoder_cls = HSpecTTTra if cfg.model.name == "HSpecTTTra" else SpecTTTra
+            model = encoder_cls(
                 input_spec_dim=cfg.model.input_shape[0],
                 input_temp_dim=cfg.model.input_shape[1],
                 embed_dim=cfg.model.embed_dim,
@@ -70,6 +126,17 @@ class AudioClassifier(nn.Module):
                 attn_drop_rate=getattr(cfg.model, "attn_drop_rate", 0.0),
                 proj_drop_rate=getattr(cfg.model, "proj_drop_rate", 0.0),
                 mlp_ratio=getattr(cfg.model, "mlp_ratio", 4.0),
+                merge_ratio=getattr(cfg.model, "merge_ratio", 0.0),
+                attn_window=getattr(cfg.model, "attn_window", None),
+                attn_shift=getattr(cfg.model, "attn_shift", True),
+                grad_checkpointing=getattr(cfg.model, "grad_checkpointing", 0),
+                exit_blocks=getattr(cfg.model, "exit_blocks", None),
+                attn_type=getattr(cfg.model, "attn_type", "softmax"),
+                layer_dims=getattr(cfg.model, "layer_dims", None),
+                layer_ranks=getattr(cfg.model, "layer_ranks", None),
+                attn_backend=getattr(cfg.model, "attn_backend", "auto"),
+                fused_tokenizer=getattr(cfg.model, "fused_tokenizer", False),
+                **stage_kwargs,
             )
         elif cfg.model.name == "ViT":
             model = ViT(
@@ -84,6 +151,15 @@ class AudioClassifier(nn.Module):
                 attn_drop_rate=getattr(cfg.model, "attn_drop_rate", 0.0),
                 proj_drop_rate=getattr(cfg.model, "proj_drop_rate", 0.0),
                 mlp_ratio=getattr(cfg.model, "mlp_ratio", 4.0),
+                merge_ratio=getattr(cfg.model, "merge_ratio", 0.0),
+                attn_window=getattr(cfg.model, "attn_window", None),
+                attn_shift=getattr(cfg.model, "attn_shift", True),
+                grad_checkpointing=getattr(cfg.model, "grad_checkpointing", 0),
+                exit_blocks=getattr(cfg.model, "exit_blocks", None),
+                attn_type=getattr(cfg.model, "attn_type", "softmax"),
+                layer_dims=getattr(cfg.model, "layer_dims", None),
+                layer_ranks=getattr(cfg.model, "layer_ranks", None),
+                attn_backend=getattr(cfg.model, "attn_backend", "auto"),
             )
         elif "timm" in cfg.model.name:
             model_name = cfg.model.name.replace("timm-", "")
@@ -93,25 +169,215 @@ class AudioClassifier(nn.Module):
                 in_chans=1,
                 num_classes=0,
             )
+            if getattr(cfg.model, "grad_checkpointing", 0):
+                model.set_grad_checkpointing(True)
         else:
             raise ValueError(f"Model {cfg.model.name} not supported in V1.")
         return model
 
-    def forward(self, audio, y=None):
-        spec = self.ft_extractor(audio)  # shape: (batch_size, n_mels, n_frames)
-        if self.training:
-            spec, y = self.augment(spec, y)
-        spec = spec.unsqueeze(1)  # shape: (batch_size, 1, n_mels, n_frames)
-        spec = F.interpolate(spec, size=tuple(self.input_shape), mode="bilinear")
-        features = self.encoder(spec)
-        embeds = features.mean(dim=1) if use_global_pool(self.model_name) else features
+    def forward(self, audio, y=None, lengths=None):
+        spec, y = self.get_spec(audio, y, lengths)
+        frames = None if lengths is None else self.frame_lengths(lengths, audio, spec)
+        if self.exit_threshold is not None and not self.training:
+            preds = self.forward_early_exit(spec, frames)
+            return preds if y is None else (preds, y)
+
+        self.exit_depth = None
+        features = self.encoder(spec) if frames is None else self.encoder(spec, frames)
+        embeds = self.pool(features) if use_global_pool(self.model_name) else features
         preds = self.classifier(embeds)
+        self.exit_logits = {}
+        if self.training and self.exit_blocks:  # SpecTTTra/ViT only, see __init__
+            self.exit_logits = {
+                d: self.exit_heads[str(d)](feat)
+                for d, feat in self.encoder.transformer.exit_features.items()
+            }
         return preds if y is None else (preds, y)
 
+    @torch.no_grad()
+    def predict(self, audio, lengths=None):
+        """
+        Probabilities for a batch of waveforms (the model should be in eval mode).
+
+        Args:
+            audio (np.ndarray or torch.Tensor): Waveforms of shape (batch_size, n_samples)
+                or (n_samples,).
+            lengths (array-like, optional): Valid samples of each zero-padded waveform,
+                padding is masked out (SpecTTTra/ViT). Defaults to None.
+
+        Returns:
+            np.ndarray: Probabilities of shape (batch_size, num_classes).
+        """
+        device = next(self.parameters()).device
+        audio = torch.as_tensor(audio, dtype=torch.float32, device=device)
+        if audio.dim() == 1:
+            audio = audio.unsqueeze(0)
+        if lengths is not None:
+            lengths = torch.as_tensor(lengths, device=device).reshape(-1)
+        if self.frontend_placement == "worker":
+            n_samples = audio.size(-1)
+            audio = self.ft_extractor(audio, lengths)
+            if lengths is not None:  # valid samples -> valid frames
+                lengths = (lengths * audio.size(-1) / n_samples).ceil()
+        return torch.sigmoid(self(audio, lengths=lengths).float()).cpu().numpy()
+
+    def get_spec(self, audio, y=None, lengths=None):
+        """
+        Encoder input of shape (batch_size, 1, n_mels, n_frames), with augmentation
+        applied in training. With the valid `lengths` of a padded batch, the frontend
+        normalizes each song over its own frames, so it scores as it would alone.
+        """
+        if self.frontend_placement == "worker":
+            # Computed per song by `WorkerFeatureExtractor` before padding
+            spec = audio.float()  # shape: (batch_size, n_mels, n_frames)
+        else:
+            spec = self.ft_extractor(audio, lengths)  # (batch_size, n_mels, n_frames)
+        if self.training:
+            spec, y = self.augment_spec(spec, y)
+        spec = spec.unsqueeze(1)  # shape: (batch_size, 1, n_mels, n_frames)
+        if spec.shape[-2:] != tuple(self.input_shape) and not self.keep_length(spec):
+            warnings.warn(
+                f"Spectrogram shape {tuple(spec.shape[-2:])} doesn't match input_shape "
+                f"{tuple(self.input_shape)}, falling back to bilinear resize.",
+                RuntimeWarning,
+            )
+            spec = F.interpolate(spec, size=tuple(self.input_shape), mode="bilinear")
+        if self.channels_last:
+            spec = spec.contiguous(memory_format=torch.channels_last)
+        return spec, y
+
+    def forward_early_exit(self, spec, lengths=None):
+        """
+        Logits from the first head (exit heads, then the final classifier) whose
+        confidence reaches `exit_threshold`; the depth each sample exited at is kept in
+        `exit_depth`. `lengths` are the valid frames of a padded batch.
+        """
+        transformer = self.encoder.transformer
+        heads = {int(d): head for d, head in self.exit_heads.items()}
+        heads[len(transformer.blocks)] = self.classifier
+        token_mask = None if lengths is None else self.encoder.token_mask(lengths, spec)
+        preds, self.exit_depth = transformer.forward_early_exit(
+            self.encoder.embed(spec, lengths),
+            heads,
+            self.exit_threshold,
+            token_mask=token_mask,
+        )
+        return preds
+
+    def exit_loss(self, criterion, preds, y):
+        """
+        Weighted mean loss of the early-exit heads from the last training forward,
+        against `y` or, with `model.exit_distill`, the final head's probabilities.
+
+        Args:
+            criterion (nn.Module): Loss function.
+            preds (torch.Tensor): Squeezed logits of the final head.
+            y (torch.Tensor): Targets.
+        """
+        if not self.exit_logits:
+            return 0.0
+        target = torch.sigmoid(preds.detach().float()) if self.exit_distill else y
+        losses = [
+            criterion(logits.squeeze(-1), target) for logits in self.exit_logits.values()
+        ]
+        return self.exit_loss_weight * sum(losses) / len(losses)
+
+    def pool(self, features):
+        """
+        Mean over tokens, weighted by the number of original tokens each one stands for
+        when the transformer merges tokens; padding tokens are left out.
+        """
+        return pool_tokens(features, self.encoder.transformer.token_sizes)
+
+    def compile_targets(self):
+        """
+        Submodules `set_compile` compiles: the torchaudio frontend (when it runs in the
+        model) and the encoder. Augmentation, early exit and the numpy frontend stay
+        eager, so their data-dependent Python never breaks the compiled graphs.
+        """
+        targets = {}
+        if (
+            self.frontend_placement == "model"
+            and getattr(self.cfg.melspec, "backend", "torchaudio") == "torchaudio"
+        ):
+            targets["frontend"] = self.ft_extractor
+        targets["encoder"] = self.encoder
+        return targets
+
+    def set_compile(self, mode="default", dynamic=None):
+        """
+        Compiles `compile_targets` in place with `torch.compile`, state_dict keys are
+        unchanged so checkpoints load and save as usual.
+
+        Args:
+            mode (str, optional): torch.compile mode, e.g. "default", "reduce-overhead"
+                or "max-autotune". Defaults to "default".
+            dynamic (bool, optional): Compile for any batch size and length (True), or
+                let torch.compile switch to dynamic shapes on recompilation (None).
+                Defaults to None.
+        """
+        for module in self.compile_targets().values():
+            module.compile(mode=mode, dynamic=dynamic)
+
+    def set_channels_last(self, enabled=True):
+        """
+        Runs the timm CNN encoder and its input in channels-last (NHWC) memory format,
+        where cuDNN/oneDNN have faster (depthwise) conv kernels. Weights are unchanged,
+        so it can be switched on any checkpoint.
+        """
+        if enabled and "timm" not in self.model_name:
+            raise ValueError("Channels-last is only supported for timm encoders")
+        self.channels_last = enabled
+        self.encoder.to(
+            memory_format=torch.channels_last if enabled else torch.contiguous_format
+        )
+
+    def set_token_merging(self, merge_ratio):
+        """
+        Sets the fraction of tokens merged after every transformer block (0 disables it).
+        Merging has no parameters, so it can be switched on any trained checkpoint.
+        """
+        if "timm" in self.model_name:
+            raise ValueError("Token merging is only supported for SpecTTTra and ViT")
+        if merge_ratio and getattr(self.cfg.model, "attn_window", None):
+            raise ValueError("Token merging and windowed attention can't be combined")
+        self.encoder.transformer.merge_ratio = merge_ratio
+
+    def frame_lengths(self, lengths, audio, spec):
+        """
+        Valid frames (B,) of each spectrogram in a padded batch, from the valid
+        `lengths` (B,) along the last axis of `audio` (samples, or frames with
+        `melspec.placement: "worker"`). Scaling by the padded length keeps them right
+        when `get_spec` resizes the spectrogram.
+        """
+        if "timm" in self.model_name:
+            raise ValueError("Padding masks are only supported for SpecTTTra and ViT")
+        frames = (lengths.float() / audio.size(-1) * spec.size(-1)).ceil().long()
+        return frames.clamp(1, spec.size(-1))
+
+    def keep_length(self, spec):
+        """
+        Whether `spec` is passed to the encoder with its own number of frames.
+        """
+        return (
+            self.variable_length
+            and not self.training
+            and spec.size(-2) == self.input_shape[0]
+            and spec.size(-1) >= self.encoder.t_clip
+        )
+
+    def augment_spec(self, spec, y=None):
+        if self.augment is None:
+            # Imported lazily so inference never loads torchaudio/torchvision for it
+            from sonics.layers.augment import AugmentLayer
+
+            self.augment = AugmentLayer(self.cfg)
+        return self.augment(spec, y)
+
     def initialize_weights(self):
         for name, module in self.named_modules():
             if isinstance(module, nn.Linear):
-                if name.startswith("classifier"):
+                if name.startswith(("classifier", "exit_heads")):
                     nn.init.zeros_(module.weight)
                     nn.init.constant_(module.bias, 0.0)
                 else:
@@ -0,0 +1,140 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from sonics.layers.transformer import LowRankLinear
+
+
+def layer_dims(transformer):
+    """
+    Per-block [num_heads, mlp_hidden_dim] of a Transformer, the `model.layer_dims` spec.
+    """
+    return [
+        [block.attn.num_heads, block.mlp.fc1.out_features]
+        for block in transformer.blocks
+    ]
+
+
+def importance_scores(model, dataloader, device, num_batches=8):
+    """
+    First-order Taylor importance (|sum of weight * grad|, Molchanov et al., 2019) of
+    every attention head and MLP hidden channel of a SpecTTTra/ViT `AudioClassifier`,
+    accumulated over `num_batches` batches of `dataloader`.
+
+    Returns:
+        Tuple[list, list]: Per-block head scores (num_heads,) and MLP channel scores
+            (mlp_hidden_dim,).
+    """
+    if "timm" in model.model_name:
+        raise ValueError("Pruning is only supported for SpecTTTra and ViT")
+    if any(isinstance(m, LowRankLinear) for m in model.encoder.modules()):
+        raise ValueError("Pruning doesn't support low-rank (`layer_ranks`) layers")
+    blocks = model.encoder.transformer.blocks
+    head_scores = [torch.zeros(b.attn.num_heads, device=device) for b in blocks]
+    mlp_scores = [torch.zeros(b.mlp.fc1.out_features, device=device) for b in blocks]
+
+    # Eval mode for deterministic features, without early exit, which runs no_grad
+    exit_threshold, model.exit_threshold = model.exit_threshold, None
+    model.eval()
+    for step, batch in enumerate(dataloader):
+        if step >= num_batches:
+            break
+        x, y = batch["audio"].to(device), batch["target"].to(device)
+        model.zero_grad()
+        loss = F.binary_cross_entropy_with_logits(model(x).squeeze(-1).float(), y)
+        loss.backward()
+
+        for idx, block in enumerate(blocks):
+            attn, mlp = block.attn, block.mlp
+            H, D = attn.num_heads, attn.head_dim
+            score = (attn.qkv.weight * attn.qkv.weight.grad).reshape(3, H, D, -1)
+            score = score.sum(dim=(0, 2, 3))
+            score += (attn.proj.weight * attn.proj.weight.grad).reshape(-1, H, D).sum(
+                dim=(0, 2)
+            )
+            head_scores[idx] += score.abs().detach()
+
+            score = (mlp.fc1.weight * mlp.fc1.weight.grad).sum(dim=1)
+            score += (mlp.fc2.weight * mlp.fc2.weight.grad).sum(dim=0)
+            mlp_scores[idx] += score.abs().detach()
+    model.zero_grad()
+    model.exit_threshold = exit_threshold
+    return head_scores, mlp_scores
+
+
+def keep_top(scores, ratio):
+    """
+    Indices (sorted, per block) of the scores kept when the lowest `ratio` of all
+    blocks' scores is pruned, ranked globally so blocks can shrink unevenly. At least
+    one entry per block is kept.
+    """
+    if not ratio:
+        return [torch.arange(s.numel(), device=s.device) for s in scores]
+    # Normalize per block so the ranking isn't dominated by the scale of one layer
+    scores = [s / s.sum().clamp(min=1e-12) for s in scores]
+    num_prune = int(sum(s.numel() for s in scores) * ratio)
+    threshold = torch.cat(scores).sort().values[num_prune]
+    keep = []
+    for s in scores:
+        idx = (s >= threshold).nonzero().squeeze(-1)
+        keep.append(idx if idx.numel() else s.argmax().reshape(1))
+    return keep
+
+
+def prune_linear(linear, index, dim):
+    """
+    Copy of `linear` that keeps `index` of its outputs (dim=0) or inputs (dim=1).
+    """
+    weight = linear.weight.index_select(dim, index)
+    bias = linear.bias
+    if bias is not None and dim == 0:
+        bias = bias.index_select(0, index)
+    out = nn.Linear(weight.size(1), weight.size(0), bias=bias is not None)
+    out.to(weight.device, weight.dtype)
+    with torch.no_grad():
+        out.weight.copy_(weight)
+        if bias is not None:
+            out.bias.copy_(bias)
+    return out
+
+
+@torch.no_grad()
+def prune_transformer(
+    transformer, head_scores, mlp_scores, head_ratio=0.0, mlp_ratio=0.0
+):
+    """
+    Structured pruning: physically removes the least important attention heads and
+    MLP channels, shrinking `qkv`, `proj`, `fc1` and `fc2`, so the pruned model runs
+    dense and faster instead of multiplying by zeros.
+
+    Args:
+        transformer (Transformer): Transformer to prune in place.
+        head_scores (list): Per-block head importance, see `importance_scores`.
+        mlp_scores (list): Per-block MLP channel importance.
+        head_ratio (float, optional): Fraction of all heads removed. Defaults to 0.0.
+        mlp_ratio (float, optional): Fraction of all MLP channels removed.
+            Defaults to 0.0.
+
+    Returns:
+        list: The new `model.layer_dims`, needed to build the model for the checkpoint.
+    """
+    if not (0 <= head_ratio < 1 and 0 <= mlp_ratio < 1):
+        raise ValueError("head_ratio and mlp_ratio must be in [0, 1)")
+    if any(not isinstance(block.mlp.norm, nn.Identity) for block in transformer.blocks):
+        raise ValueError("Pruning doesn't support Mlp with a hidden norm")
+
+    head_keep = keep_top(head_scores, head_ratio)
+    mlp_keep = keep_top(mlp_scores, mlp_ratio)
+    for block, heads, channels in zip(transformer.blocks, head_keep, mlp_keep):
+        attn, mlp = block.attn, block.mlp
+        D = attn.head_dim
+        # qkv rows are laid out (3, heads, head_dim), proj columns (heads, head_dim)
+        cols = (heads[:, None] * D + torch.arange(D, device=heads.device)).reshape(-1)
+        rows = torch.cat([cols + i * attn.num_heads * D for i in range(3)])
+        attn.qkv = prune_linear(attn.qkv, rows, dim=0)
+        attn.proj = prune_linear(attn.proj, cols, dim=1)
+        attn.num_heads = heads.numel()
+
+        mlp.fc1 = prune_linear(mlp.fc1, channels, dim=0)
+        mlp.fc2 = prune_linear(mlp.fc2, channels, dim=1)
+    return layer_dims(transformer)
@@ -0,0 +1,83 @@
+import copy
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import (
+    DeQuantStub,
+    QuantStub,
+    convert,
+    get_default_qconfig,
+    prepare,
+    quantize_dynamic,
+)
+
+
+class StaticQuantConv(nn.Module):
+    def __init__(self, conv):
+        """
+        Wraps a float conv so eager-mode static quantization turns it into an int8 conv
+        with float input and output.
+
+        Args:
+            conv (nn.Module): Conv1d or Conv2d to quantize.
+        """
+        super().__init__()
+        self.quant = QuantStub()
+        self.conv = conv
+        self.dequant = DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.conv(self.quant(x)))
+
+
+def get_tokenizer_convs(encoder):
+    """
+    Returns (parent, name) of the tokenizer/patch-embedding convs of SpecTTTra or ViT.
+    """
+    tokenizer = getattr(encoder, "st_tokenizer", None) or getattr(
+        encoder, "patch_encoder", None
+    )
+    if tokenizer is None:
+        raise ValueError("Static quantization is only supported for SpecTTTra and ViT")
+    if getattr(encoder, "fused_tokenizer", False):
+        raise ValueError("Static quantization needs the unfused tokenizer")
+    return [
+        (parent, name)
+        for parent in tokenizer.modules()
+        for name, child in parent.named_children()
+        if isinstance(child, (nn.Conv1d, nn.Conv2d))
+    ]
+
+
+def quantize_model(model, calib_batches=None, backend="x86"):
+    """
+    Post-training int8 quantization of an `AudioClassifier` for CPU inference. All
+    `nn.Linear` layers (attention, `Mlp`, classifier) are dynamically quantized, and
+    with `calib_batches` the tokenizer convs are statically quantized as well. The
+    log-mel frontend stays in float32.
+
+    Args:
+        model (AudioClassifier): Trained float model, left untouched.
+        calib_batches (Iterable, optional): Model inputs used to calibrate the static
+            quantization of the tokenizer convs. None skips it. Defaults to None.
+        backend (str, optional): Quantized engine, "x86", "fbgemm" or "qnnpack".
+            Defaults to "x86".
+
+    Returns:
+        AudioClassifier: Quantized copy of the model, on CPU in eval mode.
+    """
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).cpu().eval()
+
+    if calib_batches is not None:
+        for parent, name in get_tokenizer_convs(model.encoder):
+            wrapped = StaticQuantConv(getattr(parent, name))
+            wrapped.qconfig = get_default_qconfig(backend)
+            setattr(parent, name, wrapped)
+        prepare(model, inplace=True)
+        with torch.no_grad():
+            for x in calib_batches:
+                model(x)
+        convert(model, inplace=True)
+
+    return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
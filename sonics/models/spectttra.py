@@ -1,6 +1,7 @@
+import torch
 import torch.nn as nn
 from sonics.layers import Transformer
-from sonics.layers.tokenizer import STTokenizer
+from sonics.layers.tokenizer import STTokenizer, FusedSTTokenizer
 
 
 class SpecTTTra(nn.Module):
@@ -19,6 +20,19 @@ class SpecTTTra(nn.Module):
         attn_drop_rate=0.0,
         proj_drop_rate=0.0,
         mlp_ratio=4.0,
+        merge_ratio=0.0,
+        attn_window=None,
+        attn_shift=True,
+        grad_checkpointing=0,
+        exit_blocks=None,
+        attn_type="softmax",
+        layer_dims=None,
+        layer_ranks=None,
+        attn_backend="auto",
+        fused_tokenizer=False,
+        stage_depths=None,
+        temporal_stride=2,
+        spectral_stride=1,
     ):
         super(SpecTTTra, self).__init__()
         self.input_spec_dim = input_spec_dim
@@ -36,8 +50,10 @@ class SpecTTTra(nn.Module):
         self.attn_drop_rate = attn_drop_rate
         self.proj_drop_rate = proj_drop_rate
         self.mlp_ratio = mlp_ratio
+        self.fused_tokenizer = fused_tokenizer  # same weights, single-pass tokenization
 
-        self.st_tokenizer = STTokenizer(
+        tokenizer_cls = FusedSTTokenizer if fused_tokenizer else STTokenizer
+        self.st_tokenizer = tokenizer_cls(
             input_spec_dim,
             input_temp_dim,
             t_clip,
@@ -54,25 +70,81 @@ class SpecTTTra(nn.Module):
             attn_drop=self.attn_drop_rate,
             proj_drop=self.proj_drop_rate,
             mlp_ratio=self.mlp_ratio,
+            merge_ratio=merge_ratio,
+            attn_window=attn_window,
+            attn_shift=attn_shift,
+            grad_checkpointing=grad_checkpointing,
+            exit_blocks=exit_blocks,
+            attn_type=attn_type,
+            layer_dims=layer_dims,
+            layer_ranks=layer_ranks,
+            attn_backend=attn_backend,
+            stage_depths=stage_depths,
+            temporal_stride=temporal_stride,
+            spectral_stride=spectral_stride,
+            # Spectral tokens summarize the whole clip, so they stay global when the
+            # temporal tokens use windowed attention
+            num_global_tokens=self.st_tokenizer.num_spectral_tokens,
         )
 
-    def forward(self, x):
+    def embed(self, x, lengths=None):
+        """
+        Tokens fed to the transformer, shape (B, T/t + F/f, dim). `lengths` (B,) are
+        the valid frames of a padded batch.
+        """
         # Squeeze the channel dimension if it exists
         if x.dim() == 4:
             x = x.squeeze(1)
 
         # Spectro-temporal tokenization
-        spectro_temporal_tokens = self.st_tokenizer(x)
+        spectro_temporal_tokens = self.st_tokenizer(x, lengths)
 
         # Positional dropout
         spectro_temporal_tokens = self.pos_drop(spectro_temporal_tokens)
+        return spectro_temporal_tokens
+
+    def token_mask(self, lengths, x):
+        """
+        Valid tokens (B, T/t + F/f) of a padded batch `x` with `lengths` (B,) valid
+        frames: temporal tokens with at least one valid frame, and every spectral token.
+        """
+        t_clip = self.st_tokenizer.t_clip
+        start = torch.arange(x.size(-1) // t_clip, device=lengths.device) * t_clip
+        temporal = start[None] < lengths[:, None]
+        num_spectral = self.st_tokenizer.num_spectral_tokens
+        spectral = temporal.new_ones(lengths.size(0), num_spectral)
+        return torch.cat([temporal, spectral], dim=1)
+
+    def forward(self, x, lengths=None):
+        spectro_temporal_tokens = self.embed(x, lengths)
+        token_mask = None if lengths is None else self.token_mask(lengths, x)
 
         # Transformer
-        output = self.transformer(spectro_temporal_tokens)  # shape: (B, T/t + F/f, dim)
+        output = self.transformer(
+            spectro_temporal_tokens, token_mask=token_mask
+        )  # shape: (B, T/t + F/f, dim)
 
         return output
 
 
+class HSpecTTTra(SpecTTTra):
+    """
+    Hierarchical SpecTTTra: the same tokenizer and blocks split into stages, with the
+    temporal tokens average-pooled by `temporal_stride` (and the spectral tokens by
+    `spectral_stride`, 1 keeps them intact) between stages. Early blocks see every
+    t_clip-frame token, later ones far fewer, which makes fine clips cheaper.
+    """
+
+    def __init__(self, num_layers, stage_depths=None, **kwargs):
+        if stage_depths is None:
+            # Three stages of equal depth, the remainder goes to the first ones
+            stage_depths = [num_layers // 3 + (i < num_layers % 3) for i in range(3)]
+        super(HSpecTTTra, self).__init__(
+            num_layers=num_layers, stage_depths=stage_depths, **kwargs
+        )
+        self.stage_depths = stage_depths
+
+
 # Example usage:
 input_spec_dim = 384
 input_temp_dim = 128
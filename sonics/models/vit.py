@@ -22,6 +22,15 @@ class ViT(nn.Module):
         attn_drop_rate=0.0,
         proj_drop_rate=0.0,
         mlp_ratio=4.0,
+        merge_ratio=0.0,
+        attn_window=None,
+        attn_shift=True,
+        grad_checkpointing=0,
+        exit_blocks=None,
+        attn_type="softmax",
+        layer_dims=None,
+        layer_ranks=None,
+        attn_backend="auto",
     ):
         super().__init__()
         assert (
@@ -38,6 +47,7 @@ class ViT(nn.Module):
         self.attn_drop_rate = attn_drop_rate
         self.proj_drop_rate = proj_drop_rate
         self.mlp_ratio = mlp_ratio
+        self.attn_window = attn_window
 
         self.num_patches = (image_size[0] // patch_size) * (image_size[1] // patch_size)
 
@@ -65,9 +75,22 @@ class ViT(nn.Module):
             attn_drop=self.attn_drop_rate,
             proj_drop=self.proj_drop_rate,
             mlp_ratio=self.mlp_ratio,
+            merge_ratio=merge_ratio,
+            attn_window=attn_window,
+            attn_shift=attn_shift,
+            grad_checkpointing=grad_checkpointing,
+            exit_blocks=exit_blocks,
+            attn_type=attn_type,
+            layer_dims=layer_dims,
+            layer_ranks=layer_ranks,
+            attn_backend=attn_backend,
         )
 
-    def forward(self, x):
+    def embed(self, x, lengths=None):
+        """
+        Tokens fed to the transformer, shape (B, num_patches, embed_dim). Patches don't
+        mix frames, so `lengths` of a padded batch only matter for `token_mask`.
+        """
         B = x.shape[0]
         # x = x.unsqueeze(1)  # B x 1 x n_mels x n_frames # taken care of in the AudioClassifier
         if x.dim() == 3:
@@ -89,8 +112,34 @@ class ViT(nn.Module):
         # Positional dropout
         embeddings = self.pos_drop(embeddings)
 
+        # Windowed attention runs along time: order the patches time-major so that a
+        # window covers consecutive time columns across all mel rows
+        if self.attn_window:
+            grid_h, grid_w = x.size(-2) // self.patch_size, x.size(-1) // self.patch_size
+            embeddings = embeddings.reshape(B, grid_h, grid_w, -1).transpose(1, 2)
+            embeddings = embeddings.reshape(B, grid_h * grid_w, -1)
+        return embeddings
+
+    def token_mask(self, lengths, x):
+        """
+        Valid patches (B, num_patches) of a padded batch `x` with `lengths` (B,) valid
+        frames: patches with at least one valid frame, in mel-major order (padding masks
+        can't be combined with the time-major order of windowed attention).
+        """
+        grid_h, grid_w = x.size(-2) // self.patch_size, x.size(-1) // self.patch_size
+        start = torch.arange(grid_w, device=lengths.device) * self.patch_size
+        valid = start[None] < lengths[:, None]  # (B, grid_w)
+        mask = valid[:, None, :].expand(-1, grid_h, grid_w)
+        return mask.reshape(lengths.size(0), grid_h * grid_w)
+
+    def forward(self, x, lengths=None):
+        embeddings = self.embed(x)
+        token_mask = None if lengths is None else self.token_mask(lengths, x)
+
         # Transformer encoding
-        output = self.transformer(embeddings)  # B x num_patches x embed_dim
+        output = self.transformer(
+            embeddings, token_mask=token_mask
+        )  # B x num_patches x embed_dim
 
         return output
 
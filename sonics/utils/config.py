@@ -10,9 +10,46 @@ def dict2cfg(d):
             d[k] = SimpleNamespace(**v)
     c = SimpleNamespace(**d)
     c.audio.max_len = int(c.audio.max_time * c.audio.sample_rate)
+    fit_melspec_to_input(c)
     return c
 
 
+def fit_melspec_to_input(cfg):
+    """
+    Derives `melspec.hop_length` and `melspec.n_frames` so that the (centered) STFT of
+    `audio.max_len` samples yields exactly `model.input_shape` after trimming a few
+    trailing frames, making the bilinear resize in `AudioClassifier` unnecessary.
+
+    The largest hop with at least `n_frames` frames is used, so the spectrogram still
+    spans the whole clip, e.g. 120s -> hop 512 (3751 -> 3744), 5s -> hop 629 (128).
+
+    Opt-in with `melspec.fit_input_shape: true`, for configs trained from scratch: it
+    changes the spectrograms (hop length, or a frame trim instead of the resize), so
+    checkpoints trained without it lose accuracy when it's turned on.
+    """
+    melspec = getattr(cfg, "melspec", None)
+    model = getattr(cfg, "model", None)
+    input_shape = getattr(model, "input_shape", None)
+    if melspec is None or input_shape is None:
+        return cfg
+    if not getattr(melspec, "fit_input_shape", False):
+        return cfg
+
+    n_mels, n_frames = input_shape
+    # Mel bins can't be derived from the STFT, leave mismatches to the resize fallback
+    if melspec.n_mels != n_mels or n_frames < 2:
+        return cfg
+
+    # Centered STFT: num_frames = max_len // hop_length + 1
+    hop_length = cfg.audio.max_len // (n_frames - 1)
+    if hop_length < 1:
+        return cfg
+
+    melspec.hop_length = hop_length
+    melspec.n_frames = n_frames
+    return cfg
+
+
 def cfg2dict(cfg):
     """
     Converts a SimpleNamespace into a dictionary without modifying the original cfg.
@@ -1,8 +1,9 @@
 from torch.utils.data import Dataset
 from torch.utils.data import DataLoader
+from torch.utils.data import default_collate
 import numpy as np
 import torch
-import librosa
+import torch.nn.functional as F
 
 
 class AudioDataset(Dataset):
@@ -16,6 +17,9 @@ class AudioDataset(Dataset):
         max_len=32000,
         random_sampling=True,
         train=False,
+        transform=None,
+        teacher_logits=None,
+        return_length=False,
         **kwargs
     ):
         super().__init__(**kwargs)
@@ -27,10 +31,16 @@ class AudioDataset(Dataset):
         self.normalize = normalize
         self.max_len = max_len
         self.train = train
+        self.transform = transform
+        self.teacher_logits = teacher_logits  # cached for knowledge distillation
+        # Valid (unpadded) length of each item, for the model's padding masks
+        self.return_length = return_length
         if not self.train:
             assert (
                 not self.random_sampling
             ), "Ensure random_sampling is disabled for val"
+        if self.return_length and self.random_sampling:
+            raise ValueError("return_length needs random_sampling disabled")
 
     def __len__(self):
         return len(self.filepaths)
@@ -60,6 +70,8 @@ class AudioDataset(Dataset):
         return audio
 
     def __getitem__(self, idx):
+        import librosa  # imported lazily, it's slow to load and unused for inference
+
         # Load audio
         audio, sr = librosa.load(self.filepaths[idx], sr=None)
         target = np.array([self.labels[idx]])
@@ -69,8 +81,10 @@ class AudioDataset(Dataset):
             skip_time = self.skip_times[idx]
             audio = audio[int(skip_time*sr):]
 
-        # Ensure fixed length
-        audio = self.crop_or_pad(audio, self.max_len, self.random_sampling)
+        # Ensure fixed length, `max_len=None` keeps the whole song (variable-length inference)
+        length = len(audio) if self.max_len is None else min(len(audio), self.max_len)
+        if self.max_len is not None:
+            audio = self.crop_or_pad(audio, self.max_len, self.random_sampling)
 
         if self.normalize == "std":
             audio /= np.maximum(np.std(audio), 1e-6)
@@ -78,12 +92,38 @@ class AudioDataset(Dataset):
             audio -= np.min(audio)
             audio /= np.maximum(np.max(audio), 1e-6)
 
+        n_samples = len(audio)
         audio = torch.from_numpy(audio).float()
+        if self.transform is not None:
+            audio = self.transform(audio)  # e.g. log-mel computed in the worker
         target = torch.from_numpy(target).float().squeeze()
-        return {
+        item = {
             "audio": audio,
             "target": target,
         }
+        if self.teacher_logits is not None:
+            item["teacher_logit"] = torch.tensor(self.teacher_logits[idx]).float()
+        if self.return_length:
+            # Along the last axis of `audio`: samples, or frames of a worker spectrogram
+            item["length"] = torch.tensor(-(-length * audio.shape[-1] // n_samples))
+        return item
+
+
+def pad_collate(batch):
+    """
+    Collates items of different lengths (e.g. whole songs with `max_len=None`) by
+    zero-padding "audio" along its last axis to the longest item of the batch; the
+    padding is masked out by the model with the items' "length".
+    """
+    max_len = max(item["audio"].shape[-1] for item in batch)
+    audio = torch.stack(
+        [F.pad(item["audio"], (0, max_len - item["audio"].shape[-1])) for item in batch]
+    )
+    collated = default_collate(
+        [{k: v for k, v in item.items() if k != "audio"} for item in batch]
+    )
+    collated["audio"] = audio
+    return collated
 
 
 def get_dataloader(
@@ -102,6 +142,9 @@ def get_dataloader(
     collate_fn=None,
     num_workers=0,
     distributed=False,
+    transform=None,
+    teacher_logits=None,
+    return_length=False,
 ):
     dataset = AudioDataset(
         filepaths,
@@ -112,7 +155,12 @@ def get_dataloader(
         random_sampling=random_sampling,
         normalize=normalize,
         train=train,
+        transform=transform,
+        teacher_logits=teacher_logits,
+        return_length=return_length,
     )
+    if collate_fn is None and return_length:
+        collate_fn = pad_collate  # pads whole songs to the batch's longest one
 
     if distributed:
         # drop_last is set to True to validate properly
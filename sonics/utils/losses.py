@@ -14,6 +14,29 @@ class BCEWithLogitsLoss(nn.BCEWithLogitsLoss):
         return super(BCEWithLogitsLoss, self).forward(input, target)
 
 
+class SoftTargetLoss(nn.Module):
+    def __init__(self, temperature=1.0):
+        """
+        Knowledge distillation loss for sigmoid outputs: BCE between the student logits
+        and the teacher probabilities, both softened by `temperature`.
+
+        Args:
+            temperature (float): Softening temperature, the loss is scaled by its square
+                to keep gradient magnitudes comparable across temperatures.
+        """
+        super(SoftTargetLoss, self).__init__()
+        self.temperature = temperature
+
+    def forward(self, input, soft_target):
+        """
+        Args:
+            input (Tensor): Student logits.
+            soft_target (Tensor): Teacher probabilities, `sigmoid(teacher_logits / T)`.
+        """
+        loss = F.binary_cross_entropy_with_logits(input / self.temperature, soft_target)
+        return loss * self.temperature**2
+
+
 class SigmoidFocalLoss(nn.Module):
     def __init__(self, alpha=1, gamma=2, label_smoothing=0.0, reduction="mean"):
         """
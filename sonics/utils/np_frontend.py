@@ -0,0 +1,159 @@
+import numpy as np
+
+
+def hz_to_mel(freq):
+    """
+    Converts Hz to mels (HTK formula, as torchaudio's default `mel_scale="htk"`).
+    """
+    return 2595.0 * np.log10(1.0 + freq / 700.0)
+
+
+def mel_to_hz(mels):
+    """
+    Converts mels to Hz (HTK formula).
+    """
+    return 700.0 * (10.0 ** (mels / 2595.0) - 1.0)
+
+
+def melscale_fbanks(n_freqs, f_min, f_max, n_mels, sample_rate):
+    """
+    Triangular mel filterbank of shape (n_freqs, n_mels), same as
+    `torchaudio.functional.melscale_fbanks` with `norm=None` and `mel_scale="htk"`.
+    """
+    all_freqs = np.linspace(0, sample_rate // 2, n_freqs)
+    m_pts = np.linspace(hz_to_mel(f_min), hz_to_mel(f_max), n_mels + 2)
+    f_pts = mel_to_hz(m_pts)
+
+    f_diff = f_pts[1:] - f_pts[:-1]  # (n_mels + 1,)
+    slopes = f_pts[None, :] - all_freqs[:, None]  # (n_freqs, n_mels + 2)
+    down_slopes = -slopes[:, :-2] / f_diff[:-1]
+    up_slopes = slopes[:, 2:] / f_diff[1:]
+    fb = np.maximum(0.0, np.minimum(down_slopes, up_slopes))
+    return fb.astype(np.float32)
+
+
+def hann_window(win_length, n_fft):
+    """
+    Periodic Hann window zero-padded to `n_fft`, as used by `torch.stft`.
+    """
+    n = np.arange(win_length)
+    window = 0.5 - 0.5 * np.cos(2.0 * np.pi * n / win_length)
+    left = (n_fft - win_length) // 2
+    window = np.pad(window, (left, n_fft - win_length - left))
+    return window.astype(np.float32)
+
+
+class NumpyFrontend:
+    def __init__(self, cfg):
+        """
+        NumPy-only version of `FeatureExtractor`: MelSpectrogram -> AmplitudeToDB(top_db)
+        -> normalization, with the window and filterbank computed once at construction.
+        Importing it pulls in neither torch, torchaudio nor librosa.
+
+        Args:
+            cfg (SimpleNamespace): Config with `audio` and `melspec` sections.
+        """
+        melspec = cfg.melspec
+        self.n_fft = melspec.n_fft
+        self.win_length = melspec.win_length or melspec.n_fft
+        self.hop_length = melspec.hop_length or self.win_length // 2
+        self.power = melspec.power
+        self.top_db = melspec.top_db
+        self.norm = melspec.norm
+        self.n_frames = getattr(melspec, "n_frames", None)
+        self.max_len = cfg.audio.max_len
+        self.eps = 1e-6
+
+        f_max = melspec.f_max or cfg.audio.sample_rate // 2
+        self.window = hann_window(self.win_length, self.n_fft)
+        self.fb = melscale_fbanks(
+            self.n_fft // 2 + 1,
+            melspec.f_min,
+            f_max,
+            melspec.n_mels,
+            cfg.audio.sample_rate,
+        )
+
+    def __call__(self, x, lengths=None):
+        """
+        Args:
+            x (np.ndarray): Input audio of shape (batch_size, n_samples) or (n_samples,).
+            lengths (np.ndarray, optional): Valid samples of each zero-padded waveform;
+                the top_db threshold and the normalization then use each clip's valid
+                frames only, like `FeatureExtractor`. Defaults to None.
+
+        Returns:
+            np.ndarray: Features of shape (batch_size, n_mels, n_frames) or (n_mels, n_frames).
+        """
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 1:
+            return self(x[None])[0]
+
+        melspec = self.melspectrogram(x)
+        mask = None
+        if lengths is not None:
+            # Same rounding as `frame_mask` in sonics.layers.feature
+            n_frames = melspec.shape[-1]
+            lengths = np.asarray(lengths, dtype=np.float64).reshape(-1, 1, 1)
+            frames = np.clip(np.ceil(lengths / x.shape[-1] * n_frames), 1, n_frames)
+            mask = np.arange(n_frames) < frames
+        melspec = self.amplitude_to_db(melspec, mask)
+        return self.normalize(melspec, mask)
+
+    def melspectrogram(self, x):
+        # Only clips up to `max_len` are trimmed to `n_frames`, like `FeatureExtractor`
+        n_frames = self.n_frames if x.shape[-1] <= self.max_len else None
+
+        # Centered STFT with reflect padding, like torch.stft(center=True)
+        pad = self.n_fft // 2
+        x = np.pad(x, [(0, 0)] * (x.ndim - 1) + [(pad, pad)], mode="reflect")
+        frames = np.lib.stride_tricks.sliding_window_view(x, self.n_fft, axis=-1)
+        frames = frames[..., :: self.hop_length, :]  # (B, n_frames, n_fft)
+        if n_frames is not None:
+            frames = frames[..., :n_frames, :]
+
+        spec = np.fft.rfft(frames * self.window, n=self.n_fft, axis=-1)
+        if self.power == 2:
+            spec = spec.real**2 + spec.imag**2
+        else:
+            spec = np.abs(spec) ** self.power
+        spec = spec.astype(np.float32)  # (B, n_frames, n_freqs)
+
+        melspec = spec @ self.fb  # (B, n_frames, n_mels)
+        return np.swapaxes(melspec, -1, -2)
+
+    def amplitude_to_db(self, x, mask=None, amin=1e-10):
+        x_db = 10.0 * np.log10(np.maximum(x, amin))
+        if self.top_db is not None and mask is not None:
+            # Per clip, over its valid frames
+            x_max = np.where(mask, x_db, -np.inf).max(axis=(1, 2), keepdims=True)
+            x_db = np.maximum(x_db, x_max - self.top_db)
+        elif self.top_db is not None:
+            # Same packing as torchaudio: for 3D inputs the threshold is taken from the
+            # max over the whole batch, not per clip
+            shape = x_db.shape
+            packed_channels = shape[-3] if x_db.ndim > 2 else 1
+            x_db = x_db.reshape(-1, packed_channels, shape[-2], shape[-1])
+            x_max = x_db.max(axis=(-3, -2, -1)).reshape(-1, 1, 1, 1)
+            x_db = np.maximum(x_db, x_max - self.top_db).reshape(shape)
+        return x_db
+
+    def normalize(self, x, mask=None):
+        # Statistics over the valid frames of each clip when `mask` is given
+        where = True if mask is None else np.broadcast_to(mask, x.shape)
+        if self.norm == "mean_std":
+            mean = x.mean(axis=(1, 2), keepdims=True, where=where)
+            # A float32 count, an int one would promote the features to float64
+            valid = np.broadcast_to(where, x.shape)
+            count = valid.sum(axis=(1, 2), keepdims=True, dtype=np.float32)
+            sq_sum = ((x - mean) ** 2).sum(axis=(1, 2), keepdims=True, where=where)
+            std = np.sqrt(sq_sum / (count - 1))  # unbiased, like torch.std
+            return (x - mean) / (std + self.eps)
+        elif self.norm == "min_max":
+            # Mirrors `MinMaxNorm`, including its min/max naming
+            min_ = x.max(axis=(1, 2), keepdims=True, where=where, initial=-np.inf)
+            max_ = x.min(axis=(1, 2), keepdims=True, where=where, initial=np.inf)
+            return (x - min_) / (max_ - min_ + self.eps)
+        elif self.norm == "simple":
+            return (x - 40) / 80
+        return x
@@ -0,0 +1,59 @@
+import os
+import json
+
+import numpy as np
+
+from sonics.utils.config import dict2cfg
+from sonics.utils.np_frontend import NumpyFrontend
+
+
+class OnnxAudioClassifier:
+    def __init__(self, model_path, cfg, providers=None, num_threads=None):
+        """
+        ONNX Runtime inference engine for models exported with `export_onnx`, with the
+        same `predict` API as `AudioClassifier`. It only needs numpy and onnxruntime.
+
+        Args:
+            model_path (str): Path of the exported `model.onnx`.
+            cfg (SimpleNamespace): Config of the exported model.
+            providers (list, optional): ONNX Runtime execution providers. Defaults to
+                ["CPUExecutionProvider"].
+            num_threads (int, optional): Intra-op threads. Defaults to onnxruntime's.
+        """
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            model_path, options, providers=providers or ["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        # Graphs exported without the frontend take spectrograms, computed with NumPy
+        self.frontend = NumpyFrontend(cfg) if self.input_name == "spectrogram" else None
+        self.cfg = cfg
+
+    @classmethod
+    def from_pretrained(cls, save_directory, **kwargs):
+        """
+        Loads `model.onnx` and `config.json` written by `export_onnx`.
+        """
+        with open(os.path.join(save_directory, "config.json"), encoding="utf-8") as f:
+            cfg = dict2cfg(json.load(f))
+        return cls(os.path.join(save_directory, "model.onnx"), cfg, **kwargs)
+
+    def predict(self, audio):
+        """
+        Args:
+            audio (np.ndarray): Waveforms of shape (batch_size, n_samples) or (n_samples,).
+
+        Returns:
+            np.ndarray: Probabilities of shape (batch_size, num_classes).
+        """
+        audio = np.asarray(audio, dtype=np.float32)
+        if audio.ndim == 1:
+            audio = audio[None]
+        x = self.frontend(audio) if self.frontend is not None else audio
+        logits = self.session.run(None, {self.input_name: x.astype(np.float32)})[0]
+        return 1.0 / (1.0 + np.exp(-logits))
@@ -26,15 +26,70 @@ def profile_model(model, input_tensor, display=False):
     return profile_df
 
 
-def calculate_speed(model, input_tensor, num_runs=100, warmup_runs=5):
+def graph_break_report(model, input_tensor, display=False):
+    """
+    Graphs and graph breaks `torch.compile` finds in each of `model.compile_targets()`
+    on `input_tensor`, from `torch._dynamo.explain`.
+    """
     model.eval()
+    with torch.no_grad():
+        spec, _ = model.get_spec(input_tensor[0:1, ...])
+    inputs = {"frontend": input_tensor[0:1, ...], "encoder": spec}
 
-    if torch.cuda.is_available():
-        # Warm-up iterations
+    rows = []
+    for name, module in model.compile_targets().items():
         with torch.no_grad():
-            for _ in range(warmup_runs):
-                _ = model(input_tensor)
+            explain = torch._dynamo.explain(module)(inputs[name])
+        reasons = sorted({str(b.reason) for b in explain.break_reasons})
+        rows.append(
+            {
+                "Module": name,
+                "Graphs": explain.graph_count,
+                "Graph Breaks": explain.graph_break_count,
+                "Reasons": "; ".join(reasons) or "-",
+            }
+        )
+    torch._dynamo.reset()  # `explain` leaves its compiled frames behind
+    report_df = pd.DataFrame(rows)
+    if display:
+        print(report_df.to_markdown(index=False, tablefmt="grid"))
+    return report_df
+
+
+def fused_layer_report(display=False):
+    """
+    Fused and fast kernels the timm encoders can use in this environment.
+    """
+    from timm.layers import fast_norm, use_fused_attn
+
+    report = {
+        "cuDNN": torch.cuda.is_available() and torch.backends.cudnn.is_available(),
+        "cuDNN Benchmark": torch.backends.cudnn.benchmark,
+        "oneDNN (CPU)": torch.backends.mkldnn.is_available(),
+        "Fused Attention": use_fused_attn(),
+        "Fast Norm": fast_norm.is_fast_norm(),
+        "Apex Fused Norm": getattr(fast_norm, "has_apex", False),
+    }
+    report_df = pd.DataFrame([report])
+    if display:
+        print(report_df.to_markdown(index=False, tablefmt="grid"))
+    return report_df
 
+
+def calculate_speed(model, input_tensor, num_runs=100, warmup_runs=5):
+    """
+    Throughput (audio/s) of `model` on `input_tensor`, timed with CUDA events when the
+    input is on a GPU and with `time.perf_counter` otherwise, e.g. for CPU-only int8
+    models on a machine that also has a GPU.
+    """
+    model.eval()
+
+    # Warm-up iterations
+    with torch.no_grad():
+        for _ in range(warmup_runs):
+            _ = model(input_tensor)
+
+    if input_tensor.is_cuda:
         # Create CUDA events for timing
         start = torch.cuda.Event(enable_timing=True)
         end = torch.cuda.Event(enable_timing=True)
@@ -53,17 +108,12 @@ def calculate_speed(model, input_tensor, num_runs=100, warmup_runs=5):
         elapsed_time = start.elapsed_time(end)  # in milliseconds
         latency = elapsed_time / num_runs / 1000.0  # convert to seconds
     else:
-        # Warm-up iterations
-        with torch.no_grad():
-            for _ in range(warmup_runs):
-                _ = model(input_tensor)
-
         # Actual timing
-        start = time.time()
+        start = time.perf_counter()
         with torch.no_grad():
             for _ in range(num_runs):
                 _ = model(input_tensor)
-        end = time.time()
+        end = time.perf_counter()
 
         # Calculate elapsed time
         latency = (end - start) / num_runs
@@ -92,7 +142,7 @@ def calculate_params(model):
 
 
 def calculate_memory(model, input_tensor):
-    if torch.cuda.is_available():
+    if input_tensor.is_cuda:
         torch.cuda.empty_cache()
         torch.cuda.reset_peak_memory_stats(device=None)
         start_memory = torch.cuda.max_memory_allocated(device=None)
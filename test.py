@@ -17,15 +17,18 @@ except:
 
     torch_amp_new = False
 
-from sonics.models.model import AudioClassifier
+from sonics.layers.feature import WorkerFeatureExtractor
+from sonics.models.compress import decompress_state_dict
+from sonics.models.model import AudioClassifier, get_example_input
 from sonics.utils.config import dict2cfg
 from sonics.utils.dataset import get_dataloader
 from sonics.utils.metrics import get_part_result
 from sonics.utils.losses import BCEWithLogitsLoss, SigmoidFocalLoss
+from sonics.utils.perf import graph_break_report
 from sonics.utils.seed import set_seed, worker_init_fn
 
 # Import the valid_loop function from the training script
-from train import valid_loop
+from train import check_frontend_precision, uses_frontend_precision, valid_loop
 
 warnings.filterwarnings("ignore", category=UserWarning)
 logging.getLogger("fvcore").setLevel(logging.ERROR)
@@ -76,13 +79,22 @@ def main():
     cfg.dataset.num_test_real = len(test_df.query("target == 0"))
     cfg.dataset.num_test_fake = len(test_df.query("target == 1"))
 
+    # Score whole songs one at a time with `model.variable_length`, or in batches of
+    # similar durations padded to the longest one with `model.padding_mask`
+    variable_length = getattr(cfg.model, "variable_length", False)
+    padding_mask = getattr(cfg.model, "padding_mask", False)
+    if variable_length and padding_mask:
+        test_df = test_df.sort_values("duration", kind="stable").reset_index(drop=True)
+
     # Load dataloader
     test_dataloader = get_dataloader(
         test_df.filepath.tolist(),
         test_df.target.tolist(),
         skip_times=test_df.skip_time.tolist() if cfg.audio.skip_time else None,
-        max_len=cfg.audio.max_len,
-        batch_size=cfg.validation.batch_size,
+        max_len=None if variable_length else cfg.audio.max_len,
+        batch_size=(
+            1 if variable_length and not padding_mask else cfg.validation.batch_size
+        ),
         num_classes=cfg.num_classes,
         train=False,
         random_sampling=False,
@@ -90,6 +102,12 @@ def main():
         worker_init_fn=worker_init_fn,
         collate_fn=None,
         distributed=False,
+        transform=(
+            WorkerFeatureExtractor(cfg)
+            if getattr(cfg.melspec, "placement", "model") == "worker"
+            else None
+        ),
+        return_length=padding_mask,
     )
 
     # Load model
@@ -101,9 +119,41 @@ def main():
         print(f"> Checkpoint file not found: {args.ckpt_path}")
         raise FileNotFoundError(f"Checkpoint file not found: {args.ckpt_path}")
     checkpoint = torch.load(args.ckpt_path, map_location=device)
-    model.load_state_dict(checkpoint["model"])
+    model.load_state_dict(decompress_state_dict(checkpoint["model"]))
     print(f"> Loaded checkpoint from {args.ckpt_path}")
 
+    # Verify a reduced precision frontend with these weights on validation songs
+    if uses_frontend_precision(cfg):
+        valid_df = pd.read_csv(cfg.dataset.valid_dataframe)
+        num_songs = getattr(cfg.melspec, "precision_batches", 8) * cfg.validation.batch_size
+        valid_df = valid_df.sample(
+            n=min(len(valid_df), num_songs), random_state=cfg.environment.seed
+        )
+        valid_dataloader = get_dataloader(
+            valid_df.filepath.tolist(),
+            valid_df.target.tolist(),
+            skip_times=valid_df.skip_time.tolist() if cfg.audio.skip_time else None,
+            max_len=cfg.audio.max_len,
+            batch_size=cfg.validation.batch_size,
+            num_classes=cfg.num_classes,
+            train=False,
+            random_sampling=False,
+            num_workers=cfg.environment.num_workers,
+            worker_init_fn=worker_init_fn,
+            collate_fn=None,
+            distributed=False,
+        )
+        print("> Frontend Precision Check:")
+        check_frontend_precision(model, valid_dataloader, device, cfg)
+
+    # Compile for inference, any batch size and (with variable_length) any length
+    if getattr(cfg.environment, "compile", False):
+        print("\n> Graph Breaks:")
+        graph_break_report(model, get_example_input(cfg, 1).to(device), display=True)
+        model.set_compile(
+            mode=getattr(cfg.environment, "compile_mode", "default"), dynamic=True
+        )
+
     # Loss
     if cfg.loss.name == "BCEWithLogitsLoss":
         criterion = BCEWithLogitsLoss(label_smoothing=cfg.loss.label_smoothing)
@@ -135,6 +185,9 @@ def main():
         "spec": test_spec,
     }
 
+    if "exit_depth" in test_pred_df:
+        best_test_result["exit_depth"] = test_pred_df.exit_depth.mean()
+
     print("> Best Test Result:")
     best_test_result_df = pd.DataFrame([best_test_result])
     print(best_test_result_df.to_markdown(index=False, tablefmt="grid"))
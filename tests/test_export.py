@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import pytest
+import yaml
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchaudio")
+pytest.importorskip("timm")
+
+from sonics.layers.feature import ExportFeatureExtractor, FeatureExtractor  # noqa: E402
+from sonics.models.export import ExportModel  # noqa: E402
+from sonics.models.model import AudioClassifier  # noqa: E402
+from sonics.utils.config import dict2cfg  # noqa: E402
+
+CONFIG_DIR = Path(__file__).resolve().parents[1] / "configs"
+
+
+def load_cfg(max_time=2, fit_input_shape=True):
+    with open(CONFIG_DIR / "spectttra_f1t3-5s.yaml") as f:
+        dict_ = yaml.safe_load(f)
+    dict_["audio"]["max_time"] = max_time
+    dict_["melspec"]["fit_input_shape"] = fit_input_shape
+    # A small encoder keeps the export fast
+    dict_["model"].update(embed_dim=64, num_heads=2, num_layers=2)
+    return dict2cfg(dict_)
+
+
+def test_export_frontend_matches_torchaudio():
+    cfg = load_cfg()
+    audio = torch.randn(2, cfg.audio.max_len)
+    with torch.no_grad():
+        expected = FeatureExtractor(cfg)(audio)
+        actual = ExportFeatureExtractor(cfg)(audio)
+    assert actual.shape == expected.shape
+    assert (actual - expected).abs().max().item() < 1e-3
+
+
+def test_export_model_raises_when_resize_needed():
+    model = AudioClassifier(load_cfg(fit_input_shape=False)).eval()
+    with pytest.raises(ValueError, match="resize=True"):
+        ExportModel(model)
+
+    audio = torch.randn(2, model.cfg.audio.max_len)
+    with torch.no_grad():
+        diff = (ExportModel(model, resize=True)(audio) - model(audio)).abs().max()
+    assert diff.item() < 1e-3
+
+
+def test_onnx_export_matches_pytorch(tmp_path):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    from sonics.models.export import export_onnx, onnx_parity
+
+    model = AudioClassifier(load_cfg()).eval()
+    export_onnx(model, str(tmp_path))
+    assert onnx_parity(model, str(tmp_path)) < 1e-4
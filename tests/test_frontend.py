@@ -0,0 +1,102 @@
+from pathlib import Path
+
+import pytest
+import yaml
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchaudio")
+
+from sonics.layers.feature import (  # noqa: E402
+    FeatureExtractor,
+    NumpyFeatureExtractor,
+    frontend_parity,
+    get_feature_extractor,
+)
+from sonics.utils.config import dict2cfg  # noqa: E402
+
+CONFIG_DIR = Path(__file__).resolve().parents[1] / "configs"
+
+
+def load_cfg(name="spectttra_f1t3-5s.yaml", max_time=2, **melspec):
+    with open(CONFIG_DIR / name) as f:
+        dict_ = yaml.safe_load(f)
+    dict_["audio"]["max_time"] = max_time  # short clips keep the test fast
+    dict_["melspec"].update(melspec)
+    return dict2cfg(dict_)
+
+
+@pytest.mark.parametrize("norm", ["mean_std", "min_max", "simple"])
+def test_numpy_frontend_matches_torchaudio(norm):
+    cfg = load_cfg(norm=norm)
+    assert frontend_parity(cfg, batch_size=2) < 1e-3
+
+
+@pytest.mark.parametrize("norm", ["mean_std", "min_max", "simple"])
+def test_numpy_frontend_is_float32(norm):
+    cfg = load_cfg(norm=norm, backend="numpy")
+    audio = torch.randn(2, cfg.audio.max_len)
+    frontend = get_feature_extractor(cfg)
+    assert frontend(audio).dtype == torch.float32
+    assert frontend(audio, torch.tensor([audio.size(-1), 1000])).dtype == torch.float32
+
+
+def test_numpy_frontend_matches_torchaudio_fitted_hop():
+    cfg = load_cfg(fit_input_shape=True)
+    assert frontend_parity(cfg, batch_size=2) < 1e-3
+
+
+def test_numpy_frontend_loads_torchaudio_checkpoint():
+    cfg = load_cfg()
+    state_dict = FeatureExtractor(cfg).state_dict()
+    assert state_dict  # the window and filterbank buffers
+    NumpyFeatureExtractor(cfg).load_state_dict(state_dict, strict=True)
+
+
+def test_numpy_frontend_rejects_unknown_keys():
+    cfg = load_cfg()
+    with pytest.raises(RuntimeError, match="Unexpected key"):
+        NumpyFeatureExtractor(cfg).load_state_dict(
+            {"not_a_buffer": torch.zeros(1)}, strict=True
+        )
+
+
+@pytest.mark.parametrize("backend", ["torchaudio", "numpy"])
+@pytest.mark.parametrize("norm", ["mean_std", "min_max"])
+def test_padded_batch_matches_single_song(backend, norm):
+    cfg = load_cfg(norm=norm, backend=backend)
+    frontend = get_feature_extractor(cfg)
+    audio = torch.randn(cfg.audio.max_len)
+    # The short song ends in silence, so its last STFT windows see zeros whether the
+    # clip is reflect-padded alone or zero-padded in the batch
+    short = audio[: cfg.audio.max_len // 2].clone()
+    short[-cfg.melspec.n_fft :] = 0
+    batch = torch.stack([audio, torch.nn.functional.pad(short, (0, short.numel()))])
+    lengths = torch.tensor([audio.numel(), short.numel()])
+    with torch.no_grad():
+        masked = frontend(batch, lengths)
+        full, alone = frontend(audio[None])[0], frontend(short[None])[0]
+
+    assert (masked[0] - full).abs().max().item() < 1e-3
+    assert (masked[1, :, : alone.size(-1)] - alone).abs().max().item() < 1e-3
+
+
+@pytest.mark.parametrize("num_fb_bands", [1, 8])
+def test_banded_mel_scale_matches_dense(num_fb_bands):
+    audio = torch.randn(2, load_cfg().audio.max_len)
+    with torch.no_grad():
+        expected = FeatureExtractor(load_cfg())(audio)
+        actual = FeatureExtractor(load_cfg(num_fb_bands=num_fb_bands))(audio)
+    assert (actual - expected).abs().max().item() < 1e-4
+
+
+@pytest.mark.parametrize("fit_input_shape", [False, True])
+@pytest.mark.parametrize("chunk_frames", [7, 16, 1000])
+def test_chunked_stft_matches_reference(chunk_frames, fit_input_shape):
+    cfg = load_cfg(fit_input_shape=fit_input_shape)
+    audio = torch.randn(2, cfg.audio.max_len)
+    chunked_cfg = load_cfg(fit_input_shape=fit_input_shape, chunk_frames=chunk_frames)
+    with torch.no_grad():
+        expected = FeatureExtractor(cfg)(audio)
+        actual = FeatureExtractor(chunked_cfg)(audio)
+    assert actual.shape == expected.shape
+    assert (actual - expected).abs().max().item() < 1e-4
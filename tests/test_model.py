@@ -0,0 +1,55 @@
+from pathlib import Path
+
+import pytest
+import yaml
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchaudio")
+pytest.importorskip("timm")
+
+from sonics.models.model import AudioClassifier  # noqa: E402
+from sonics.utils.config import dict2cfg  # noqa: E402
+
+CONFIG_DIR = Path(__file__).resolve().parents[1] / "configs"
+
+
+def load_cfg(name, max_time=2, **model):
+    with open(CONFIG_DIR / name) as f:
+        dict_ = yaml.safe_load(f)
+    dict_["audio"]["max_time"] = max_time  # short clips keep the test fast
+    dict_["model"].update(model)
+    return dict2cfg(dict_)
+
+
+@pytest.mark.parametrize("name", ["convnext-5s.yaml", "efficientvit-5s.yaml"])
+def test_timm_forward(name):
+    model = AudioClassifier(load_cfg(name, pretrained=False))
+    audio = torch.randn(2, model.cfg.audio.max_len)
+
+    model.eval()
+    with torch.no_grad():
+        assert model(audio).shape == (2, model.num_classes)
+
+    model.train()
+    preds, _ = model(audio, torch.ones(2, model.num_classes))
+    assert preds.shape == (2, model.num_classes)
+    assert model.exit_logits == {}
+
+
+@pytest.mark.parametrize("name", ["spectttra_f1t3-5s.yaml", "convnext-5s.yaml"])
+def test_numpy_backend_forward(name):
+    cfg = load_cfg(name, pretrained=False)
+    cfg.melspec.backend = "numpy"
+    model = AudioClassifier(cfg).eval()
+    probs = model.predict(torch.randn(2, cfg.audio.max_len))
+    assert probs.shape == (2, model.num_classes)
+
+
+def test_timm_channels_last_forward():
+    model = AudioClassifier(load_cfg("convnext-5s.yaml", pretrained=False)).eval()
+    audio = torch.randn(2, model.cfg.audio.max_len)
+    with torch.no_grad():
+        expected = model(audio)
+        model.set_channels_last(True)
+        actual = model(audio)
+    assert (actual - expected).abs().max().item() < 1e-4
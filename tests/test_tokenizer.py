@@ -0,0 +1,31 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("timm")
+
+from sonics.layers.tokenizer import FusedSTTokenizer, STTokenizer  # noqa: E402
+
+
+@pytest.mark.parametrize("pe_learnable", [False, True])
+@pytest.mark.parametrize("pre_norm", [False, True])
+def test_fused_tokenizer_matches_reference(pre_norm, pe_learnable):
+    kwargs = dict(
+        input_spec_dim=128,
+        input_temp_dim=128,
+        t_clip=3,
+        f_clip=1,
+        embed_dim=64,
+        pre_norm=pre_norm,
+        pe_learnable=pe_learnable,
+    )
+    reference = STTokenizer(**kwargs).eval()
+    fused = FusedSTTokenizer(**kwargs).eval()
+    fused.load_state_dict(reference.state_dict(), strict=True)
+
+    x = torch.randn(2, 128, 128)
+    lengths = torch.tensor([128, 90])
+    with torch.no_grad():
+        for args in [(x,), (x, lengths)]:
+            expected, actual = reference(*args), fused(*args)
+            assert actual.shape == expected.shape
+            assert (actual - expected).abs().max().item() < 1e-4
@@ -0,0 +1,23 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("timm")
+
+from sonics.layers.transformer import (  # noqa: E402
+    SDPA_BACKENDS,
+    Transformer,
+    benchmark_sdpa_backends,
+)
+
+
+def test_sdpa_benchmark_skips_unavailable_kernels():
+    q, k, v = torch.randn(3, 1, 2, 16, 32).unbind(0)
+    latencies = benchmark_sdpa_backends(q, k, v, num_runs=1)
+    assert "auto" in latencies and "math" in latencies
+    assert set(latencies) <= {"auto", *SDPA_BACKENDS}
+
+
+def test_benchmark_attn_backend_forward():
+    model = Transformer(32, 2, 1, attn_backend="benchmark").eval()
+    with torch.no_grad():
+        assert model(torch.randn(2, 16, 32)).shape == (2, 16, 32)
@@ -0,0 +1,132 @@
+import argparse
+import logging
+import os
+import warnings
+
+import pandas as pd
+import yaml
+
+import torch
+
+from sonics.layers.feature import WorkerFeatureExtractor
+from sonics.models.compress import decompress_state_dict
+from sonics.models.model import AudioClassifier, get_example_input
+from sonics.utils.config import dict2cfg
+from sonics.utils.dataset import get_dataloader
+from sonics.utils.losses import BCEWithLogitsLoss
+from sonics.utils.perf import calculate_speed
+from sonics.utils.seed import set_seed, worker_init_fn
+
+# Import the valid_loop function from the training script
+from train import valid_loop
+
+warnings.filterwarnings("ignore", category=UserWarning)
+logging.getLogger("fvcore").setLevel(logging.ERROR)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Sweep token merging ratios: speedup vs validation F1"
+    )
+    parser.add_argument("--config", type=str, required=True, help="Path to config file")
+    parser.add_argument(
+        "--ckpt_path", type=str, required=True, help="Path to checkpoint file"
+    )
+    parser.add_argument(
+        "--ratios",
+        type=float,
+        nargs="+",
+        default=[0.0, 0.05, 0.1, 0.15, 0.2, 0.3],
+        help="Fractions of tokens merged after every transformer block",
+    )
+    parser.add_argument(
+        "--num_valid",
+        type=int,
+        default=None,
+        help="Number of validation songs to score (default: all)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    # Parse arguments
+    args = arg_parser()
+    dict_ = yaml.safe_load(open(args.config).read())
+    cfg = dict2cfg(dict_)
+    print(cfg)
+
+    # Set seed
+    set_seed(cfg.environment.seed)
+
+    # Set up device
+    if not torch.cuda.is_available():
+        print("> Using CPU, this will be slow")
+        device = torch.device("cpu")
+    else:
+        device = torch.device("cuda:0")
+        print(f"> Using GPU: {device}")
+
+    # Load validation data
+    valid_df = pd.read_csv(cfg.dataset.valid_dataframe)
+    valid_df = valid_df.sample(frac=1.0, random_state=cfg.environment.seed).reset_index(
+        drop=True
+    )
+    if args.num_valid is not None:
+        valid_df = valid_df[: args.num_valid]
+
+    valid_dataloader = get_dataloader(
+        valid_df.filepath.tolist(),
+        valid_df.target.tolist(),
+        skip_times=valid_df.skip_time.tolist() if cfg.audio.skip_time else None,
+        max_len=cfg.audio.max_len,
+        batch_size=cfg.validation.batch_size,
+        num_classes=cfg.num_classes,
+        train=False,
+        random_sampling=False,
+        num_workers=cfg.environment.num_workers,
+        worker_init_fn=worker_init_fn,
+        collate_fn=None,
+        distributed=False,
+        transform=(
+            WorkerFeatureExtractor(cfg)
+            if getattr(cfg.melspec, "placement", "model") == "worker"
+            else None
+        ),
+    )
+
+    # Load model
+    model = AudioClassifier(cfg)
+    model.to(device)
+    checkpoint = torch.load(args.ckpt_path, map_location=device)
+    model.load_state_dict(decompress_state_dict(checkpoint["model"]))
+    print(f"> Loaded checkpoint from {args.ckpt_path}")
+
+    criterion = BCEWithLogitsLoss(label_smoothing=0.0)
+    input_tensor = get_example_input(cfg, 1).to(device)
+
+    # Sweep merge ratios
+    results = []
+    for ratio in args.ratios:
+        print(f"\n> Merge ratio: {ratio}")
+        model.set_token_merging(ratio)
+        speed = calculate_speed(model, input_tensor)
+        _, acc, f1, _, _, _ = valid_loop(
+            model, valid_dataloader, criterion, device, cfg, desc=f"r={ratio}"
+        )
+        results.append({"merge_ratio": ratio, "speed": speed, "acc": acc, "f1": f1})
+
+    result_df = pd.DataFrame(results)
+    base = result_df.iloc[0]
+    result_df["speedup"] = result_df.speed / base.speed
+    result_df["f1_change"] = result_df.f1 - base.f1
+    print("\n> Token Merging Sweep:")
+    print(result_df.to_markdown(index=False, tablefmt="grid"))
+
+    # Save sweep results
+    os.makedirs(f"output/{cfg.experiment_name}", exist_ok=True)
+    result_df.to_csv(f"output/{cfg.experiment_name}/tome_sweep.csv", index=False)
+    print(f"> Sweep results saved to output/{cfg.experiment_name}/tome_sweep.csv")
+
+
+if __name__ == "__main__":
+    main()
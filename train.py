@@ -1,5 +1,7 @@
 import argparse
 import gc
+import hashlib
+import json
 import logging
 import os
 import warnings
@@ -27,7 +29,9 @@ except:
 import torch.distributed as dist
 import torch.multiprocessing as mp
 
-from sonics.models.model import AudioClassifier
+from sonics.layers.feature import WorkerFeatureExtractor
+from sonics.models.compress import compress_state_dict, decompress_state_dict
+from sonics.models.model import AudioClassifier, get_example_input
 from sonics.utils.config import dict2cfg
 from sonics.utils.dataset import get_dataloader
 from sonics.utils.metrics import (
@@ -38,8 +42,8 @@ from sonics.utils.metrics import (
     SpecificityMeter,
     get_part_result,
 )
-from sonics.utils.losses import BCEWithLogitsLoss, SigmoidFocalLoss
-from sonics.utils.perf import profile_model
+from sonics.utils.losses import BCEWithLogitsLoss, SigmoidFocalLoss, SoftTargetLoss
+from sonics.utils.perf import fused_layer_report, graph_break_report, profile_model
 
 # from sonics.utils.scheduler import get_cosine_schedule_with_warmup, get_scheduler
 from sonics.utils.seed import set_seed, worker_init_fn
@@ -51,8 +55,59 @@ warnings.filterwarnings("ignore", category=UserWarning)
 logging.getLogger("fvcore").setLevel(logging.ERROR)
 
 
+def unwrap(model):
+    """
+    Returns the `AudioClassifier` inside a DistributedDataParallel wrapper.
+    """
+    return getattr(model, "module", model)
+
+
+def get_soft_targets(batch, x, teacher, device, cfg):
+    """
+    Teacher probabilities softened by `distill.temperature`, from the cached logits
+    of the batch or, without a cache, from running the frozen teacher on `x`.
+    """
+    if teacher is None:
+        logits = batch["teacher_logit"].to(device)
+    else:
+        with torch.no_grad():
+            if cfg.environment.mixed_precision:
+                with autocast("cuda") if torch_amp_new else autocast():
+                    logits = teacher(x)
+            else:
+                logits = teacher(x)
+        logits = logits.squeeze(-1).float()
+    return torch.sigmoid(logits / getattr(cfg.distill, "temperature", 1.0))
+
+
+def get_loss(model, criterion, distill_criterion, preds, y, cfg):
+    """
+    Training loss (target loss, early-exit heads and distillation) scaled for
+    gradient accumulation. With distillation `y` stacks (targets, soft targets) so
+    MixUp mixes both alike; the returned `y` holds the targets only.
+    """
+    soft_y = None
+    if distill_criterion is not None:
+        y, soft_y = y.unbind(-1)
+    loss = criterion(preds, y) + unwrap(model).exit_loss(criterion, preds, y)
+    if soft_y is not None:
+        loss = loss + getattr(cfg.distill, "loss_weight", 1.0) * distill_criterion(
+            preds, soft_y
+        )
+    return loss / cfg.optimizer.grad_accum_steps, y
+
+
 def train_loop(
-    model, train_dataloader, criterion, optimizer, scaler, device, cfg, scheduler=None
+    model,
+    train_dataloader,
+    criterion,
+    optimizer,
+    scaler,
+    device,
+    cfg,
+    scheduler=None,
+    teacher=None,
+    distill_criterion=None,
 ):
     model.train()
     running_loss = AverageMeter()
@@ -74,16 +129,18 @@ def train_loop(
     for i, batch in enumerate(progress_bar):
         x, y = batch["audio"], batch["target"]
         x, y = x.to(device), y.to(device)
+        if distill_criterion is not None:
+            y = torch.stack([y, get_soft_targets(batch, x, teacher, device, cfg)], dim=-1)
         if cfg.environment.mixed_precision:
             with autocast("cuda") if torch_amp_new else autocast():
                 preds, y = model(x, y)
                 preds = preds.squeeze()
-                loss = criterion(preds, y) / cfg.optimizer.grad_accum_steps
+                loss, y = get_loss(model, criterion, distill_criterion, preds, y, cfg)
             scaler.scale(loss).backward()
         else:
             preds, y = model(x, y)
             preds = preds.squeeze()
-            loss = criterion(preds, y) / cfg.optimizer.grad_accum_steps
+            loss, y = get_loss(model, criterion, distill_criterion, preds, y, cfg)
             loss.backward()
 
         if (i + 1) % cfg.optimizer.grad_accum_steps == 0:
@@ -153,23 +210,28 @@ def valid_loop(model, valid_dataloader, criterion, device, cfg, desc="Valid"):
 
     y_true_list = []
     y_pred_list = []
+    exit_depth_list = []
     with torch.no_grad():
         for batch in progress_bar:
             x, y = batch["audio"], batch["target"]
             x, y = x.to(device), y.to(device)
+            # Valid lengths of padded songs with `model.padding_mask`
+            lengths = batch["length"].to(device) if "length" in batch else None
 
             if cfg.environment.mixed_precision:
                 with autocast("cuda") if torch_amp_new else autocast():
-                    preds = model(x)
+                    preds = model(x, lengths=lengths)
             else:
-                preds = model(x)
+                preds = model(x, lengths=lengths)
 
-            preds = preds.squeeze()
+            preds = preds.squeeze(-1)  # keeps the batch dim for batch_size=1
             loss = criterion(preds, y)
             running_loss.update(loss.item(), x.size(0))
 
             preds = torch.sigmoid(preds).cpu().numpy()
             y_pred_list.append(preds)
+            if unwrap(model).exit_depth is not None:
+                exit_depth_list.append(unwrap(model).exit_depth.cpu().numpy())
 
             targets = y.cpu().numpy().astype(int)
             y_true_list.append(targets)
@@ -194,6 +256,8 @@ def valid_loop(model, valid_dataloader, criterion, device, cfg, desc="Valid"):
     pred_df = pd.DataFrame(
         {"y_true": np.concatenate(y_true_list), "y_pred": np.concatenate(y_pred_list)}
     )
+    if exit_depth_list:
+        pred_df["exit_depth"] = np.concatenate(exit_depth_list)  # blocks run per song
 
     return (
         running_loss.avg,
@@ -205,6 +269,222 @@ def valid_loop(model, valid_dataloader, criterion, device, cfg, desc="Valid"):
     )
 
 
+def uses_frontend_precision(cfg):
+    """
+    Whether the model runs a reduced precision torchaudio frontend, which has to pass
+    `check_frontend_precision` with trained weights before it's used for evaluation.
+    """
+    return (
+        getattr(cfg.melspec, "precision", "fp32") != "fp32"
+        and getattr(cfg.melspec, "placement", "model") == "model"
+        and getattr(cfg.melspec, "backend", "torchaudio") == "torchaudio"
+    )
+
+
+def check_frontend_precision(model, valid_dataloader, device, cfg, check_f1=True):
+    """
+    Accuracy gate for `melspec.precision: "bf16"/"fp16"`. Runs the frontend in float32
+    and in the reduced precision on `melspec.precision_batches` validation batches and
+    falls back to "fp32" if the max abs spectrogram error exceeds
+    `melspec.precision_tol` or, with `check_f1`, the F1 changes by more than
+    `melspec.precision_f1_tol`. The F1 check needs trained weights (an untrained model
+    predicts the same under both precisions), so before training it runs with
+    `check_f1=False` and only the spectrogram error is checked, on every rank. The
+    outcome is written to `cfg.melspec` (`precision_checked` once the F1 check passed,
+    or `precision: fp32`) so configs saved with the model, e.g. by `push_to_hub`, keep
+    it.
+
+    Returns:
+        bool: Whether the reduced precision frontend is kept.
+    """
+    ft_extractor = getattr(model, "module", model).ft_extractor
+    precision = ft_extractor.precision
+    spec_tol = getattr(cfg.melspec, "precision_tol", 0.05)
+    f1_tol = getattr(cfg.melspec, "precision_f1_tol", 0.005)
+    max_batches = getattr(cfg.melspec, "precision_batches", 8)
+
+    model.eval()
+    spec_error = 0.0
+    y_true_list, ref_pred_list, pred_list = [], [], []
+    with torch.no_grad():
+        for step, batch in enumerate(valid_dataloader):
+            if step >= max_batches:
+                break
+            x = batch["audio"].to(device)
+            y_true_list.append(batch["target"].numpy().astype(int).reshape(-1))
+
+            for prec in ["fp32", precision]:
+                ft_extractor.precision = prec
+                spec = ft_extractor(x)
+                if prec == "fp32":
+                    ref_spec = spec
+                if not check_f1:
+                    continue
+                if cfg.environment.mixed_precision:
+                    with autocast("cuda") if torch_amp_new else autocast():
+                        preds = model(x)
+                else:
+                    preds = model(x)
+                preds = (torch.sigmoid(preds.float()) > 0.5).int().cpu().numpy()
+                if prec == "fp32":
+                    ref_pred_list.append(preds.reshape(-1))
+                else:
+                    pred_list.append(preds.reshape(-1))
+            spec_error = max(spec_error, (spec - ref_spec).abs().max().item())
+
+    if not check_f1 and getattr(cfg.environment, "distributed", False):
+        # Every rank checked its own validation shard, agree on the worst error
+        error = torch.tensor(spec_error, device=device)
+        dist.all_reduce(error, op=dist.ReduceOp.MAX)
+        spec_error = error.item()
+
+    keep = spec_error <= spec_tol
+    summary = f"max spec error {spec_error:.4f} (tol {spec_tol})"
+    if check_f1:
+        y_true = np.concatenate(y_true_list)
+        ref_f1 = f1_score(y_true, np.concatenate(ref_pred_list), average="binary")
+        f1 = f1_score(y_true, np.concatenate(pred_list), average="binary")
+        keep = keep and abs(f1 - ref_f1) <= f1_tol
+        summary += f", F1 {f1:.4f} vs fp32 {ref_f1:.4f} (tol {f1_tol})"
+
+    ft_extractor.precision = precision if keep else "fp32"
+    cfg.melspec.precision = ft_extractor.precision
+    if check_f1:
+        cfg.melspec.precision_checked = keep
+    if getattr(cfg.environment, "gpu", 0) == 0:
+        print(
+            f"> Frontend precision {precision}: {summary} -> "
+            + ("enabled" if keep else "refused, using fp32")
+        )
+    return keep
+
+
+def load_teacher(cfg, device):
+    """
+    Frozen teacher `AudioClassifier` from `distill.teacher_config` and
+    `distill.teacher_ckpt`, with its config.
+    """
+    teacher_cfg = dict2cfg(yaml.safe_load(open(cfg.distill.teacher_config).read()))
+    teacher = AudioClassifier(teacher_cfg)
+    checkpoint = torch.load(cfg.distill.teacher_ckpt, map_location=device)
+    state_dict = {
+        (k[len("module.") :] if k.startswith("module.") else k): v
+        for k, v in decompress_state_dict(checkpoint["model"]).items()
+    }
+    teacher.load_state_dict(state_dict)
+    teacher.to(device).eval()
+    teacher.requires_grad_(False)
+    if cfg.environment.gpu == 0:
+        print(f"> Loaded teacher from {cfg.distill.teacher_ckpt}")
+    return teacher, teacher_cfg
+
+
+def teacher_cache_key(teacher_cfg, df, cfg):
+    """
+    Short hash of what the cached teacher logits depend on: the checkpoint (path and
+    modification time), the songs of `df` in order with their skip times, and the
+    teacher's `audio` and `melspec` config.
+    """
+    ckpt = cfg.distill.teacher_ckpt
+    key = {
+        "ckpt": [os.path.abspath(ckpt), os.path.getmtime(ckpt)],
+        "filepaths": df.filepath.tolist(),
+        "skip_times": (
+            df.skip_time.tolist() if teacher_cfg.audio.skip_time else None
+        ),
+        "audio": vars(teacher_cfg.audio),
+        "melspec": vars(teacher_cfg.melspec),
+    }
+    key = json.dumps(key, sort_keys=True, default=str)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def get_teacher_logits(teacher, teacher_cfg, df, device, cfg):
+    """
+    Teacher logits for every song of `df`, computed once on the teacher's own
+    validation crop and cached to `distill.cache_path` (CSV keyed by filepath), so
+    later runs and students trained from the same teacher skip the teacher pass. The
+    `teacher_cache_key` is appended to the file name, so a new checkpoint, song list or
+    frontend config gets its own cache. With several GPUs, each rank scores a shard of
+    the songs and the logits are all-gathered.
+    """
+    cache_path = getattr(cfg.distill, "cache_path", None) or (
+        os.path.splitext(cfg.distill.teacher_ckpt)[0] + "_train_logits.csv"
+    )
+    root, ext = os.path.splitext(cache_path)
+    cache_path = f"{root}_{teacher_cache_key(teacher_cfg, df, cfg)}{ext}"
+    if os.path.exists(cache_path):
+        cache_df = pd.read_csv(cache_path)
+        logit_map = dict(zip(cache_df.filepath, cache_df.teacher_logit))
+        missing = set(df.filepath) - set(logit_map)
+        if missing:
+            raise ValueError(
+                f"{len(missing)} training songs are missing from {cache_path}, "
+                "delete it to recompute the teacher logits"
+            )
+        return df.filepath.map(logit_map).tolist()
+
+    # Every rank scores its own strided shard of the songs
+    rank = cfg.environment.rank if cfg.environment.distributed else 0
+    world_size = cfg.environment.world_size if cfg.environment.distributed else 1
+    shard = np.arange(rank, len(df), world_size)
+    shard_df = df.iloc[shard]
+    dataloader = get_dataloader(
+        shard_df.filepath.tolist(),
+        shard_df.target.tolist(),
+        skip_times=shard_df.skip_time.tolist() if teacher_cfg.audio.skip_time else None,
+        max_len=teacher_cfg.audio.max_len,
+        batch_size=teacher_cfg.validation.batch_size,
+        num_classes=teacher_cfg.num_classes,
+        train=False,
+        random_sampling=False,
+        num_workers=cfg.environment.num_workers,
+        worker_init_fn=worker_init_fn,
+        collate_fn=None,
+        distributed=False,
+        transform=(
+            WorkerFeatureExtractor(teacher_cfg)
+            if getattr(teacher_cfg.melspec, "placement", "model") == "worker"
+            else None
+        ),
+    )
+    logits = []
+    with torch.no_grad():
+        for batch in tqdm(
+            dataloader,
+            desc="Teacher",
+            ncols=150,
+            bar_format="{l_bar}{bar:5}{r_bar}",
+            disable=rank != 0,
+        ):
+            x = batch["audio"].to(device)
+            if cfg.environment.mixed_precision:
+                with autocast("cuda") if torch_amp_new else autocast():
+                    preds = teacher(x)
+            else:
+                preds = teacher(x)
+            logits.append(preds.squeeze(-1).float().cpu().numpy())
+    logits = np.concatenate(logits) if logits else np.zeros(0, dtype=np.float32)
+
+    # Put the shards back in the order of `df` on every rank
+    teacher_logits = np.zeros(len(df), dtype=np.float32)
+    if cfg.environment.distributed:
+        shards = [None] * world_size
+        dist.all_gather_object(shards, (shard, logits))
+    else:
+        shards = [(shard, logits)]
+    for idx, values in shards:
+        teacher_logits[idx] = values
+
+    if rank == 0:
+        cache_df = pd.DataFrame(
+            {"filepath": df.filepath.values, "teacher_logit": teacher_logits}
+        )
+        cache_df.to_csv(cache_path, index=False)
+        print(f"> Saved teacher logits to {cache_path}")
+    return teacher_logits.tolist()
+
+
 def arg_parser():
     parser = argparse.ArgumentParser(description="Train a model")
     parser.add_argument("--config", type=str, required=True, help="Path to config file")
@@ -286,6 +566,32 @@ def main_worker(gpu, cfg):
     cfg.dataset.num_test_real = len(test_df.query("target == 0"))
     cfg.dataset.num_test_fake = len(test_df.query("target == 1"))
 
+    # Knowledge distillation from a frozen teacher, by default through cached logits
+    teacher, distill_criterion, teacher_logits = None, None, None
+    if getattr(cfg, "distill", None) is not None:
+        teacher, teacher_cfg = load_teacher(cfg, device)
+        distill_criterion = SoftTargetLoss(
+            temperature=getattr(cfg.distill, "temperature", 1.0)
+        )
+        if getattr(cfg.distill, "cache", True):
+            teacher_logits = get_teacher_logits(
+                teacher, teacher_cfg, train_df, device, cfg
+            )
+            teacher = None  # the teacher never runs again
+            torch.cuda.empty_cache()
+        elif getattr(cfg.melspec, "placement", "model") == "worker":
+            raise ValueError(
+                "Online distillation needs `melspec.placement: model`, the teacher "
+                "runs on the student's waveforms; use `distill.cache: true` instead"
+            )
+
+    # Compute log-mel inside the DataLoader workers if requested
+    transform = (
+        WorkerFeatureExtractor(cfg)
+        if getattr(cfg.melspec, "placement", "model") == "worker"
+        else None
+    )
+
     # Load dataloaders
     train_dataloader = get_dataloader(
         train_df.filepath.tolist(),
@@ -300,6 +606,8 @@ def main_worker(gpu, cfg):
         worker_init_fn=worker_init_fn,
         collate_fn=None,
         distributed=cfg.environment.distributed,
+        transform=transform,
+        teacher_logits=teacher_logits,
     )
     valid_dataloader = get_dataloader(
         valid_df.filepath.tolist(),
@@ -314,6 +622,8 @@ def main_worker(gpu, cfg):
         worker_init_fn=worker_init_fn,
         collate_fn=None,
         distributed=cfg.environment.distributed,
+        transform=transform,
+        return_length=getattr(cfg.model, "padding_mask", False),
     )
     test_dataloader = get_dataloader(
         test_df.filepath.tolist(),
@@ -328,20 +638,59 @@ def main_worker(gpu, cfg):
         worker_init_fn=worker_init_fn,
         collate_fn=None,
         distributed=cfg.environment.distributed,
+        transform=transform,
+        return_length=getattr(cfg.model, "padding_mask", False),
     )
 
     # Load model
     model = AudioClassifier(cfg)
     model.to(device)
 
+    # Initialize from trained weights without resuming the run, e.g. to convert a
+    # softmax checkpoint to `model.attn_type: "linear"` with a short fine-tune
+    init_ckpt = getattr(cfg.model, "init_ckpt", None)
+    if init_ckpt and not cfg.model.resume:
+        checkpoint = torch.load(init_ckpt, map_location=device)
+        state_dict = {
+            (k[len("module.") :] if k.startswith("module.") else k): v
+            for k, v in decompress_state_dict(checkpoint["model"]).items()
+        }
+        missing, unexpected = model.load_state_dict(state_dict, strict=False)
+        if cfg.environment.gpu == 0:
+            print(f"> Initialized weights from {init_ckpt}")
+            if missing or unexpected:
+                print(f"> Missing keys: {missing}\n> Unexpected keys: {unexpected}")
+
+    # Check the reduced precision frontend's spectrograms before training runs it, the
+    # F1 check follows with the trained weights
+    if uses_frontend_precision(cfg):
+        if cfg.environment.gpu == 0:
+            print("\n> Frontend Precision Check (spectrogram only):")
+        check_frontend_precision(model, valid_dataloader, device, cfg, check_f1=False)
+
     # Profile model
     if cfg.environment.gpu == 0:
         print("\n> Model Profile:")
-        input_tensor = torch.randn((cfg.training.batch_size, cfg.audio.max_len)).to(
-            device
-        )
+        input_tensor = get_example_input(cfg, cfg.training.batch_size).to(device)
         profile_df = profile_model(model, input_tensor, display=True)
 
+    # Channels-last timm encoders: fixed input shapes, so let cuDNN pick conv kernels
+    if model.channels_last:
+        torch.backends.cudnn.benchmark = True
+        if cfg.environment.gpu == 0:
+            print("\n> Fused Layers:")
+            fused_layer_report(display=True)
+
+    # Compile the frontend and encoder, augmentation stays eager between them
+    if getattr(cfg.environment, "compile", False):
+        if cfg.environment.gpu == 0:
+            print("\n> Graph Breaks:")
+            graph_break_report(model, input_tensor, display=True)
+        model.set_compile(
+            mode=getattr(cfg.environment, "compile_mode", "default"),
+            dynamic=getattr(cfg.environment, "compile_dynamic", None),
+        )
+
     # Distributed Model
     if cfg.environment.distributed:
         model = torch.nn.parallel.DistributedDataParallel(
@@ -445,6 +794,8 @@ def main_worker(gpu, cfg):
             device,
             cfg,
             scheduler,
+            teacher=teacher,
+            distill_criterion=distill_criterion,
         )
         (
             val_loss,
@@ -558,6 +909,28 @@ def main_worker(gpu, cfg):
         )
         model.load_state_dict(checkpoint["model"])
 
+        # Check the reduced precision frontend against the trained weights before the
+        # test run and the inference checkpoint rely on it
+        if uses_frontend_precision(cfg):
+            print("> Frontend Precision Check:")
+            check_frontend_precision(model, valid_dataloader, device, cfg)
+
+        # Save inference-only best checkpoint: no optimizer state, fp32/fp16/int8 weights
+        weight_format = getattr(cfg.logger, "inference_checkpoint", None)
+        if weight_format:
+            inference_checkpoint = {
+                "model": compress_state_dict(unwrap(model), weight_format),
+                "epoch": checkpoint["epoch"],
+                "best_metric": checkpoint["best_metric"],
+            }
+            torch.save(
+                inference_checkpoint,
+                f"output/{cfg.experiment_name}/best_model_{weight_format}.pth",
+            )
+            print(
+                f"> Saved inference checkpoint to output/{cfg.experiment_name}/best_model_{weight_format}.pth"
+            )
+
         # Test loop
         (
             test_loss,